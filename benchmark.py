@@ -0,0 +1,533 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+清掃スケジュール Excel変換ツール ベンチマーク
+変換パイプラインの各段階の処理時間とピークメモリを計測します（ネットワーク不要）
+
+使い方:
+    python benchmark.py                  # 計測してベースラインと比較
+    python benchmark.py --quick          # 小さいケースだけ計測
+    python benchmark.py --save-baseline  # 計測結果をベースラインとして保存
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import random
+import argparse
+import tempfile
+import tracemalloc
+import contextlib
+from pathlib import Path
+
+# main.py と同じディレクトリから読み込む
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fitz  # PyMuPDF
+from PIL import Image, ImageDraw, ImageEnhance, ImageFont
+
+import main
+
+DEFAULT_BASELINE_FILE = "benchmark_baseline.json"
+DEFAULT_THRESHOLD = 1.25  # ベースラインに対してこの倍率を超えたら劣化とみなす
+RECORDED_RESPONSE = Path(__file__).resolve().parent / "debug_output" / "claude_response.txt"
+
+# PDFのページサイズ（ポイント）
+PAGE_SIZES = {
+    'A4': (595, 842),
+    'A3': (842, 1191),
+}
+
+# 1ページの画像化・エンコードで許容するピークメモリ（MB、tracemalloc で計測できる Python 側の確保量）
+# 並列・一括変換ではワーカー数だけ同時に確保されるため、ベースラインとは別に上限を設ける
+MEMORY_CEILINGS_MB = {
+    'render/A4@300dpi': 12,
+    'render/A3@300dpi': 24,
+    # 既定の予算では表の範囲を検出して切り抜く（検出は長辺 1000px に縮小して行うため、ページの大きさによらず一定）
+    'render/A4@budget': 16,
+    'render/A3@budget': 16,
+    'render/A4@budget_uncropped': 4,
+    'render/A3@budget_uncropped': 4,
+    'encode/prepared_4mp': 4,
+    'encode/prepared_12mp': 4,
+    # 表の検出は長辺 1000px に縮小した画像で行うため、写真の大きさによらず一定
+    'crop/table_photo_4mp': 20,
+    'crop/table_photo_12mp': 20,
+    # 行を保持せずに書き出す出力形式は、行数によらず一定
+    'export/xlsx_stream/1000rows': 4,
+    'export/xlsx_stream/100000rows': 4,
+    'export/csv/100000rows': 1,
+    'export/jsonl/100000rows': 1,
+}
+
+
+class _StubMessage:
+    """Anthropic のレスポンス（Message）の代わり"""
+
+    def __init__(self, text):
+        self.content = [type('TextBlock', (), {'type': 'text', 'text': text})()]
+        self.stop_reason = "end_turn"
+        self.usage = type('Usage', (), {'input_tokens': 0, 'output_tokens': 0})()
+
+
+class _StubStream:
+    """messages.stream() の代わり（記録済みのテキストを小分けに返す）"""
+
+    def __init__(self, text, chunk_size):
+        self._text = text
+        self._chunk_size = chunk_size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    @property
+    def text_stream(self):
+        for i in range(0, len(self._text), self._chunk_size):
+            yield self._text[i:i + self._chunk_size]
+
+    def get_final_message(self):
+        return _StubMessage(self._text)
+
+
+class _StubMessages:
+    def __init__(self, text, chunk_size):
+        self._text = text
+        self._chunk_size = chunk_size
+
+    def create(self, **request):
+        return _StubMessage(self._text)
+
+    def stream(self, **request):
+        return _StubStream(self._text, self._chunk_size)
+
+
+class StubAnthropicClient:
+    """記録済みのレスポンスを返す Anthropic クライアントの代わり"""
+
+    def __init__(self, text, chunk_size=16):
+        self.messages = _StubMessages(text, chunk_size)
+
+
+def make_table(rows, columns=12):
+    """ベンチマーク用の表データを作成"""
+    names = [f"列{i}" for i in range(1, columns + 1)]
+    return {
+        'title': "清掃作業基準書（ベンチマーク）",
+        'columns': names,
+        'rows': [
+            {name: f"{r}-{c} 週2回" for c, name in enumerate(names)}
+            for r in range(rows)
+        ],
+    }
+
+
+def make_pdf(path, page_size, rows=40, columns=8):
+    """罫線と文字を含む表のPDFを作成"""
+    width, height = page_size
+    doc = fitz.open()
+    page = doc.new_page(width=width, height=height)
+    margin = 36
+    row_height = (height - margin * 2) / rows
+    col_width = (width - margin * 2) / columns
+    for r in range(rows + 1):
+        y = margin + r * row_height
+        page.draw_line((margin, y), (width - margin, y))
+    for c in range(columns + 1):
+        x = margin + c * col_width
+        page.draw_line((x, margin), (x, height - margin))
+    for r in range(rows):
+        for c in range(columns):
+            page.insert_text((margin + c * col_width + 2, margin + (r + 0.7) * row_height),
+                             f"R{r}C{c}", fontsize=min(8, row_height * 0.6))
+    doc.save(path)
+    doc.close()
+
+
+def make_photo(path, megapixels):
+    """写真に近い（圧縮しにくい）大きなJPEG画像を作成"""
+    width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    height = int(width * 3 / 4)
+    img = Image.effect_noise((width, height), 64).convert('RGB')
+    draw = ImageDraw.Draw(img)
+    for y in range(0, height, 60):
+        draw.line((0, y, width, y), fill='black', width=3)
+    img.save(path, format='JPEG', quality=92)
+
+
+def make_table_photo(path, megapixels, angle=2.0, rows=20, columns=6):
+    """壁の前で少し傾けて撮った表の写真に近いJPEG画像を作成（表は画像の中央の一部）"""
+    width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    height = int(width * 3 / 4)
+    img = Image.effect_noise((width, height), 24).convert('RGB')
+    table = Image.new('RGB', (width // 3, height // 2), 'white')
+    draw = ImageDraw.Draw(table)
+    row_height = (table.height - 1) / rows
+    col_width = (table.width - 1) / columns
+    for r in range(rows + 1):
+        draw.line((0, round(r * row_height), table.width, round(r * row_height)), fill='black', width=3)
+    for c in range(columns + 1):
+        draw.line((round(c * col_width), 0, round(c * col_width), table.height), fill='black', width=3)
+    for r in range(rows):
+        for c in range(columns):
+            draw.text((c * col_width + 8, r * row_height + 8), f"R{r}C{c}", fill='black')
+    table = table.rotate(angle, expand=True, fillcolor=(128, 128, 128))
+    img.paste(table, ((width - table.width) // 2, (height - table.height) // 2))
+    img.save(path, format='JPEG', quality=92)
+
+
+# 類似画像の判定に使う、同じ罫線の表に入る値（空欄・「-」が多いのは実際の当番表と同じ）
+SCHEDULE_WORDS = ["Tanaka", "Suzuki", "Sato", "Ito", "Watanabe", "OK", "10:00", "x", "-", "", ""]
+
+
+def make_schedule_scan(seed, rows=22, columns=8, size=(1240, 1754)):
+    """A4を150dpiでスキャンした当番表に近い画像を作成（seed が違えば、同じ罫線で中身の違う表になる）"""
+    rnd = random.Random(seed)
+    img = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(img)
+    font = ImageFont.load_default(size=22)
+    draw.text((120, 80), "Cleaning schedule 2025", fill='black', font=ImageFont.load_default(size=40))
+    left, top, right, bottom = 100, 180, size[0] - 100, size[1] - 200
+    row_height = (bottom - top) / rows
+    col_width = (right - left) / columns
+    for r in range(rows + 1):
+        draw.line((left, round(top + r * row_height), right, round(top + r * row_height)), fill='black', width=2)
+    for c in range(columns + 1):
+        draw.line((round(left + c * col_width), top, round(left + c * col_width), bottom), fill='black', width=2)
+    for c in range(columns):
+        draw.text((left + c * col_width + 10, top + 10), f"Area{c}", fill='black', font=font)
+    for r in range(1, rows):
+        for c in range(columns):
+            draw.text((left + c * col_width + 10, top + r * row_height + 10), rnd.choice(SCHEDULE_WORDS),
+                      fill='black', font=font)
+    return img
+
+
+def make_photo_of(img, angle, offset=(0, 0)):
+    """紙を壁に貼って撮り直した写真に近い画像を作成"""
+    width, height = 2000, 1500
+    photo = ImageEnhance.Brightness(Image.effect_noise((width, height), 24).convert('RGB')).enhance(0.7)
+    sheet = img.resize((round(img.width * 0.55), round(img.height * 0.55)), Image.Resampling.LANCZOS)
+    sheet = sheet.rotate(angle, expand=True, fillcolor=(90, 90, 90))
+    photo.paste(sheet, ((width - sheet.width) // 2 + offset[0], (height - sheet.height) // 2 + offset[1]))
+    return photo
+
+
+def rescan_variants(img):
+    """同じ紙を読み直したときに起こる違い（名前 → 画像、JPEG の画質は保存時に指定）"""
+    def noisy(image):
+        return Image.blend(image, Image.effect_noise(image.size, 12).convert('RGB'), 0.08)
+
+    def shifted(image, dx, dy):
+        moved = Image.new('RGB', image.size, 'white')
+        moved.paste(image, (dx, dy))
+        return moved
+
+    return {
+        'jpeg_q70': (img, 70),
+        'darker_20': (ImageEnhance.Brightness(img).enhance(0.8), 92),
+        'rotate_0.5_noise': (noisy(img.rotate(0.5, resample=Image.Resampling.BICUBIC, fillcolor='white')), 92),
+        'rotate_-1.5_noise': (noisy(img.rotate(-1.5, resample=Image.Resampling.BICUBIC, fillcolor='white')), 92),
+        'shift_10px': (shifted(img, 10, 10), 92),
+        'shift_30px_low_contrast': (ImageEnhance.Contrast(shifted(img, -30, 20)).enhance(0.7), 92),
+        'rescan_100dpi': (img.resize((827, 1169), Image.Resampling.LANCZOS), 92),
+    }
+
+
+def check_duplicate_threshold(workdir, quick=False):
+    """読み直した同じ表と、同じ罫線の別の表の類似度を測り、既定のしきい値で分けられるかを返す
+
+    戻り値は（結果の辞書, しきい値で分けられたか）です。
+    """
+    def hashes(img, name, quality=92):
+        path = os.path.join(workdir, f"{name}.jpg")
+        img.save(path, format='JPEG', quality=quality)
+        return main.source_image_hashes(path)
+
+    tables = [make_schedule_scan(seed) for seed in range((4 if quick else 8))]
+    scans = [hashes(img, f"schedule_{index}") for index, img in enumerate(tables)]
+    same = {}
+    for index, img in enumerate(tables[:(1 if quick else 3)]):
+        for name, (variant, quality) in rescan_variants(img).items():
+            same.setdefault(name, []).append(
+                main.hash_similarity(scans[index], hashes(variant, f"schedule_{index}_{name}", quality)))
+        first = hashes(make_photo_of(img, 2.0), f"schedule_{index}_photo", 85)
+        second = hashes(make_photo_of(img, -1.0, (40, -30)), f"schedule_{index}_photo_retake", 85)
+        same.setdefault('photo_retake', []).append(main.hash_similarity(first, second))
+    different = [main.hash_similarity(scans[i], scans[j])
+                 for i in range(len(scans)) for j in range(i + 1, len(scans))]
+
+    result = {
+        'threshold': main.DEFAULT_DUPLICATE_THRESHOLD,
+        'same_min': min(min(values) for values in same.values()),
+        'different_max': max(different),
+        'same': {name: min(values) for name, values in same.items()},
+    }
+    separated = result['different_max'] < result['threshold'] <= result['same_min']
+    return result, separated
+
+
+def print_duplicate_report(result, separated):
+    """類似画像のしきい値の確認結果を表示"""
+    print(f"\n類似画像の類似度（しきい値 {result['threshold']:.2f}）:")
+    for name, similarity in result['same'].items():
+        print(f"  同じ表: {name:<28}{similarity:.3f}")
+    print(f"  同じ表の最小値 {result['same_min']:.3f} / 同じ罫線の別の表の最大値 {result['different_max']:.3f}")
+    if not separated:
+        print("  既定のしきい値では、読み直した同じ表と別の表を分けられません")
+
+
+def build_cases(workdir, quick=False):
+    """計測するケースの一覧（名前, 段階, 関数）を作成"""
+    cases = []
+
+    # 1. PDFページの画像化（変換時と同じく、プロセスプールや単一ページの解析が使う関数で計測する）
+    budget = main.image_budget_from_config({})
+    for size_name, page_size in PAGE_SIZES.items():
+        pdf_path = os.path.join(workdir, f"{size_name}.pdf")
+        make_pdf(pdf_path, page_size)
+        for dpi in ((150,) if quick else (150, 300)):
+            cases.append((
+                f"render/{size_name}@{dpi}dpi", "render",
+                lambda p=pdf_path, d=dpi: main.pdf_page_to_image_base64(
+                    p, 1, max_bytes=20 * 1024 * 1024, max_tokens=10 ** 9, max_long_edge=10 ** 6, dpi=d),
+            ))
+        cases.append((
+            f"render/{size_name}@budget", "render",
+            lambda p=pdf_path: main.pdf_page_to_image_base64(p, 1, **budget),
+        ))
+        cases.append((
+            f"render/{size_name}@budget_uncropped", "render",
+            lambda p=pdf_path: main.pdf_page_to_image_base64(p, 1, **dict(budget, table_crop=False)),
+        ))
+
+    # 2. 大きな画像のBase64エンコード
+    for megapixels in ((4,) if quick else (4, 12)):
+        photo_path = os.path.join(workdir, f"photo_{megapixels}mp.jpg")
+        make_photo(photo_path, megapixels)
+        cases.append((
+            f"encode/raw_{megapixels}mp", "encode",
+            lambda p=photo_path: base64.standard_b64encode(Path(p).read_bytes()).decode('utf-8'),
+        ))
+        cases.append((
+            f"encode/prepared_{megapixels}mp", "encode",
+            lambda p=photo_path: main.load_image_base64(p),
+        ))
+
+    # 3. 表の範囲の検出・切り抜き（写真全体を送る場合と比較する）
+    for megapixels in ((4,) if quick else (4, 12)):
+        photo_path = os.path.join(workdir, f"table_photo_{megapixels}mp.jpg")
+        make_table_photo(photo_path, megapixels)
+        cases.append((
+            f"crop/table_photo_{megapixels}mp", "crop",
+            lambda p=photo_path: main.load_image_base64(p, table_crop=True),
+        ))
+        cases.append((
+            f"crop/table_photo_{megapixels}mp_uncropped", "crop",
+            lambda p=photo_path: main.load_image_base64(p),
+        ))
+
+    # 4. レスポンスのJSON抽出（記録済みレスポンス＋大きな合成レスポンス）
+    responses = {}
+    if RECORDED_RESPONSE.exists():
+        responses['recorded'] = RECORDED_RESPONSE.read_text(encoding='utf-8')
+    responses['synthetic_500rows'] = "```json\n" + json.dumps(make_table(500), ensure_ascii=False) + "\n```"
+    compact = make_table(500)
+    compact['rows'] = [list(row.values()) for row in compact['rows']]
+    responses['synthetic_500rows_compact'] = json.dumps(compact, ensure_ascii=False)
+    for name, text in responses.items():
+        for stream in (False, True):
+            engine = main.ConversionEngine("offline", client=StubAnthropicClient(text), stream=stream)
+            label = "stream" if stream else "create"
+            cases.append((
+                f"parse/{name}_{label}", "parse",
+                lambda e=engine: e.analyze_with_claude("", on_row=lambda row, count: None),
+            ))
+
+    # 5. Excel生成
+    output_dir = os.path.join(workdir, "excel")
+    engine = main.ConversionEngine("offline", output_dir=output_dir)
+    for rows in ((100, 1000) if quick else (100, 1000, 10000, 100000)):
+        table = make_table(rows)
+        cases.append((
+            f"excel/{rows}rows", "excel",
+            lambda t=table: os.remove(engine.generate_excel(t, "benchmark.xlsx")),
+        ))
+
+    # 6. 出力形式ごとの書き出し（行/秒で比較する）
+    formats = [name for name in main.EXPORTERS if name != 'parquet' or has_pyarrow()]
+    for rows in ((1000,) if quick else (1000, 10000, 100000)):
+        table = make_table(rows)
+        for output_format in formats:
+            cases.append((
+                f"export/{output_format}/{rows}rows", "export",
+                lambda t=table, f=output_format: os.remove(engine.export(t, "benchmark.png", output_format=f)),
+            ))
+
+    # 7. 類似画像の検出用ハッシュ（表の範囲の検出＋pHash・dHash）
+    scan_path = os.path.join(workdir, "schedule_scan.jpg")
+    make_schedule_scan(0).save(scan_path, format='JPEG', quality=92)
+    cases.append((
+        "duplicate/hash_scan", "duplicate",
+        lambda p=scan_path: main.source_image_hashes(p),
+    ))
+
+    return cases
+
+
+def has_pyarrow():
+    """Parquet の出力に必要な pyarrow があるか"""
+    try:
+        main._import_pyarrow()
+        return True
+    except ImportError:
+        return False
+
+
+def case_rows(name):
+    """ケース名に含まれる行数（例: "export/csv/1000rows" → 1000、含まない場合は None）"""
+    last = name.rsplit("/", 1)[-1]
+    if last.endswith("rows") and last[:-len("rows")].isdigit():
+        return int(last[:-len("rows")])
+    return None
+
+
+def measure(func, repeat, with_memory=True):
+    """関数の実行時間（最小値）とピークメモリを計測"""
+    func()  # ウォームアップ
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+
+    # tracemalloc は処理を遅くするため、時間とは別に1回だけ計測する
+    peak_mb = None
+    if with_memory:
+        tracemalloc.start()
+        try:
+            func()
+            peak_mb = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        finally:
+            tracemalloc.stop()
+
+    return {'seconds': min(timings), 'peak_mb': peak_mb}
+
+
+def compare(results, baseline, threshold):
+    """ベースラインと比較して、劣化したケース名のリストを返す"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for key in ('seconds', 'peak_mb'):
+            if result.get(key) is None or not base.get(key):
+                continue
+            ratio = result[key] / base[key]
+            result[f"{key}_ratio"] = ratio
+            if ratio > threshold:
+                regressions.append(f"{name} ({key}: x{ratio:.2f})")
+    return regressions
+
+
+def check_memory_ceilings(results):
+    """ピークメモリが上限を超えたケース名のリストを返す"""
+    exceeded = []
+    for name, ceiling in MEMORY_CEILINGS_MB.items():
+        peak = results.get(name, {}).get('peak_mb')
+        if peak is not None and peak > ceiling:
+            exceeded.append(f"{name} ({peak:.1f}MB > {ceiling}MB)")
+    return exceeded
+
+
+def print_report(results):
+    """計測結果を表形式で表示"""
+    print(f"{'ケース':<40}{'時間[ms]':>12}{'ピーク[MB]':>12}{'行/秒':>12}{'時間比':>9}{'メモリ比':>9}")
+    for name, result in results.items():
+        peak = f"{result['peak_mb']:.1f}" if result['peak_mb'] is not None else "-"
+        rows = case_rows(name)
+        throughput = f"{rows / result['seconds']:,.0f}" if rows and result['seconds'] else "-"
+        time_ratio = f"x{result['seconds_ratio']:.2f}" if 'seconds_ratio' in result else "-"
+        memory_ratio = f"x{result['peak_mb_ratio']:.2f}" if 'peak_mb_ratio' in result else "-"
+        print(f"{name:<40}{result['seconds'] * 1000:>12.1f}{peak:>12}{throughput:>12}{time_ratio:>9}{memory_ratio:>9}")
+
+
+def parse_args(argv=None):
+    """コマンドライン引数を解析"""
+    parser = argparse.ArgumentParser(description="変換パイプラインのベンチマーク（ネットワーク不要）")
+    parser.add_argument('--quick', action='store_true', help="小さいケースだけ計測する")
+    parser.add_argument('--stage', action='append', choices=('render', 'encode', 'crop', 'parse', 'excel', 'export', 'duplicate'),
+                        help="計測する段階（複数指定可、既定: すべて）")
+    parser.add_argument('--repeat', type=int, default=3, help="各ケースの繰り返し回数（既定: 3）")
+    parser.add_argument('--no-memory', action='store_true', help="ピークメモリを計測しない")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_FILE,
+                        help=f"ベースラインのファイル（既定: {DEFAULT_BASELINE_FILE}）")
+    parser.add_argument('--save-baseline', action='store_true', help="計測結果をベースラインとして保存する")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help=f"劣化とみなす倍率（既定: {DEFAULT_THRESHOLD}）")
+    return parser.parse_args(argv)
+
+
+def run(args):
+    """ベンチマークを実行して終了コードを返す"""
+    baseline_path = Path(args.baseline).resolve()
+    results = {}
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # デバッグ出力などを作業ディレクトリに書き出させるため移動する
+        previous_cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                cases = build_cases(workdir, quick=args.quick)
+            for name, stage, func in cases:
+                if args.stage and stage not in args.stage:
+                    continue
+                with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                    results[name] = measure(func, args.repeat, with_memory=not args.no_memory)
+                print(f"計測完了: {name}", file=sys.stderr)
+            duplicate_check = None
+            if not args.stage or 'duplicate' in args.stage:
+                duplicate_check = check_duplicate_threshold(workdir, quick=args.quick)
+        finally:
+            os.chdir(previous_cwd)
+
+    regressions = []
+    if baseline_path.exists() and not args.save_baseline:
+        baseline = json.loads(baseline_path.read_text(encoding='utf-8'))
+        regressions = compare(results, baseline, args.threshold)
+
+    print_report(results)
+    
+    exceeded = check_memory_ceilings(results)
+    if exceeded:
+        print("\nピークメモリの上限を超えたケース:")
+        for case in exceeded:
+            print(f"  - {case}")
+
+    if duplicate_check is not None:
+        print_duplicate_report(*duplicate_check)
+        if not duplicate_check[1]:
+            exceeded.append("duplicate/threshold")
+
+    if args.save_baseline:
+        baseline_path.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding='utf-8')
+        print(f"\nベースラインを保存しました: {baseline_path}")
+        return 1 if exceeded else 0
+
+    if regressions:
+        print(f"\n性能が劣化したケース（x{args.threshold} 超）:")
+        for regression in regressions:
+            print(f"  - {regression}")
+        return 1
+    return 1 if exceeded else 0
+
+
+if __name__ == "__main__":
+    sys.exit(run(parse_args()))
@@ -11,24 +11,4697 @@ import json
 import base64
 import threading
 import io
+import math
+import time
+import random
+import asyncio
+import hashlib
+import types
+import logging
+import sqlite3
+import queue
+import contextvars
+import weakref
+import csv
+import re
+import struct
+import zlib
+import zipfile
+import contextlib
+import functools
+import abc
+from copy import copy
+from collections import OrderedDict
+from logging.handlers import RotatingFileHandler
+import glob
+import argparse
+import multiprocessing
+import concurrent.futures
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
+from xml.sax.saxutils import escape as xml_escape
+
+# 起動時間の計測開始（標準ライブラリ以外の読み込みより前）
+_MODULE_START = time.perf_counter()
+
 from tkinter import filedialog, messagebox
 import customtkinter as ctk
-from PIL import Image, ImageTk
-import anthropic
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Border, Side, Alignment
-from openpyxl.utils import get_column_letter
-import fitz  # PyMuPDF
+from PIL import Image, ImageOps, ImageChops, ImageFilter, ImageStat
+
+
+class LazyModule:
+    """初回アクセス時に読み込むモジュール
+    
+    anthropic / openpyxl / PyMuPDF は読み込みに時間がかかるため、起動時には読み込まず
+    最初に使うとき（またはウィンドウ表示後のバックグラウンド読み込み）に読み込みます。
+    """
+    
+    def __init__(self, name, loader):
+        self._name = name
+        self._loader = loader
+        self._module = None
+        self._lock = threading.Lock()
+    
+    def load(self):
+        """モジュールを読み込んで返す（読み込み済みならそのまま返す）"""
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    started = time.perf_counter()
+                    module = self._loader()
+                    startup_timings[f"import:{self._name}"] = time.perf_counter() - started
+                    self._module = module
+        return self._module
+    
+    @property
+    def loaded(self):
+        return self._module is not None
+    
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+
+# import文は関数内に書く（PyInstaller が依存モジュールとして検出できるように）
+def _import_anthropic():
+    import anthropic
+    return anthropic
+
+
+def _import_openpyxl():
+    import openpyxl
+    import openpyxl.cell
+    import openpyxl.styles
+    import openpyxl.utils
+    return openpyxl
+
+
+def _import_fitz():
+    import fitz  # PyMuPDF
+    return fitz
+
+
+def _import_image_tk():
+    from PIL import ImageTk
+    return ImageTk
+
+
+def _import_numpy():
+    import numpy
+    return numpy
+
+
+def _import_pyarrow():
+    # 任意の依存ライブラリ（Parquet で出力する場合だけ必要）
+    import pyarrow
+    import pyarrow.parquet
+    return pyarrow, pyarrow.parquet
+
+
+def _import_watchdog():
+    # 任意の依存ライブラリ（なければフォルダ監視は走査で行う）
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+    return Observer, FileSystemEventHandler
+
+
+# 起動時間・読み込み時間の計測結果（秒）
+startup_timings = {}
+
+anthropic = LazyModule("anthropic", _import_anthropic)
+openpyxl = LazyModule("openpyxl", _import_openpyxl)
+fitz = LazyModule("fitz", _import_fitz)
+ImageTk = LazyModule("PIL.ImageTk", _import_image_tk)
+np = LazyModule("numpy", _import_numpy)
+PRELOAD_MODULES = (anthropic, openpyxl, fitz, ImageTk, np)
+
+# アプリケーション設定
+APP_TITLE = "清掃スケジュール Excel変換ツール"
+APP_VERSION = "1.0.0"
+CONFIG_FILE = "config.json"
+STARTUP_BUDGET_MS = 1500  # ウィンドウ表示までの目標時間
+DEFAULT_MODEL = "claude-sonnet-4-5"
+
+# 対応ファイル形式
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+PDF_EXTENSIONS = ('.pdf',)
+SUPPORTED_EXTENSIONS = IMAGE_EXTENSIONS + PDF_EXTENSIONS
+
+# 応答の形式（"compact": 行を値の配列で出力 / "objects": 行を列名付きのオブジェクトで出力）
+DEFAULT_RESPONSE_SCHEMA = "compact"
+
+# 一括変換の同時実行数（API呼び出しが中心のためスレッドで並列化）
+DEFAULT_BATCH_WORKERS = 4
+
+# API呼び出し
+MAX_OUTPUT_TOKENS = 8000  # 1回の解析で出力できるトークン数の上限（表の大きさが分からない場合）
+EXPECTED_OUTPUT_TOKENS = 3000  # レート制限の見積もりに使う出力トークン数（応答後に実際の値で精算）
+MAX_OUTPUT_TOKENS_CEILING = 20000  # 表の大きさから決める上限の最大値（ストリーミングしない呼び出しでも使える範囲）
+OUTPUT_TOKENS_PER_CELL = {'compact': 10, 'objects': 18}  # 応答形式ごとの1セルあたりの出力トークン数の目安
+OUTPUT_TOKENS_OVERHEAD = 200  # タイトル・列名などの出力トークン数の目安
+OUTPUT_TOKENS_MARGIN = 1.3  # 見込みに対する上限の余裕
+GRID_DEFAULT_COLUMNS = 8  # 縦罫線がなく列数が分からない表の列数の目安
+MAX_CONTINUATIONS = 4  # 出力が上限で途切れたときに続きを要求する回数の上限
+DEFAULT_API_CONCURRENCY = 8  # 同時に実行するAPI呼び出しの上限
+
+# レート制限（アカウントの上限に合わせて config.json で変更する）
+DEFAULT_RATE_LIMIT_RPM = 50  # 1分あたりのリクエスト数
+DEFAULT_RATE_LIMIT_INPUT_TPM = 30000  # 1分あたりの入力トークン数
+DEFAULT_RATE_LIMIT_OUTPUT_TPM = 8000  # 1分あたりの出力トークン数
+
+# 再試行（429/529・一時的な通信エラー）
+DEFAULT_MAX_RETRIES = 5
+RETRY_BASE_DELAY = 1.0  # 秒（試行ごとに2倍、ジッター付き）
+RETRY_MAX_DELAY = 60.0
+RETRYABLE_STATUS_CODES = (408, 409, 429, 500, 502, 503, 504, 529)
+
+# API の接続（API キーごとに1つのクライアントを共有し、接続をプールして使い回す）
+HTTP_MAX_CONNECTIONS = 20  # 同時に開く接続数の上限
+HTTP_KEEPALIVE_CONNECTIONS = 10  # 使い終わった後も開いたままにしておく接続数
+HTTP_KEEPALIVE_SECONDS = 60  # 使われない接続を開いたままにしておく秒数
+HTTP_CONNECT_TIMEOUT = 10  # 秒
+HTTP_READ_TIMEOUT = 600  # 秒（長い表の応答を待てるように）
+
+# 複数ページPDFの同時解析数（ページの描画はCPUコア数のプロセスで並列化）
+DEFAULT_PAGE_WORKERS = 4
+PDF_RENDER_DPI = 300  # PDF描画の最大解像度
+
+# アップロード画像の予算
+# Claude は長辺 1568px を超える画像を縮小して扱うため、それ以上の解像度は送っても意味がない
+MAX_IMAGE_LONG_EDGE = 1568
+DEFAULT_IMAGE_MAX_KB = 1500
+DEFAULT_IMAGE_MAX_TOKENS = 1600  # 画像トークン数 ≒ 幅 × 高さ / 750
+JPEG_QUALITY_STEPS = (90, 80, 70, 60)
+BASE64_CHUNK_BYTES = 3 * 64 * 1024  # Base64 で区切りが揃うよう3の倍数
+PDF_PROBE_LONG_EDGE = 256  # 色の判定用に試し描きするときの長辺（px）
+
+# 表の範囲の切り抜き（写真の壁・床・余白を送らない）
+DEFAULT_TABLE_CROP = True
+TABLE_DETECT_LONG_EDGE = 1000  # 検出に使う縮小画像の長辺（px）
+TABLE_DARK_CONTRAST = 20  # 周囲の平均よりこれだけ暗い画素を線・文字とみなす
+TABLE_LINE_MIN_RUN = 1 / 30  # 罫線とみなす連続した画素の長さ（画像の幅・高さに対する割合）
+TABLE_LINE_MIN_LENGTH = 0.15  # 罫線の行・列とみなす画素の合計（同上）
+TABLE_MIN_LINES = 3  # 表とみなす横罫線の最少本数
+TABLE_EXTEND_ROWS = 3  # 表の上下に続く文字（タイトル・備考）を含める範囲（行の高さの何倍か）
+TABLE_CROP_MARGIN = 0.015  # 切り抜くときに残す余白（画像の幅・高さに対する割合）
+TABLE_CROP_MAX_AREA = 0.9  # 表が画像のこれ以上を占めていれば切り抜かない
+TABLE_SKEW_MAX_DEGREES = 5.0
+TABLE_SKEW_STEP_DEGREES = 0.25
+TABLE_SKEW_FINE_STEP_DEGREES = 0.05
+TABLE_DESKEW_MIN_DEGREES = 0.3  # これより小さい傾きは補正しない
+TABLE_SKEW_SAMPLE_PIXELS = 200_000
+TABLE_SKEW_MAX_THICKNESS = 3  # 傾きの検出に使う線の太さの上限（検出用の縮小画像の px）
+
+# 大きな表の分割解析（行の境界で帯に分け、並列に解析して結合する）
+DEFAULT_TILING = "auto"  # "auto" / "on" / "off"
+TILE_MIN_SCALE = 0.5  # これ以上縮小しないと送れない画像は分割する
+TILE_MAX_ROWS = 40  # 1回の解析で読み取る行数の目安
+TILE_MAX_COUNT = 8
+
+TILE_PROMPT_NOTE = """
+
+【補足】この画像は大きな表を行ごとに分割した一部です。先頭には表の見出し部分を付けています。
+見出しの列名を "columns" とし、この画像に写っているデータ行だけを "rows" に出力してください。"""
+
+# プレビュー（バックグラウンドで縮小表示用の画像を作成し、最近のものをメモリに保持する）
+PREVIEW_MAX_SIZE = (600, 450)
+PREVIEW_CACHE_SIZE = 16
+
+# GUI のジョブ一覧（変換スレッドはイベントバスに通知を積むだけで、画面は一定間隔でまとめて反映する）
+GUI_MAX_CONCURRENT_JOBS = 4  # 同時に変換するファイル数（それ以上は待機）
+UI_POLL_INTERVAL_MS = 16  # 画面に反映する間隔（約60Hz）
+UI_MAX_EVENTS_PER_POLL = 500  # 1回に反映するイベント数の上限（残りは次回に回す）
+GUI_JOB_WAIT_INTERVAL = 0.1  # 待機中のジョブが中止されたかを確認する間隔（秒）
+
+# 解析結果キャッシュ（同じ画像・プロンプト・モデルの再解析を省略）
+CACHE_DIR = "cache"
+DEFAULT_CACHE_MAX_MB = 200
+DEFAULT_CACHE_MAX_AGE_DAYS = 90
+CACHE_AGE_CHECK_INTERVAL = 60 * 60  # 保存期間切れのエントリを探す間隔（秒、容量を超えたときは間隔によらず探す）
+CACHE_EVICT_TARGET = 0.9  # 容量を超えたときは上限のこの割合まで削除する（保存のたびに数え直さないように）
+
+# 類似画像の検出（再スキャン・撮り直しの画像は以前の解析結果を再利用する）
+DUPLICATE_INDEX_DIR = "cache/duplicates"
+DEFAULT_DUPLICATE_MODE = "ask"  # "ask"（確認する）/ "auto"（自動で再利用）/ "off"
+DEFAULT_DUPLICATE_THRESHOLD = 0.85  # 類似度（pHash・dHash で一致するビットの割合の平均、benchmark.py の duplicate で確認）
+DUPLICATE_HASH_SIZE = 16  # pHash・dHash の1辺（それぞれ 16×16 = 256ビット）
+DEFAULT_DUPLICATE_MAX_ENTRIES = 5000
+
+# 計測ログ（変換ごとの段階別時間・トークン数などを JSONL で記録）
+METRICS_FILE = "metrics/metrics.jsonl"
+METRICS_MAX_BYTES = 5 * 1024 * 1024
+METRICS_BACKUP_COUNT = 10
+TOKEN_USAGE_FIELDS = ('input_tokens', 'output_tokens', 'cache_read_input_tokens', 'cache_creation_input_tokens')
+
+# APIのやり取りの記録・再生（オフラインでの負荷試験・不具合の再現用）
+RECORDINGS_DIR = "recordings"
+
+# 一括（夜間）モード（Message Batches API でまとめて送信し、終わったら結果を取り込む）
+BULK_JOBS_DIR = "bulk_jobs"  # 送信したバッチのIDと対応表（再起動後の再開用）
+BULK_POLL_INITIAL_SECONDS = 30.0  # 状態確認の間隔（確認ごとに1.5倍）
+BULK_POLL_MAX_SECONDS = 600.0
+BULK_MAX_REQUESTS = 10000  # 1回の送信に含めるリクエスト数の上限
+BULK_MAX_BATCH_BYTES = 100 * 1024 * 1024  # 1回の送信に含める画像データの上限（API上限は256MB）
+BULK_RETRYABLE_ERRORS = ('api_error', 'overloaded_error', 'rate_limit_error')
+
+# ジョブストア（変換の段階ごとの結果を SQLite に保存し、終了・クラッシュ後に続きから再開する）
+JOB_STORE_FILE = "jobs/jobs.sqlite3"
+
+# フォルダ監視（スキャンを置くと自動で変換するホットフォルダ）
+WATCH_SETTLE_SECONDS = 3.0  # サイズ・更新時刻がこの秒数変わらなければ書き込みが終わったとみなす
+WATCH_POLL_INTERVAL = 2.0  # 変更通知を使えない場合にフォルダを走査する間隔
+WATCH_RESCAN_INTERVAL = 60.0  # 変更通知を使う場合も、取りこぼし（共有フォルダなど）に備えて走査する間隔
+WATCH_CHECK_INTERVAL = 0.5  # 書き込み中のファイルを確認する間隔
+
+# Excel出力
+DEFAULT_EXCEL_WRITER = "auto"  # "auto" / "styled" / "streaming"
+EXCEL_STREAMING_MIN_CELLS = 50000  # これ以上のセル数は省メモリモードで書き出す
+EXCEL_MAX_COLUMN_WIDTH = 50
+STYLE_TITLE = "schedule_title"
+STYLE_HEADER = "schedule_header"
+STYLE_CELL = "schedule_cell"
+
+# 出力形式（Excel の書式が不要な用途では、より速い形式で書き出せる）
+DEFAULT_OUTPUT_FORMAT = "xlsx"
+OUTPUT_FORMAT_LABELS = {
+    'xlsx': "Excel（書式付き）",
+    'xlsx_stream': "Excel（高速・省メモリ）",
+    'csv': "CSV",
+    'jsonl': "JSON Lines",
+    'parquet': "Parquet",
+}
+CSV_ENCODING = "utf-8-sig"  # Excel で開いても文字化けしないよう BOM を付ける
+EXPORT_WRITE_CHUNK_CHARS = 256 * 1024  # 省メモリのExcel出力で、まとめて圧縮する文字数
+
+# 統合ブック（変換結果を別々のファイルにせず、1つのExcelファイルに追記していく）
+DEFAULT_CONSOLIDATED_LAYOUT = "sheets"  # "sheets"（元ファイルごとに1シート）/ "master"（一覧シートに行を追記）
+CONSOLIDATED_LAYOUTS = ('sheets', 'master')
+CONSOLIDATED_INDEX_SHEET = "目次"
+CONSOLIDATED_MASTER_SHEET = "一覧"
+CONSOLIDATED_MASTER_WIDTHS = (40, 18)  # 一覧シートの「元ファイル」「変換日時」列の幅
+CONSOLIDATED_MASTER_COLUMN_WIDTH = 14  # 一覧シートの表の列の幅（列幅は後から変えられないため固定）
+CONSOLIDATED_MASTER_MAX_COLUMNS = 100
+EXCEL_MAX_SHEET_NAME = 31
+
+# 出力ファイル名の確保を直列化するロック
+_output_path_lock = threading.Lock()
+
+# 統合ブックへの追記を直列化するロック
+_consolidated_lock = threading.Lock()
+
+# PDFページ描画用のプロセスプール（一括変換の全ワーカーで共有）
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+# CustomTkinter テーマ設定
+ctk.set_appearance_mode("light")
+ctk.set_default_color_theme("blue")
+
+
+TABLE_EXTRACTION_PROMPT = """この画像に含まれる表データを解析して、表形式のJSON（columns と rows）で出力してください。
+
+【重要】以下のJSON形式を必ず守ってください：
+- トップレベルのキーは "title", "columns", "rows" のみ
+- "columns" は列名の配列
+- "rows" は各行のデータをオブジェクトの配列として表現
+
+【必須要件】
+1. 表のすべての行・列を漏らさず出力（省略禁止）
+2. 説明文やコメントは一切含めず、純粋なJSONのみ出力
+3. コードブロック（```json）は使用しないでください
+
+【出力例】
+{
+  "title": "タイトル",
+  "columns": ["列1", "列2", "列3", "列4"],
+  "rows": [
+    {"列1": "値1", "列2": "値2", "列3": "値3", "列4": "値4"},
+    {"列1": "値5", "列2": "値6", "列3": "値7", "列4": "値8"}
+  ]
+}
+
+上記の形式で、画像内のすべてのデータを含むJSONを出力してください。"""
+
+# 行を列名の付かない配列で出力させる形式（列名の繰り返しがないため出力トークン数が少ない）
+COMPACT_TABLE_EXTRACTION_PROMPT = """この画像に含まれる表データを解析して、表形式のJSON（columns と rows）で出力してください。
+
+【重要】以下のJSON形式を必ず守ってください：
+- トップレベルのキーは "title", "columns", "rows" のみ
+- "columns" は列名の配列
+- "rows" は各行の値の配列の配列（値は "columns" と同じ順・同じ個数で並べる）
+- 空欄のセルは "" とする
+
+【必須要件】
+1. 表のすべての行・列を漏らさず出力（省略禁止）
+2. 説明文やコメントは一切含めず、純粋なJSONのみ出力
+3. コードブロック（```json）は使用しないでください
+
+【出力例】
+{
+  "title": "タイトル",
+  "columns": ["列1", "列2", "列3", "列4"],
+  "rows": [
+    ["値1", "値2", "値3", "値4"],
+    ["値5", "値6", "", "値8"]
+  ]
+}
+
+上記の形式で、画像内のすべてのデータを含むJSONを出力してください。"""
+
+# 応答形式ごとの指示（システムプロンプトとして送り、プロンプトキャッシュの対象にする）
+RESPONSE_SCHEMA_PROMPTS = {
+    'objects': TABLE_EXTRACTION_PROMPT,
+    'compact': COMPACT_TABLE_EXTRACTION_PROMPT,
+}
+
+# 画像と一緒に送る短い依頼文（分割解析ではここに補足を付ける）
+TABLE_REQUEST_TEXT = "この画像の表を、指示どおりのJSONで出力してください。"
+
+# 出力が上限で途切れたときの続きの依頼（受信済みの最後の行を目印にする）
+CONTINUATION_PROMPT_NOTE = """
+
+【続き】前回の出力は長さの上限に達したため途中で途切れました。表の先頭から {count} 行は受信済みで、最後の行は次のとおりです：
+{last_row}
+"columns" は前回と同じ列名とし、"rows" にはこの行より後の行だけを出力してください。"""
+
+
+def parse_table_response(response_text, allow_empty=False):
+    """Claudeのレスポンス文字列から表データ（columns / rows）を取り出して検証（allow_empty なら0行も可）"""
+    # JSONの抽出（```json ``` で囲まれている場合に対応）
+    if "```json" in response_text:
+        json_start = response_text.find("```json") + 7
+        json_end = response_text.find("```", json_start)
+        response_text = response_text[json_start:json_end].strip()
+    elif "```" in response_text:
+        json_start = response_text.find("```") + 3
+        json_end = response_text.find("```", json_start)
+        response_text = response_text[json_start:json_end].strip()
+    
+    # JSONオブジェクトのみを抽出（余分なテキストを除去）
+    # 最初の { から最後の } までを抽出
+    json_start_bracket = response_text.find('{')
+    json_end_bracket = response_text.rfind('}')
+    
+    if json_start_bracket != -1 and json_end_bracket != -1:
+        response_text = response_text[json_start_bracket:json_end_bracket+1]
+    
+    # JSONパース
+    table_data = json.loads(response_text)
+    
+    # データ構造の検証
+    if 'columns' not in table_data or 'rows' not in table_data:
+        raise Exception(
+            f"不正なJSON形式：'columns'と'rows'が必要です。\n"
+            f"受け取ったキー: {list(table_data.keys())}\n"
+            f"詳細は debug_output/claude_response.txt を確認してください。"
+        )
+    
+    if not isinstance(table_data['columns'], list) or not isinstance(table_data['rows'], list):
+        raise Exception("'columns'と'rows'は配列である必要があります。")
+    
+    # 行はオブジェクト（列名: 値）または値の配列（columns と同じ順）のどちらか
+    if not all(isinstance(row, (dict, list)) for row in table_data['rows']):
+        raise Exception("'rows'の各行はオブジェクトまたは配列である必要があります。")
+    
+    if len(table_data['rows']) == 0 and not allow_empty:
+        raise Exception("データ行が0件です。画像を確認してください。")
+    
+    print(f"解析成功: {len(table_data['columns'])}列 x {len(table_data['rows'])}行")
+    
+    return table_data
+
+
+def recover_truncated_table(response_text):
+    """途中で途切れたレスポンスから、完成している行までの表データを取り出す（列名まで届いていなければ None）
+    
+    IncrementalTableParser で一度だけ走査し、括弧の対応が取れた行だけを残します。
+    """
+    parser = IncrementalTableParser()
+    parser.feed(response_text)
+    if parser.columns is None:
+        return None
+    return {'title': parser.title or '', 'columns': parser.columns, 'rows': list(parser.rows)}
+
+
+def join_continuation_tables(pieces):
+    """途切れた応答と続きの応答の表データを1つにつなげる
+    
+    続きの応答には目印として送った行（前の応答の最後の行）より後の行だけを求めているので、重なりはない前提です。
+    続きの応答が目印の行を繰り返した場合に限り、その先頭の1行だけを取り除きます。
+    """
+    if len(pieces) == 1:
+        return pieces[0]
+    joined = {'title': pieces[0].get('title', ''), 'columns': list(pieces[0]['columns']), 'rows': []}
+    anchor = None  # 続きを要求したときに送った最後の行
+    for piece in pieces:
+        rows = aligned_rows(piece, joined['columns'])
+        if anchor is not None and rows[:1] == [anchor]:
+            rows = rows[1:]
+        joined['rows'].extend(rows)
+        anchor = rows[-1] if rows else anchor
+    return joined
+
+
+def merge_continuation_tables(pieces):
+    """途切れた応答と続きの応答の表データを1つにまとめる"""
+    table_data = join_continuation_tables(pieces)
+    if len(pieces) > 1:
+        print(f"続きの応答を結合: {len(pieces)}回の応答 → {len(table_data['rows'])}行")
+    return table_data
+
+
+def estimate_output_tokens(image_data, response_schema=DEFAULT_RESPONSE_SCHEMA):
+    """送信する画像の表の行数・列数から（出力トークン数の見込み, max_tokens）を決める
+    
+    罫線が見つからず表の大きさが分からない場合は（EXPECTED_OUTPUT_TOKENS, MAX_OUTPUT_TOKENS）を返します。
+    """
+    try:
+        with Image.open(io.BytesIO(base64.b64decode(image_data))) as img:
+            grid = detect_table_grid(img)
+    except Exception:
+        grid = None
+    if grid is None:
+        return EXPECTED_OUTPUT_TOKENS, MAX_OUTPUT_TOKENS
+    rows, columns = grid
+    expected = OUTPUT_TOKENS_OVERHEAD + rows * (columns or GRID_DEFAULT_COLUMNS) * OUTPUT_TOKENS_PER_CELL[response_schema]
+    max_tokens = min(MAX_OUTPUT_TOKENS_CEILING, max(MAX_OUTPUT_TOKENS, math.ceil(expected * OUTPUT_TOKENS_MARGIN)))
+    return expected, max_tokens
+
+
+def load_config():
+    """設定ファイルを読み込んで辞書で返す"""
+    if os.path.exists(CONFIG_FILE):
+        try:
+            with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"設定読み込みエラー: {e}")
+    return {}
+
+
+def preload_modules():
+    """時間のかかるモジュールを読み込んでおく（ウィンドウ表示後にバックグラウンドで実行）"""
+    for module in PRELOAD_MODULES:
+        try:
+            module.load()
+        except Exception as e:
+            print(f"モジュール読み込みエラー（{module._name}）: {e}")
+
+
+def format_startup_report(budget_ms=STARTUP_BUDGET_MS):
+    """起動時間の計測結果を文字列にまとめる"""
+    parts = [f"モジュール読み込み {startup_timings.get('module_import', 0) * 1000:.0f}ms"]
+    if 'window_created' in startup_timings:
+        parts.append(f"ウィンドウ作成 {startup_timings['window_created'] * 1000:.0f}ms")
+    if 'first_paint' in startup_timings:
+        parts.append(f"初回描画 {startup_timings['first_paint'] * 1000:.0f}ms")
+    report = f"起動時間: {' / '.join(parts)}（目標 {budget_ms}ms 以内）"
+    
+    imports = [f"{name[7:]} {seconds * 1000:.0f}ms"
+               for name, seconds in startup_timings.items() if name.startswith('import:')]
+    if imports:
+        report += f"\n起動中に読み込んだモジュール: {', '.join(imports)}"
+    if startup_timings.get('first_paint', 0) * 1000 > budget_ms:
+        report += "\n警告: 起動時間が目標を超えています"
+    return report
+
+
+def is_pdf_file(path):
+    """PDFファイルかどうかを判定"""
+    return str(path).lower().endswith(PDF_EXTENSIONS)
+
+
+def estimate_image_tokens(width, height):
+    """画像の入力トークン数の目安を計算"""
+    return math.ceil(width * height / 750)
+
+
+def image_budget_from_config(config):
+    """設定（config.json の内容）からアップロード画像の予算を作成"""
+    return {
+        'max_bytes': int(config.get('image_max_kb', DEFAULT_IMAGE_MAX_KB)) * 1024,
+        'max_tokens': int(config.get('image_max_tokens', DEFAULT_IMAGE_MAX_TOKENS)),
+        'max_long_edge': int(config.get('image_max_long_edge', MAX_IMAGE_LONG_EDGE)),
+        'table_crop': bool(config.get('table_crop', DEFAULT_TABLE_CROP)),
+    }
+
+
+def fit_image_scale(width, height, max_tokens=DEFAULT_IMAGE_MAX_TOKENS, max_long_edge=MAX_IMAGE_LONG_EDGE):
+    """長辺とトークン数の上限に収まる縮小率を返す（拡大はしない）"""
+    scale = min(1.0, max_long_edge / max(width, height))
+    if estimate_image_tokens(width * scale, height * scale) > max_tokens:
+        scale = min(scale, math.sqrt(max_tokens * 750 / (width * height)))
+    return scale
+
+
+def detect_color_mode(img):
+    """画像に適した色モードを判定（'RGB' / 'L' / '1'）
+    
+    彩度がほとんどない画像はグレースケール、ほぼ白と黒だけの線画（表）は2値にします。
+    """
+    sample = img.convert('RGB')
+    sample.thumbnail((256, 256))
+    
+    r, g, b = sample.split()
+    chroma = max(
+        ImageStat.Stat(ImageChops.difference(r, g)).mean[0],
+        ImageStat.Stat(ImageChops.difference(g, b)).mean[0],
+    )
+    if chroma > 8:
+        return 'RGB'
+    
+    histogram = sample.convert('L').histogram()
+    extremes = sum(histogram[:48]) + sum(histogram[208:])
+    if extremes / sum(histogram) >= 0.97:
+        return '1'
+    return 'L'
+
+
+def detect_table_region(img):
+    """写真・スキャン画像から表の範囲と傾きを検出する（表が見つからない・切り抜く必要がない場合は None）
+    
+    戻り値の 'angle' は補正の回転角（度、反時計回り）、'box'（左, 上, 右, 下）は回転後の画像の
+    幅・高さに対する割合、'rows' は切り抜いた範囲の高さに対する横罫線の位置の割合です。
+    """
+    found = _find_table_lines(img)
+    if found is None:
+        return None
+    angle, dark, lines = found['angle'], found['dark'], found['rows']
+    left, top, right, bottom = found['box']
+    height, width = dark.shape
+    
+    # 表のすぐ上・下に続く文字（タイトル・備考）も含める
+    row_height = max(1, int(np.median(np.diff(lines))))
+    ink = dark[:, left:right].mean(axis=1) > 0.01
+    top = _extend_to_text(ink, top, -1, row_height)
+    bottom = _extend_to_text(ink, bottom - 1, 1, row_height) + 1
+    
+    margin_x, margin_y = round(width * TABLE_CROP_MARGIN), round(height * TABLE_CROP_MARGIN)
+    left, right = max(0, left - margin_x), min(width, right + margin_x)
+    top, bottom = max(0, top - margin_y), min(height, bottom + margin_y)
+    if not angle and (right - left) * (bottom - top) >= TABLE_CROP_MAX_AREA * width * height:
+        return None
+    return {
+        'angle': angle,
+        'box': (left / width, top / height, right / width, bottom / height),
+        'rows': [(y - top) / (bottom - top) for y in lines],
+    }
+
+
+def detect_table_grid(img):
+    """罫線から表の（行数, 列数）を数える（横罫線が見つからない場合は None、縦罫線がない場合の列数は None）"""
+    found = _find_table_lines(img)
+    if found is None:
+        return None
+    return len(found['rows']) - 1, len(found['columns']) - 1 if len(found['columns']) >= 2 else None
+
+
+def _find_table_lines(img):
+    """表の罫線を検出する（見つからない場合は None）
+    
+    縮小したグレースケール画像で周囲より暗い画素を求め、横・縦に長く続く画素（罫線）の
+    行ごと・列ごとの密度（射影プロファイル）を NumPy でまとめて計算します。
+    傾きは、暗い画素を角度を変えながら横方向に射影し、行の山が最も鋭くなる角度とします。
+    戻り値は、傾き 'angle'、傾きを補正した縮小画像の暗い画素 'dark'、横罫線・縦罫線の位置 'rows' / 'columns'、
+    罫線の範囲 'box'（左, 上, 右, 下）で、位置はいずれも 'dark' の画素の座標です。
+    """
+    scale = min(1.0, TABLE_DETECT_LONG_EDGE / max(img.size))
+    gray = img
+    if scale < 1.0:
+        size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        gray = img.resize(size, Image.Resampling.BOX, reducing_gap=2.0)
+    gray = gray.convert('L')
+    
+    dark = _dark_pixels(gray)
+    if min(dark.shape) < 32 or not dark.any():
+        return None
+    angle = _estimate_skew(dark)
+    if abs(angle) < TABLE_DESKEW_MIN_DEGREES:
+        angle = 0.0
+    else:
+        gray = gray.rotate(angle, resample=Image.Resampling.BILINEAR, expand=True, fillcolor=255)
+        dark = _dark_pixels(gray)
+    height, width = dark.shape
+    
+    # 横罫線：横に長く続く暗い画素が多い行。長さのそろった最も多い組を表の罫線とする（床や棚の線を除く）
+    horizontal = _line_pixels(dark, max(8, round(width * TABLE_LINE_MIN_RUN)))
+    line_rows = np.flatnonzero(horizontal.sum(axis=1) >= width * TABLE_LINE_MIN_LENGTH)
+    groups = np.split(line_rows, np.flatnonzero(np.diff(line_rows) > 1) + 1) if len(line_rows) else []
+    if len(groups) < TABLE_MIN_LINES:
+        return None
+    extents = []
+    for rows in groups:
+        columns = np.flatnonzero(horizontal[rows].any(axis=0))
+        extents.append((columns[0], columns[-1] + 1))
+    starts, ends = np.array(extents).T
+    overlap = np.minimum(ends[:, None], ends[None, :]) - np.maximum(starts[:, None], starts[None, :])
+    union = np.maximum(ends[:, None], ends[None, :]) - np.minimum(starts[:, None], starts[None, :])
+    similar = overlap >= 0.8 * union
+    best = int(np.argmax(similar.sum(axis=1) * width + (ends - starts)))
+    table = np.flatnonzero(similar[best])
+    if len(table) < TABLE_MIN_LINES:
+        return None
+    lines = [int(groups[i].mean()) for i in table]
+    top, bottom = int(groups[table[0]][0]), int(groups[table[-1]][-1]) + 1
+    left, right = int(starts[table].min()), int(ends[table].max())
+    
+    # 縦罫線：表の横罫線の範囲で縦に長く続く暗い画素が多い列。表の枠が横罫線より外にあれば含める
+    band = dark[top:bottom]
+    vertical = _line_pixels(band.T, max(8, round(band.shape[0] * TABLE_LINE_MIN_RUN * 4))).T
+    line_columns = np.flatnonzero(vertical.sum(axis=0) >= 0.5 * band.shape[0])
+    tolerance = round(width * 0.05)
+    line_columns = line_columns[(line_columns >= left - tolerance) & (line_columns < right + tolerance)]
+    column_lines = []
+    if len(line_columns):
+        left, right = min(left, int(line_columns[0])), max(right, int(line_columns[-1]) + 1)
+        column_lines = [int(group.mean())
+                        for group in np.split(line_columns, np.flatnonzero(np.diff(line_columns) > 1) + 1)]
+    return {'angle': angle, 'dark': dark, 'rows': lines, 'columns': column_lines, 'box': (left, top, right, bottom)}
+
+
+def _dark_pixels(gray):
+    """周囲の平均より暗い画素（線・文字）を True にした配列（照明のむらや影に左右されない）"""
+    radius = max(2, min(gray.size) // 50)
+    background = np.asarray(gray.filter(ImageFilter.BoxBlur(radius)), dtype=np.int16)
+    return np.asarray(gray, dtype=np.int16) < background - TABLE_DARK_CONTRAST
+
+
+def _line_pixels(mask, length):
+    """mask のうち、横に length 画素以上続く部分の画素だけを True にした配列（累積和でまとめて計算）"""
+    height, width = mask.shape
+    if width < length:
+        return np.zeros_like(mask)
+    counts = np.zeros((height, width + 1), dtype=np.int32)
+    np.cumsum(mask, axis=1, out=counts[:, 1:])
+    # 位置 x から length 画素がすべて暗ければ、そこから始まる線がある
+    starts = (counts[:, length:] - counts[:, :-length]) == length
+    started = np.zeros((height, starts.shape[1] + 1), dtype=np.int32)
+    np.cumsum(starts, axis=1, out=started[:, 1:])
+    # 画素 x は、x - length + 1 〜 x のどこかから始まる線に含まれるか
+    x = np.arange(width)
+    return started[:, np.minimum(x, starts.shape[1] - 1) + 1] > started[:, np.maximum(x - length + 1, 0)]
+
+
+def _estimate_skew(dark):
+    """暗い画素の横方向の射影が最も鋭くなる傾き（度）を求める
+    
+    罫線・文字のような細い線の画素だけを使います（床の境目や影のような太い帯は写真の傾きと関係がない）。
+    """
+    k = TABLE_SKEW_MAX_THICKNESS
+    thin = dark.copy()
+    thin[k:-k] &= ~(dark[:-2 * k] | dark[2 * k:])  # 上下が明るい画素
+    ys, xs = np.nonzero(thin)
+    if len(ys) == 0:
+        return 0.0
+    step = max(1, len(ys) // TABLE_SKEW_SAMPLE_PIXELS)
+    ys = ys[::step].astype(np.float64)
+    xs = xs[::step].astype(np.float64)
+    
+    def sharpness(angle):
+        shifted = ys - xs * math.tan(math.radians(angle))
+        counts = np.bincount(np.round(shifted - shifted.min()).astype(np.int64)).astype(np.float64)
+        return float(np.dot(counts, counts))
+    
+    coarse = np.arange(-TABLE_SKEW_MAX_DEGREES, TABLE_SKEW_MAX_DEGREES + 1e-9, TABLE_SKEW_STEP_DEGREES)
+    best = max(coarse, key=sharpness)
+    fine = np.arange(best - TABLE_SKEW_STEP_DEGREES, best + TABLE_SKEW_STEP_DEGREES + 1e-9,
+                     TABLE_SKEW_FINE_STEP_DEGREES)
+    return round(float(max(fine, key=sharpness)), 2)
+
+
+def _extend_to_text(ink, start, step, gap):
+    """start から step の向きに、文字のある行が gap 行以内の間隔で続く端の座標を返す（最大 TABLE_EXTEND_ROWS 行分）"""
+    edge = start
+    limit = gap * TABLE_EXTEND_ROWS
+    y = start + step
+    while 0 <= y < len(ink) and abs(y - start) <= limit:
+        if ink[y]:
+            edge = y
+        elif abs(y - edge) > gap:
+            break
+        y += step
+    return edge
+
+
+def crop_to_table(img, region):
+    """detect_table_region の結果に合わせて傾きを補正し、表の範囲を切り抜く（region が None ならそのまま）"""
+    if region is None:
+        return img
+    if region['angle']:
+        if img.mode not in ('L', 'RGB'):
+            img = img.convert('RGB')
+        img = img.rotate(region['angle'], resample=Image.Resampling.BICUBIC, expand=True, fillcolor='white')
+    left, top, right, bottom = region['box']
+    return img.crop((math.floor(left * img.width), math.floor(top * img.height),
+                     math.ceil(right * img.width), math.ceil(bottom * img.height)))
+
+
+def crop_table_for_upload(img, region, max_tokens=DEFAULT_IMAGE_MAX_TOKENS, max_long_edge=MAX_IMAGE_LONG_EDGE):
+    """画像全体を送る場合と同じ縮小率にしてから表の範囲を切り抜く
+    
+    表の細かさは変えずに、切り落とした面積の分だけ送信サイズと入力トークンを減らします。
+    先に縮小するため、大きな写真でも傾きの補正は小さな画像で済みます。
+    """
+    if region is None:
+        return img
+    scale = fit_image_scale(img.width, img.height, max_tokens, max_long_edge)
+    if scale < 1.0:
+        size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        img = img.resize(size, Image.Resampling.LANCZOS)
+    return crop_to_table(img, region)
+
+
+def encode_image(img, quality):
+    """画像をエンコードして（BytesIO, メディアタイプ）を返す（バイト列はコピーしない）"""
+    buffer = io.BytesIO()
+    if img.mode == '1':
+        img.save(buffer, format='PNG', optimize=True)
+        return buffer, 'image/png'
+    img.save(buffer, format='JPEG', quality=quality, optimize=True)
+    return buffer, 'image/jpeg'
+
+
+def base64_encode_stream(stream):
+    """ファイルやバッファを少しずつ読んでBase64文字列にする（全体のバイト列のコピーを作らない）"""
+    parts = []
+    while True:
+        chunk = stream.read(BASE64_CHUNK_BYTES)
+        if not chunk:
+            break
+        parts.append(base64.standard_b64encode(chunk).decode('ascii'))
+    return ''.join(parts)
+
+
+def prepare_upload_image(img, max_bytes=DEFAULT_IMAGE_MAX_KB * 1024, max_tokens=DEFAULT_IMAGE_MAX_TOKENS,
+                         max_long_edge=MAX_IMAGE_LONG_EDGE, table_crop=False):
+    """アップロード用に解像度・色モード・画質を調整し、（Base64, メディアタイプ）を返す
+    
+    途中の画像やエンコード結果は不要になった時点で手放し、ピークメモリを抑えます。
+    table_crop が True なら、先に表の範囲を切り抜いて傾きを補正します。
+    """
+    if table_crop:
+        img = crop_table_for_upload(img, detect_table_region(img), max_tokens, max_long_edge)
+    
+    mode = detect_color_mode(img)
+    
+    # グレースケールにしてから縮小する（RGB のまま縮小するより3分の1のメモリで済む）
+    if mode != 'RGB' and img.mode != 'L':
+        img = img.convert('L')
+    elif mode == 'RGB' and img.mode != 'RGB':
+        img = img.convert('RGB')
+    
+    scale = fit_image_scale(img.width, img.height, max_tokens, max_long_edge)
+    if scale < 1.0:
+        size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        img = img.resize(size, Image.Resampling.LANCZOS)
+    
+    if mode == '1':
+        # ディザリングすると文字が崩れるため、しきい値で2値化する
+        img = img.point(lambda p: 255 if p >= 160 else 0, mode='1')
+    
+    # 画質を下げても予算に収まらない場合は、さらに縮小してやり直す
+    buffer = None
+    while True:
+        for quality in JPEG_QUALITY_STEPS:
+            buffer = None  # 前回のエンコード結果を先に手放す
+            buffer, media_type = encode_image(img, quality)
+            if buffer.tell() <= max_bytes or media_type == 'image/png':
+                break
+        if buffer.tell() <= max_bytes or min(img.size) <= 200:
+            break
+        buffer = None
+        img = img.resize((round(img.width * 0.8), round(img.height * 0.8)), Image.Resampling.LANCZOS)
+    
+    # 縮小した画像を手放してから、エンコード結果のバッファを直接Base64にする
+    del img
+    buffer.seek(0)
+    return base64_encode_stream(buffer), media_type
+
+
+def load_image_base64(image_path, max_bytes=DEFAULT_IMAGE_MAX_KB * 1024, max_tokens=DEFAULT_IMAGE_MAX_TOKENS,
+                      max_long_edge=MAX_IMAGE_LONG_EDGE, table_crop=False):
+    """画像ファイルを読み込み、（Base64, メディアタイプ）を返す
+    
+    予算内に収まっているJPEG/PNGは再エンコードせずそのまま送ります。
+    table_crop が True なら表の範囲を検出し、切り抜く必要があれば切り抜いてから送ります。
+    """
+    with Image.open(image_path) as img:
+        media_type = Image.MIME.get(img.format)
+        needs_rotation = img.getexif().get(0x0112, 1) != 1  # EXIF の向き情報
+        fits = (
+            media_type in ('image/jpeg', 'image/png')
+            and not needs_rotation
+            and os.path.getsize(image_path) <= max_bytes
+            and fit_image_scale(img.width, img.height, max_tokens, max_long_edge) == 1.0
+        )
+        region = None
+        if table_crop:
+            img = ImageOps.exif_transpose(img)
+            region = detect_table_region(img)
+        if region is not None:
+            img = crop_table_for_upload(img, region, max_tokens, max_long_edge)
+            return prepare_upload_image(img, max_bytes, max_tokens, max_long_edge)
+        if not fits:
+            img = ImageOps.exif_transpose(img)
+            return prepare_upload_image(img, max_bytes, max_tokens, max_long_edge)
+    
+    with open(image_path, 'rb') as f:
+        return base64_encode_stream(f), media_type
+
+
+def render_pdf_page(pdf_path, page_number, max_tokens=None, max_long_edge=None, dpi=PDF_RENDER_DPI,
+                    grayscale=None):
+    """PDFの指定ページをPIL画像に描画
+    
+    上限を渡した場合は、送信する解像度で直接描画します（最大 dpi まで）。
+    grayscale=None の場合は、小さく試し描きして彩度のないページならグレースケールで描画します。
+    """
+    doc = fitz.open(pdf_path)
+    try:
+        # ページ番号の検証（1-indexed → 0-indexed）
+        page_index = page_number - 1
+        if page_index < 0 or page_index >= len(doc):
+            raise ValueError(f"ページ番号が範囲外です（1〜{len(doc)}ページの範囲で指定してください）")
+        
+        # 指定ページを取得
+        page = doc[page_index]
+        
+        if grayscale is None:
+            probe_zoom = PDF_PROBE_LONG_EDGE / max(page.rect.width, page.rect.height)
+            probe = page.get_pixmap(matrix=fitz.Matrix(probe_zoom, probe_zoom), alpha=False)
+            grayscale = detect_color_mode(pixmap_to_image(probe)) != 'RGB'
+            del probe
+        
+        zoom = dpi / 72  # PDFは72dpi、300dpiにするには約4.17倍
+        if max_tokens and max_long_edge:
+            zoom *= fit_image_scale(page.rect.width * zoom, page.rect.height * zoom, max_tokens, max_long_edge)
+        colorspace = fitz.csGRAY if grayscale else fitz.csRGB
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=colorspace, alpha=False)
+        
+        # PIL Imageに変換
+        return pixmap_to_image(pix)
+    finally:
+        doc.close()
+
+
+def render_pdf_table(pdf_path, page_number, max_tokens=None, max_long_edge=None, dpi=PDF_RENDER_DPI):
+    """PDFの指定ページを送信する解像度で描画し、表の範囲を切り抜く（表が見つからない場合はページ全体）"""
+    img = render_pdf_page(pdf_path, page_number, max_tokens, max_long_edge, dpi)
+    return crop_to_table(img, detect_table_region(img))
+
+
+def pixmap_to_image(pix):
+    """PyMuPDF の Pixmap をPIL画像に変換（pix.samples のようなバイト列のコピーを作らずにバッファから直接読む）"""
+    mode = "L" if pix.n == 1 else "RGB"
+    return Image.frombytes(mode, (pix.width, pix.height), pix.samples_mv, "raw", mode, pix.stride)
+
+
+def pdf_page_to_image_base64(pdf_path, page_number, max_bytes=DEFAULT_IMAGE_MAX_KB * 1024,
+                             max_tokens=DEFAULT_IMAGE_MAX_TOKENS, max_long_edge=MAX_IMAGE_LONG_EDGE,
+                             dpi=PDF_RENDER_DPI, table_crop=False):
+    """PDFの指定ページを画像に変換し、（Base64, メディアタイプ, 段階ごとの秒数）を返す
+    
+    プロセスプールから呼び出せるようモジュール直下の関数にしています。
+    描画とエンコードを1つずつ順に行い、描画した画像はエンコード後に手放します。
+    """
+    try:
+        started = time.perf_counter()
+        render = render_pdf_table if table_crop else render_pdf_page
+        img = render(pdf_path, page_number, max_tokens, max_long_edge, dpi)
+        rendered = time.perf_counter()
+        image_data, media_type = prepare_upload_image(img, max_bytes, max_tokens, max_long_edge)
+        del img
+        return image_data, media_type, {'load': rendered - started, 'encode': time.perf_counter() - rendered}
+        
+    except Exception as e:
+        raise Exception(f"PDF変換エラー: {str(e)}")
+
+
+def load_upload_image(source_path, page_number=None, **image_budget):
+    """画像ファイル（またはPDFの1ページ）を送信用の（Base64, メディアタイプ）にする（プロセスプール用）"""
+    if page_number is None:
+        return load_image_base64(source_path, **image_budget)
+    image_data, media_type, _ = pdf_page_to_image_base64(str(source_path), page_number, **image_budget)
+    return image_data, media_type
+
+
+def get_pdf_page_size(pdf_path, page_number):
+    """PDFの指定ページを300dpiで描画したときのピクセルサイズを返す"""
+    doc = fitz.open(pdf_path)
+    try:
+        rect = doc[page_number - 1].rect
+        zoom = PDF_RENDER_DPI / 72
+        return round(rect.width * zoom), round(rect.height * zoom)
+    finally:
+        doc.close()
+
+
+def find_row_boundaries(img):
+    """表の行の境界（横罫線）のy座標を検出する
+    
+    画像を幅1ピクセルに縮小して各行の平均の濃さを求め、横幅いっぱいに引かれた罫線を探します。
+    罫線がない表では、文字のない余白行の中央を境界とします。
+    """
+    profile = img.convert('L').resize((1, img.height), Image.Resampling.BOX).getdata()
+    darkness = [255 - value for value in profile]
+    
+    threshold = max(96, max(darkness) * 0.5)
+    boundaries = _group_rows([y for y, d in enumerate(darkness) if d >= threshold])
+    if len(boundaries) < 2:
+        boundaries = _group_rows([y for y, d in enumerate(darkness) if d <= 2])
+    return boundaries
+
+
+def _group_rows(rows):
+    """連続するy座標をまとめ、それぞれの中央の座標を返す"""
+    groups = []
+    start = prev = None
+    for y in rows:
+        if start is None:
+            start = prev = y
+        elif y == prev + 1:
+            prev = y
+        else:
+            groups.append((start + prev) // 2)
+            start = prev = y
+    if start is not None:
+        groups.append((start + prev) // 2)
+    return groups
+
+
+def plan_tiles(width, height, boundaries, image_budget, force=False):
+    """分割数と各帯の範囲（上端, 下端）を決める
+    
+    1回の解析で読み取れる解像度と行数に収まる最小の分割数を選び、
+    境界は検出した行の境界に合わせ、隣の帯と1行分重ねます。
+    """
+    max_tokens = image_budget['max_tokens']
+    max_long_edge = image_budget['max_long_edge']
+    
+    count = 1
+    while count < TILE_MAX_COUNT:
+        strip_scale = fit_image_scale(width, height / count, max_tokens, max_long_edge)
+        if strip_scale >= TILE_MIN_SCALE:
+            break
+        count += 1
+    count = max(count, math.ceil(len(boundaries) / TILE_MAX_ROWS))
+    if force:
+        count = max(count, 2)
+    count = min(count, TILE_MAX_COUNT, max(1, len(boundaries) - 1))
+    if count <= 1:
+        return [(0, height)]
+    
+    # 理想の切れ目に最も近い行の境界で切る
+    cuts = [0]
+    for k in range(1, count):
+        ideal = height * k / count
+        candidates = [b for b in boundaries if b > cuts[-1]]
+        if not candidates:
+            break
+        cuts.append(min(candidates, key=lambda b: abs(b - ideal)))
+    cuts.append(height)
+    
+    tiles = []
+    for top, bottom in zip(cuts, cuts[1:]):
+        if bottom <= top:
+            continue
+        # 重なり：1つ前の行の境界から始める
+        previous = [b for b in boundaries if b < top]
+        tiles.append((previous[-1] if previous and top > 0 else top, bottom))
+    return tiles
+
+
+def split_into_strips(img, tiles, boundaries):
+    """画像を帯に分割し、2枚目以降の帯には先頭のヘッダー部分を付ける"""
+    if len(tiles) <= 1:
+        return [img]
+    
+    # ヘッダー：先頭から2本目の境界まで（タイトル行＋見出し行）。ただし最初の帯の1/4まで
+    first_bottom = tiles[0][1]
+    header_bottom = boundaries[1] if len(boundaries) > 1 else 0
+    header_bottom = min(header_bottom, first_bottom // 4)
+    header = img.crop((0, 0, img.width, header_bottom)) if header_bottom > 0 else None
+    
+    strips = []
+    for index, (top, bottom) in enumerate(tiles):
+        strip = img.crop((0, top, img.width, bottom))
+        if index > 0 and header is not None:
+            combined = Image.new(img.mode, (img.width, header.height + strip.height), 'white')
+            combined.paste(header, (0, 0))
+            combined.paste(strip, (0, header.height))
+            strip = combined
+        strips.append(strip)
+    return strips
+
+
+def aligned_rows(table, columns):
+    """表データの行を、列の位置で columns に合わせた値の配列にそろえる（列名の表記ゆれに備える）"""
+    rows = []
+    for row in table['rows']:
+        values = row_values(row, table['columns'])[:len(columns)]
+        rows.append(values + [''] * (len(columns) - len(values)))
+    return rows
+
+
+def merge_tile_tables(tables):
+    """帯ごとの解析結果を1つの表データにまとめ、重なり部分の重複行を取り除く
+    
+    plan_tiles は隣の帯とちょうど1行重ねるので、先頭の1行が前の帯の最後の行と同じときだけ読み飛ばします
+    （空行や「-」だけの行が続く表でも、本物の行を落とさないように）。
+    """
+    merged = {'title': tables[0].get('title', ''), 'columns': list(tables[0]['columns']), 'rows': []}
+    columns = merged['columns']
+    
+    for table in tables:
+        rows = aligned_rows(table, columns)
+        if merged['rows'] and rows[:1] == merged['rows'][-1:]:
+            rows = rows[1:]
+        merged['rows'].extend(rows)
+    
+    return merged
+
+
+def get_pdf_page_count(pdf_path):
+    """PDFのページ数を返す"""
+    doc = fitz.open(pdf_path)
+    try:
+        return len(doc)
+    finally:
+        doc.close()
+
+
+def parse_page_range(spec, page_count):
+    """ページ指定（例: "3", "1-5,8", "all"）をページ番号のリストに変換"""
+    spec = str(spec).strip().lower()
+    if spec in ('all', '全て', 'すべて', '*'):
+        return list(range(1, page_count + 1))
+    
+    pages = []
+    for part in spec.replace('、', ',').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            if '-' in part:
+                start, end = (int(p) if p.strip() else None for p in part.split('-', 1))
+                start = start or 1
+                end = end or page_count
+                numbers = range(start, end + 1)
+            else:
+                numbers = [int(part)]
+        except ValueError:
+            raise ValueError(f"ページ指定が不正です: {part}（例: 1 / 1-5,8 / all）")
+        
+        for number in numbers:
+            if number < 1 or number > page_count:
+                raise ValueError(f"ページ番号が範囲外です（1〜{page_count}ページの範囲で指定してください）")
+            if number not in pages:
+                pages.append(number)
+    
+    if not pages:
+        raise ValueError("変換するページを指定してください")
+    return pages
+
+
+def get_render_pool():
+    """PDFページ描画用のプロセスプールを返す（初回呼び出し時に作成）"""
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1)
+        return _render_pool
+
+
+def register_named_styles(wb):
+    """表の書式を名前付きスタイルとしてブックに登録する（全セルで共有）"""
+    styles = openpyxl.styles
+    thin = styles.Side(style='thin')
+    border = styles.Border(left=thin, right=thin, top=thin, bottom=thin)
+    named_styles = [
+        styles.NamedStyle(
+            name=STYLE_TITLE,
+            font=styles.Font(size=14, bold=True, color='FFFFFF'),
+            fill=styles.PatternFill(start_color='000000', end_color='000000', fill_type='solid'),
+            alignment=styles.Alignment(horizontal='center', vertical='center'),
+        ),
+        styles.NamedStyle(
+            name=STYLE_HEADER,
+            font=styles.Font(bold=True, size=10),
+            fill=styles.PatternFill(start_color='D3D3D3', end_color='D3D3D3', fill_type='solid'),
+            alignment=styles.Alignment(horizontal='center', vertical='center', wrap_text=True),
+            border=border,
+        ),
+        styles.NamedStyle(
+            name=STYLE_CELL,
+            alignment=styles.Alignment(horizontal='center', vertical='center', wrap_text=True),
+            border=border,
+        ),
+    ]
+    for style in named_styles:
+        if style.name not in wb.named_styles:
+            wb.add_named_style(style)
+
+
+def table_columns(table_data):
+    """表データの列名リストを返す"""
+    return table_data.get('columns', table_data.get('headers', []))
+
+
+def row_values(row_data, columns):
+    """1行分のデータ（オブジェクトまたは配列）を、列の順に並べた値のリストにする"""
+    if isinstance(row_data, dict):
+        return [row_data.get(header, '') for header in columns]
+    values = list(row_data[:len(columns)])
+    return values + [''] * (len(columns) - len(values))
+
+
+def table_row_values(table_data, columns=None):
+    """表データの各行を、列の順に並べた値のリストとして返す（行はオブジェクト・配列のどちらでもよい）"""
+    columns = table_columns(table_data) if columns is None else columns
+    for row_data in table_data.get('rows', []):
+        yield row_values(row_data, columns)
+
+
+def column_width(max_length):
+    """文字数から列幅を計算"""
+    return min(max_length + 2, EXCEL_MAX_COLUMN_WIDTH)
+
+
+def _update_widths(widths, values):
+    for index, value in enumerate(values):
+        if value:
+            length = len(str(value))
+            if length > widths[index]:
+                widths[index] = length
+
+
+def write_table_sheet(ws, table_data):
+    """ワークシートに表データを書き込む（列幅は書き込みと同時に計算）"""
+    current_row = 1
+    columns = table_columns(table_data)
+    widths = [0] * len(columns)
+    
+    # タイトル行（セル結合）
+    if 'title' in table_data and columns:
+        cell = ws.cell(row=1, column=1, value=table_data['title'])
+        cell.style = STYLE_TITLE
+        ws.merge_cells(start_row=1, start_column=1, end_row=1, end_column=len(columns))
+        current_row += 1
+    
+    # ヘッダー行
+    if columns:
+        for col_idx, header in enumerate(columns, start=1):
+            ws.cell(row=current_row, column=col_idx, value=header).style = STYLE_HEADER
+        _update_widths(widths, columns)
+        current_row += 1
+    
+    # データ行
+    for values in table_row_values(table_data, columns):
+        for col_idx, value in enumerate(values, start=1):
+            ws.cell(row=current_row, column=col_idx, value=value).style = STYLE_CELL
+        _update_widths(widths, values)
+        current_row += 1
+    
+    # 列幅を設定
+    for col_idx, max_length in enumerate(widths, start=1):
+        if max_length > 0:
+            ws.column_dimensions[openpyxl.utils.get_column_letter(col_idx)].width = column_width(max_length)
+
+
+def write_table_sheet_streaming(ws, table_data):
+    """write-only のワークシートに表データを順に書き出す
+    
+    write-only では列幅を行より先に書く必要があるため、値だけを先に走査して列幅を求めます。
+    """
+    columns = table_columns(table_data)
+    widths = [0] * len(columns)
+    _update_widths(widths, columns)
+    for values in table_row_values(table_data, columns):
+        _update_widths(widths, values)
+    for col_idx, max_length in enumerate(widths, start=1):
+        if max_length > 0:
+            ws.column_dimensions[openpyxl.utils.get_column_letter(col_idx)].width = column_width(max_length)
+    
+    def styled(value, style):
+        cell = openpyxl.cell.WriteOnlyCell(ws, value=value)
+        cell.style = style
+        return cell
+    
+    # タイトル行（セル結合）
+    if 'title' in table_data and columns:
+        ws.merged_cells.add(f"A1:{openpyxl.utils.get_column_letter(len(columns))}1")
+        ws.append([styled(table_data['title'], STYLE_TITLE)])
+    
+    # ヘッダー行
+    if columns:
+        ws.append([styled(header, STYLE_HEADER) for header in columns])
+    
+    # データ行（名前付きスタイルなので、ブックには書式が1つだけ登録される）
+    for values in table_row_values(table_data, columns):
+        ws.append([styled(value, STYLE_CELL) for value in values])
+
+
+_XML_ILLEGAL_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+_XML_SPECIAL_CHARS = re.compile('[&<>"\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+# 統合ブックの書式（register_named_styles の名前付きスタイルと同じ見た目）
+# cellXfs の番号: 1=タイトル 2=ヘッダー 3=セル 4=リンク
+XLSX_STYLES_XML = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<fonts count="4">'
+    '<font><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="14"/><color rgb="FFFFFFFF"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="10"/><name val="Calibri"/></font>'
+    '<font><u/><sz val="11"/><color rgb="FF0563C1"/><name val="Calibri"/></font>'
+    '</fonts>'
+    '<fills count="4">'
+    '<fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill>'
+    '<fill><patternFill patternType="solid"><fgColor rgb="FF000000"/><bgColor rgb="FF000000"/></patternFill></fill>'
+    '<fill><patternFill patternType="solid"><fgColor rgb="FFD3D3D3"/><bgColor rgb="FFD3D3D3"/></patternFill></fill>'
+    '</fills>'
+    '<borders count="2">'
+    '<border><left/><right/><top/><bottom/><diagonal/></border>'
+    '<border><left style="thin"/><right style="thin"/><top style="thin"/><bottom style="thin"/><diagonal/></border>'
+    '</borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="5">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="0" fontId="1" fillId="2" borderId="0" xfId="0" applyFont="1" applyFill="1" applyAlignment="1">'
+    '<alignment horizontal="center" vertical="center"/></xf>'
+    '<xf numFmtId="0" fontId="2" fillId="3" borderId="1" xfId="0" applyFont="1" applyFill="1" applyBorder="1" '
+    'applyAlignment="1"><alignment horizontal="center" vertical="center" wrapText="1"/></xf>'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="1" xfId="0" applyBorder="1" applyAlignment="1">'
+    '<alignment horizontal="center" vertical="center" wrapText="1"/></xf>'
+    '<xf numFmtId="0" fontId="3" fillId="0" borderId="1" xfId="0" applyFont="1" applyBorder="1"/>'
+    '</cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+XLSX_TITLE, XLSX_HEADER, XLSX_CELL, XLSX_LINK = 1, 2, 3, 4
+XLSX_WORKSHEET_TAIL = '</sheetData></worksheet>'
+
+
+def _xml_text(value):
+    """XMLのテキスト・属性値として書けるようにエスケープする（XMLで使えない制御文字は除く）"""
+    text = str(value)
+    if _XML_SPECIAL_CHARS.search(text) is None:
+        return text  # ほとんどのセルはそのまま書ける
+    return xml_escape(_XML_ILLEGAL_CHARS.sub('', text), {'"': '&quot;'})
+
+
+@functools.lru_cache(maxsize=None)
+def _column_letter(col_idx):
+    """列番号（1始まり）→ 列名（A, B, …, AA, …）"""
+    letters = ''
+    while col_idx > 0:
+        col_idx, remainder = divmod(col_idx - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+
+def xlsx_row(row_number, cells):
+    """1行分の <row> 要素（cells は（値, 書式番号）のリスト、値が空のセルは書式だけ付ける）"""
+    parts = [f'<row r="{row_number}">']
+    for col_idx, (value, style) in enumerate(cells, start=1):
+        ref = f"{_column_letter(col_idx)}{row_number}"
+        if value is None or value == '':
+            parts.append(f'<c r="{ref}" s="{style}"/>')
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value):
+            parts.append(f'<c r="{ref}" s="{style}"><v>{value!r}</v></c>')
+        else:
+            parts.append(f'<c r="{ref}" s="{style}" t="inlineStr"><is><t xml:space="preserve">{_xml_text(value)}</t>'
+                         f'</is></c>')
+    parts.append('</row>')
+    return ''.join(parts)
+
+
+def xlsx_worksheet_head(widths=()):
+    """ワークシートXMLの <sheetData> の開始まで（widths は（開始列, 終了列, 幅）のリスト）"""
+    head = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">')
+    if widths:
+        head += '<cols>' + ''.join(f'<col min="{first}" max="{last}" width="{width}" customWidth="1"/>'
+                                   for first, last, width in widths) + '</cols>'
+    return head + '<sheetData>'
+
+
+def xlsx_worksheet(rows, widths=(), merges=(), links=()):
+    """ワークシートXML全体（links は（セル, 移動先）のリスト）"""
+    parts = [xlsx_worksheet_head(widths), *rows, '</sheetData>']
+    if merges:
+        parts.append(f'<mergeCells count="{len(merges)}">'
+                     + ''.join(f'<mergeCell ref="{ref}"/>' for ref in merges) + '</mergeCells>')
+    if links:
+        parts.append('<hyperlinks>' + ''.join(f'<hyperlink ref="{ref}" location="{_xml_text(location)}"/>'
+                                              for ref, location in links) + '</hyperlinks>')
+    parts.append('</worksheet>')
+    return ''.join(parts)
+
+
+def iter_table_sheet_xml(table_data):
+    """表データを write_table_sheet と同じ書式のワークシートXMLにして、行ごとに区切って返す
+    
+    列幅は行より先に書く必要があるため、値だけを先に走査して列幅を求めます（行は保持しない）。
+    """
+    columns = table_columns(table_data)
+    widths = [0] * len(columns)
+    _update_widths(widths, columns)
+    for values in table_row_values(table_data, columns):
+        _update_widths(widths, values)
+    yield xlsx_worksheet_head([(col_idx, col_idx, column_width(max_length))
+                               for col_idx, max_length in enumerate(widths, start=1) if max_length > 0])
+    
+    # タイトル行（セル結合）
+    row_number = 1
+    if 'title' in table_data and columns:
+        yield xlsx_row(row_number, [(table_data['title'], XLSX_TITLE)])
+        row_number += 1
+    
+    # ヘッダー行
+    if columns:
+        yield xlsx_row(row_number, [(header, XLSX_HEADER) for header in columns])
+        row_number += 1
+    
+    # データ行
+    for values in table_row_values(table_data, columns):
+        yield xlsx_row(row_number, [(value, XLSX_CELL) for value in values])
+        row_number += 1
+    
+    yield '</sheetData>'
+    if 'title' in table_data and columns:
+        last_column = _column_letter(len(columns))
+        yield f'<mergeCells count="1"><mergeCell ref="A1:{last_column}1"/></mergeCells>'
+    yield '</worksheet>'
+
+
+def table_sheet_xml(table_data):
+    """表データを write_table_sheet と同じ書式のワークシートXMLにする"""
+    return ''.join(iter_table_sheet_xml(table_data))
+
+
+def xlsx_package_parts(sheets):
+    """ワークシート以外のブックの構成部品（パス, XML）のリスト（sheets は（シート名, ワークシートのパス）のリスト）"""
+    relationship = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+    workbook = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+                f'xmlns:r="{relationship}">'
+                '<bookViews><workbookView activeTab="0"/></bookViews><sheets>'
+                + ''.join(f'<sheet name="{_xml_text(name)}" sheetId="{i}" r:id="rId{i}"/>'
+                          for i, (name, _) in enumerate(sheets, start=1))
+                + '</sheets></workbook>')
+    workbook_rels = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                     '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                     + ''.join(f'<Relationship Id="rId{i}" Type="{relationship}/worksheet" '
+                               f'Target="{member_name[len("xl/"):]}"/>'
+                               for i, (_, member_name) in enumerate(sheets, start=1))
+                     + f'<Relationship Id="rId{len(sheets) + 1}" Type="{relationship}/styles" '
+                       'Target="styles.xml"/></Relationships>')
+    content_type = "application/vnd.openxmlformats-officedocument.spreadsheetml"
+    content_types = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                     '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                     '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                     '<Default Extension="xml" ContentType="application/xml"/>'
+                     f'<Override PartName="/xl/workbook.xml" ContentType="{content_type}.sheet.main+xml"/>'
+                     f'<Override PartName="/xl/styles.xml" ContentType="{content_type}.styles+xml"/>'
+                     + ''.join(f'<Override PartName="/{member_name}" ContentType="{content_type}.worksheet+xml"/>'
+                               for _, member_name in sheets)
+                     + '</Types>')
+    root_rels = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                 '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                 f'<Relationship Id="rId1" Type="{relationship}/officeDocument" Target="xl/workbook.xml"/>'
+                 '</Relationships>')
+    return [
+        ("xl/workbook.xml", workbook),
+        ("xl/_rels/workbook.xml.rels", workbook_rels),
+        ("xl/styles.xml", XLSX_STYLES_XML),
+        ("[Content_Types].xml", content_types),
+        ("_rels/.rels", root_rels),
+    ]
+
+
+def _zip_dos_time(timestamp):
+    """ZIPのヘッダーに書く（時刻, 日付）"""
+    t = time.localtime(timestamp)
+    return ((t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+            ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday)
+
+
+def _zip_local_header(member):
+    name = member['name'].encode('utf-8')
+    return struct.pack('<4s5H3L2H', b'PK\x03\x04', 20, 0x0800, member['method'], member['time'], member['date'],
+                       member['crc'], member['compressed_size'], member['size'], len(name), 0) + name
+
+
+def zip_write_member(f, name, data, method=zipfile.ZIP_DEFLATED):
+    """ZIPのメンバーをファイルの現在位置に書き、中央ディレクトリに載せる情報（辞書）を返す"""
+    if method == zipfile.ZIP_DEFLATED:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+        payload = compressor.compress(data) + compressor.flush()
+    else:
+        payload = data
+    dos_time, dos_date = _zip_dos_time(time.time())
+    member = {'name': name, 'offset': f.tell(), 'method': method, 'time': dos_time, 'date': dos_date,
+              'crc': zlib.crc32(data), 'compressed_size': len(payload), 'size': len(data)}
+    f.write(_zip_local_header(member))
+    f.write(payload)
+    return member
+
+
+def zip_write_directory(f, members):
+    """ZIPの中央ディレクトリと終端レコードをファイルの現在位置に書き、それより後ろを切り詰める"""
+    start = f.tell()
+    for member in members:
+        name = member['name'].encode('utf-8')
+        f.write(struct.pack('<4s6H3L5H2L', b'PK\x01\x02', 20, 20, 0x0800, member['method'], member['time'],
+                            member['date'], member['crc'], member['compressed_size'], member['size'], len(name),
+                            0, 0, 0, 0, 0, member['offset']) + name)
+    size = f.tell() - start
+    f.write(struct.pack('<4s4H2LH', b'PK\x05\x06', 0, 0, len(members), len(members), size, start, 0))
+    f.truncate()
+
+
+class ConsolidatedWorkbook:
+    """変換結果を1つのExcelファイル（統合ブック）に追記していく
+    
+    layout が "sheets" なら元ファイル（複数ページのPDFはページ）ごとに1シートを追加し、"master" なら
+    「一覧」シートに元ファイル名・変換日時の列を付けて行を追加します。先頭の「目次」シートには
+    追記した表の一覧（各シート・行へのリンク付き）を載せます。
+    
+    xlsx は ZIP なので、追記済みのシートはファイルの前側にそのまま残し、後ろにある目次・ブックの構成情報と
+    ZIP の中央ディレクトリだけを書き直します。各シートの位置・CRC と追記済みの一覧は管理ファイル
+    （<ブック名>.manifest.json）に記録するため、追記のたびに既存のシートを読み込むことも書き直すこともありません。
+    一覧シートは無圧縮で保存し、追加した行だけを書き足して CRC を続きから計算します。
+    Excel などで上書き保存するとファイルの構成が変わるため、それ以降は追記できません。
+    """
+    
+    INDEX_COLUMNS = ("No.", "元ファイル", "シート", "行数", "変換日時")
+    INDEX_WIDTHS = ((1, 1, 6), (2, 2, 40), (3, 3, 30), (4, 4, 8), (5, 5, 18))
+    
+    def __init__(self, path, layout=DEFAULT_CONSOLIDATED_LAYOUT):
+        if layout not in CONSOLIDATED_LAYOUTS:
+            raise Exception(f"統合ブックの形式が正しくありません: {layout}")
+        self.path = Path(path)
+        self.layout = layout
+        self.manifest_path = self.path.with_name(self.path.name + ".manifest.json")
+    
+    @classmethod
+    def from_config(cls, config):
+        """設定（config.json の内容）から統合ブックを作成（統合ブックを使わない場合は None）"""
+        path = config.get('consolidated_workbook')
+        if not path:
+            return None
+        return cls(path, config.get('consolidated_layout', DEFAULT_CONSOLIDATED_LAYOUT))
+    
+    def entries(self):
+        """追記済みの表の一覧"""
+        with _consolidated_lock:
+            return self._load()['entries']
+    
+    def append(self, table_data, source_path, sheet_titles=None):
+        """表データを統合ブックに追記してブックのパスを返す（generate_excel と同じ引数）
+        
+        同じ内容の元ファイル・ページを追記済みなら、その表は追記しません。
+        """
+        try:
+            tables = table_data if isinstance(table_data, list) else [table_data]
+            if isinstance(table_data, list):
+                labels = sheet_titles or [f"{i}ページ" for i in range(1, len(tables) + 1)]
+            else:
+                labels = [None]
+            source = os.path.abspath(source_path)
+            input_hash = file_sha256(source) if os.path.exists(source) else None
+            
+            with _consolidated_lock:
+                manifest = self._load()
+                added = {(entry['source'], entry['input_hash'], entry['label']) for entry in manifest['entries']}
+                pending = [(label, table) for label, table in zip(labels, tables)
+                           if input_hash is None or (source, input_hash, label) not in added]
+                if not pending:
+                    print(f"統合ブックに追記済みのため省略します: {source}")
+                    return str(self.path)
+                
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.path, 'r+b' if self.path.exists() else 'w+b') as f:
+                    f.seek(manifest['data_end'])
+                    added_at = time.strftime('%Y-%m-%d %H:%M')
+                    for label, table in pending:
+                        entry = {'source': source, 'input_hash': input_hash, 'label': label, 'added_at': added_at,
+                                 'rows': len(table.get('rows', []))}
+                        if self.layout == 'sheets':
+                            self._add_sheet(f, manifest, entry, table)
+                        else:
+                            self._add_rows(f, manifest, entry, table)
+                        manifest['entries'].append(entry)
+                    if self.layout == 'master':
+                        self._close_master(f, manifest)
+                    manifest['data_end'] = f.tell()
+                    self._write_tail(f, manifest)
+                    f.flush()
+                    os.fsync(f.fileno())
+                self._save(manifest)
+            return str(self.path)
+        
+        except Exception as e:
+            raise Exception(f"統合ブックへの追記エラー: {str(e)}")
+    
+    def _new_manifest(self):
+        return {'version': 1, 'layout': self.layout, 'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'data_end': 0, 'members': [], 'entries': [], 'master': None}
+    
+    def _load(self):
+        """管理ファイルを読み込み、ブックが前回の追記のときのままか確認する"""
+        if not self.manifest_path.exists():
+            if self.path.exists():
+                raise Exception(f"管理ファイル（{self.manifest_path.name}）がありません。"
+                                "追記できるのはこのツールで作成した統合ブックだけです")
+            return self._new_manifest()
+        
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest['layout'] != self.layout:
+            raise Exception(f"統合ブックの形式（{manifest['layout']}）が設定（{self.layout}）と異なります")
+        if not self.path.exists():
+            print(f"統合ブックが見つからないため、新しく作成します: {self.path}")
+            return self._new_manifest()
+        
+        # 最後に追記したシートが記録どおりの位置にあるか（上書き保存されると位置が変わる）
+        if manifest['members']:
+            member = manifest['members'][-1]
+            header = _zip_local_header(member)
+            with open(self.path, 'rb') as f:
+                f.seek(member['offset'])
+                current = f.read(len(header))
+            if current[:4] != header[:4] or current[30:] != header[30:] or \
+                    os.path.getsize(self.path) < manifest['data_end']:
+                raise Exception("統合ブックが他のアプリで変更されたため追記できません。別の統合ブックを指定してください")
+        return manifest
+    
+    def _save(self, manifest):
+        """管理ファイルを保存（書き込み途中で中断しても壊れないよう置き換えで保存）"""
+        tmp_path = self.manifest_path.with_suffix(".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, self.manifest_path)
+    
+    def _sheet_name(self, manifest, entry):
+        """Excelで使える重複しないシート名（31文字まで）"""
+        name = Path(entry['source']).stem + (f"_{entry['label']}" if entry['label'] else "")
+        name = re.sub(r"[\[\]:*?/\\]", "_", name).strip("'") or "シート"
+        used = {member['sheet'].lower() for member in manifest['members']} | {CONSOLIDATED_INDEX_SHEET}
+        candidate = name[:EXCEL_MAX_SHEET_NAME]
+        counter = 2
+        while candidate.lower() in used:
+            suffix = f"({counter})"
+            candidate = name[:EXCEL_MAX_SHEET_NAME - len(suffix)] + suffix
+            counter += 1
+        return candidate
+    
+    def _add_sheet(self, f, manifest, entry, table):
+        """表を新しいシートとして書き足す"""
+        name = self._sheet_name(manifest, entry)
+        number = len(manifest['members']) + 2  # sheet1 は目次
+        member = zip_write_member(f, f"xl/worksheets/sheet{number}.xml", table_sheet_xml(table).encode('utf-8'))
+        member['sheet'] = name
+        manifest['members'].append(member)
+        entry.update(sheet=name, location=f"'{name.replace(chr(39), chr(39) * 2)}'!A1")
+    
+    def _add_rows(self, f, manifest, entry, table):
+        """表の行を一覧シートに書き足す（列が前の表と異なる場合はヘッダー行も書く）"""
+        master = manifest['master']
+        if master is None:
+            # 一覧シートは無圧縮で作り、サイズ・CRC は _close_master でヘッダーに書き込む
+            member = zip_write_member(f, "xl/worksheets/sheet2.xml", b"", zipfile.ZIP_STORED)
+            member['sheet'] = CONSOLIDATED_MASTER_SHEET
+            manifest['members'].append(member)
+            first, second = CONSOLIDATED_MASTER_WIDTHS
+            head = xlsx_worksheet_head([(1, 1, first), (2, 2, second),
+                                        (3, 2 + CONSOLIDATED_MASTER_MAX_COLUMNS, CONSOLIDATED_MASTER_COLUMN_WIDTH)])
+            head = head.encode('utf-8')
+            f.write(head)
+            master = manifest['master'] = {'rows_end': f.tell(), 'crc': zlib.crc32(head), 'size': len(head),
+                                           'next_row': 1, 'columns': None}
+        
+        columns = table_columns(table)
+        row_number = master['next_row']
+        rows = []
+        if columns != master['columns']:
+            rows.append(xlsx_row(row_number, [(header, XLSX_HEADER) for header in ("元ファイル", "変換日時", *columns)]))
+            master['columns'] = columns
+            row_number += 1
+        source_name = Path(entry['source']).name + (f"（{entry['label']}）" if entry['label'] else "")
+        entry.update(sheet=CONSOLIDATED_MASTER_SHEET, first_row=row_number,
+                     location=f"'{CONSOLIDATED_MASTER_SHEET}'!A{row_number}")
+        for values in table_row_values(table, columns):
+            cells = [(source_name, XLSX_CELL), (entry['added_at'], XLSX_CELL)]
+            rows.append(xlsx_row(row_number, cells + [(value, XLSX_CELL) for value in values]))
+            row_number += 1
+        
+        data = ''.join(rows).encode('utf-8')
+        f.seek(master['rows_end'])
+        f.write(data)
+        master.update(rows_end=f.tell(), crc=zlib.crc32(data, master['crc']), size=master['size'] + len(data),
+                      next_row=row_number)
+    
+    def _close_master(self, f, manifest):
+        """一覧シートの末尾を書き、ZIPのヘッダーのサイズ・CRCを更新する"""
+        master = manifest['master']
+        tail = XLSX_WORKSHEET_TAIL.encode('utf-8')
+        f.seek(master['rows_end'])
+        f.write(tail)
+        end = f.tell()
+        member = manifest['members'][0]
+        member['time'], member['date'] = _zip_dos_time(time.time())
+        member.update(crc=zlib.crc32(tail, master['crc']), size=master['size'] + len(tail),
+                      compressed_size=master['size'] + len(tail))
+        f.seek(member['offset'])
+        f.write(_zip_local_header(member))
+        f.seek(end)
+    
+    def _index_sheet_xml(self, manifest):
+        """目次シート（追記した表の一覧）"""
+        rows = [xlsx_row(1, [("統合ブック 目次", XLSX_TITLE)]),
+                xlsx_row(2, [(header, XLSX_HEADER) for header in self.INDEX_COLUMNS])]
+        links = []
+        for number, entry in enumerate(manifest['entries'], start=1):
+            row_number = number + 2
+            source_name = Path(entry['source']).name + (f"（{entry['label']}）" if entry['label'] else "")
+            sheet = entry['sheet'] if 'first_row' not in entry else f"{entry['sheet']} {entry['first_row']}行目〜"
+            rows.append(xlsx_row(row_number, [(number, XLSX_CELL), (source_name, XLSX_CELL), (sheet, XLSX_LINK),
+                                              (entry['rows'], XLSX_CELL), (entry['added_at'], XLSX_CELL)]))
+            links.append((f"C{row_number}", entry['location']))
+        last_column = _column_letter(len(self.INDEX_COLUMNS))
+        return xlsx_worksheet(rows, self.INDEX_WIDTHS, [f"A1:{last_column}1"], links)
+    
+    def _write_tail(self, f, manifest):
+        """目次シート・ブックの構成情報・中央ディレクトリを書き直す（追記のたびに作り直す部分）"""
+        if len(manifest['members']) + 6 > 0xFFFF or manifest['data_end'] > 0xFFFFFFFF:
+            raise Exception("統合ブックが大きすぎるため追記できません。別の統合ブックを指定してください")
+        sheets = [(CONSOLIDATED_INDEX_SHEET, "xl/worksheets/sheet1.xml")]
+        sheets += [(member['sheet'], member['name']) for member in manifest['members']]
+        
+        f.seek(manifest['data_end'])
+        tail_members = [zip_write_member(f, "xl/worksheets/sheet1.xml",
+                                         self._index_sheet_xml(manifest).encode('utf-8'))]
+        for name, xml in xlsx_package_parts(sheets):
+            tail_members.append(zip_write_member(f, name, xml.encode('utf-8')))
+        zip_write_directory(f, manifest['members'] + tail_members)
+
+
+def unique_column_names(columns):
+    """重複する列名に「_2」「_3」…を付けて一意にする"""
+    names = []
+    used = set()
+    for column in columns:
+        name = str(column)
+        counter = 2
+        while name in used:
+            name = f"{column}_{counter}"
+            counter += 1
+        used.add(name)
+        names.append(name)
+    return names
+
+
+def merged_columns(tables):
+    """複数の表の列名を、最初に出てきた順にまとめたリスト（重複する列名は一意にしてから）"""
+    columns = {}
+    for table in tables:
+        columns.update(dict.fromkeys(unique_column_names(table_columns(table))))
+    return list(columns)
+
+
+def aligned_row_values(table_data, columns, missing=''):
+    """表データの各行を、columns（merged_columns の列名）の順に並べた値のリストとして返す（ない列は missing）"""
+    own = unique_column_names(table_columns(table_data))
+    if own == columns:
+        yield from table_row_values(table_data)
+        return
+    positions = {name: index for index, name in enumerate(columns)}
+    indexes = [positions[name] for name in own]
+    for values in table_row_values(table_data):
+        row = [missing] * len(columns)
+        for index, value in zip(indexes, values):
+            row[index] = value
+        yield row
+
+
+class TableExporter(abc.ABC):
+    """表データの書き出し方式（出力形式ごとにサブクラスを作り、EXPORTERS に登録する）
+    
+    write には表データとシート名のリスト（複数ページのPDFはページ数分）、書き出し先、元ファイルのパスを渡します。
+    """
+    
+    extension = ".xlsx"
+    error_message = "Excel生成エラー"
+    
+    @classmethod
+    def from_engine(cls, engine):
+        """変換エンジンの設定から作成"""
+        return cls()
+    
+    @abc.abstractmethod
+    def write(self, tables, titles, output_path, source_path):
+        """表データを output_path に書き出す（サブクラスで実装する）"""
+
+
+class ExcelExporter(TableExporter):
+    """openpyxl で書式付きのExcelファイルを書き出す（大きな表は write-only の省メモリモード）"""
+    
+    def __init__(self, excel_writer=DEFAULT_EXCEL_WRITER):
+        self.excel_writer = excel_writer  # "auto" / "styled" / "streaming"
+    
+    @classmethod
+    def from_engine(cls, engine):
+        return cls(engine.excel_writer)
+    
+    def write(self, tables, titles, output_path, source_path):
+        # 大きな表は行を順に書き出す省メモリモード（write-only）で出力する
+        streaming = self.excel_writer == "streaming" or (
+            self.excel_writer == "auto"
+            and sum(len(t.get('rows', [])) * max(1, len(t.get('columns', []))) for t in tables)
+            >= EXCEL_STREAMING_MIN_CELLS
+        )
+        
+        wb = openpyxl.Workbook(write_only=streaming)
+        register_named_styles(wb)
+        for index, (title, sheet_data) in enumerate(zip(titles, tables)):
+            if streaming:
+                write_table_sheet_streaming(wb.create_sheet(title), sheet_data)
+            else:
+                ws = wb.active if index == 0 else wb.create_sheet()
+                ws.title = title
+                write_table_sheet(ws, sheet_data)
+        wb.save(str(output_path))
+
+
+class StreamingXlsxExporter(TableExporter):
+    """openpyxl を使わずにワークシートのXMLを直接書き出す（同じ書式、行数によらず一定のメモリ）"""
+    
+    def write(self, tables, titles, output_path, source_path):
+        sheets = []
+        with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for number, (title, sheet_data) in enumerate(zip(titles, tables), start=1):
+                member_name = f"xl/worksheets/sheet{number}.xml"
+                with zf.open(member_name, 'w') as member:
+                    # 1行ずつ圧縮すると遅いため、ある程度まとめてから書き込む
+                    buffer = []
+                    size = 0
+                    for chunk in iter_table_sheet_xml(sheet_data):
+                        buffer.append(chunk)
+                        size += len(chunk)
+                        if size >= EXPORT_WRITE_CHUNK_CHARS:
+                            member.write(''.join(buffer).encode('utf-8'))
+                            buffer = []
+                            size = 0
+                    member.write(''.join(buffer).encode('utf-8'))
+                sheets.append((title, member_name))
+            for name, xml in xlsx_package_parts(sheets):
+                zf.writestr(name, xml)
+
+
+class CsvExporter(TableExporter):
+    """CSV（Excel で開けるよう BOM 付き UTF-8）に書き出す
+    
+    複数ページの場合は1つのファイルにまとめ、先頭に「シート」列を付けます（列はページをまたいでそろえる）。
+    """
+    
+    extension = ".csv"
+    error_message = "CSV出力エラー"
+    
+    def write(self, tables, titles, output_path, source_path):
+        columns = merged_columns(tables)
+        multi = len(tables) > 1
+        with open(output_path, 'w', encoding=CSV_ENCODING, newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow((["シート"] if multi else []) + columns)
+            for title, table in zip(titles, tables):
+                prefix = [title] if multi else []
+                writer.writerows(prefix + values for values in aligned_row_values(table, columns))
+
+
+class JsonLinesExporter(TableExporter):
+    """1行1つのJSONオブジェクト（元ファイル名・シート名・行番号と、列名をキーにした値）に書き出す"""
+    
+    extension = ".jsonl"
+    error_message = "JSON Lines出力エラー"
+    
+    def write(self, tables, titles, output_path, source_path):
+        source = os.path.basename(source_path)
+        with open(output_path, 'w', encoding='utf-8') as f:
+            for title, table in zip(titles, tables):
+                columns = unique_column_names(table_columns(table))
+                for row_number, values in enumerate(table_row_values(table), start=1):
+                    record = {'source': source, 'sheet': title, 'row': row_number,
+                              'values': dict(zip(columns, values))}
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+class ParquetExporter(TableExporter):
+    """Parquet（分析用）に書き出す（pyarrow が必要）
+    
+    元ファイル名・シート名・行番号の列に続けて表の列（すべて文字列）を並べ、ページごとに1つの行グループにします。
+    """
+    
+    extension = ".parquet"
+    error_message = "Parquet出力エラー"
+    
+    def write(self, tables, titles, output_path, source_path):
+        try:
+            pa, pq = _import_pyarrow()
+        except ImportError:
+            raise Exception("Parquet の出力には pyarrow が必要です（pip install pyarrow）")
+        
+        columns = merged_columns(tables)
+        names = unique_column_names(['source', 'sheet', 'row', *columns])
+        schema = pa.schema([(names[0], pa.string()), (names[1], pa.string()), (names[2], pa.int32())]
+                           + [(name, pa.string()) for name in names[3:]])
+        source = os.path.basename(source_path)
+        with pq.ParquetWriter(str(output_path), schema) as writer:
+            for title, table in zip(titles, tables):
+                rows = list(aligned_row_values(table, columns, missing=None))
+                data = {names[0]: [source] * len(rows), names[1]: [title] * len(rows),
+                        names[2]: list(range(1, len(rows) + 1))}
+                for index, name in enumerate(names[3:]):
+                    data[name] = [None if row[index] is None else str(row[index]) for row in rows]
+                writer.write_table(pa.Table.from_pydict(data, schema=schema))
+
+
+# 出力形式 → 書き出し方式
+EXPORTERS = {
+    'xlsx': ExcelExporter,
+    'xlsx_stream': StreamingXlsxExporter,
+    'csv': CsvExporter,
+    'jsonl': JsonLinesExporter,
+    'parquet': ParquetExporter,
+}
+
+
+class ConversionMetrics:
+    """1回の変換の計測値（段階ごとの時間・トークン数・送信量・行数）
+    
+    複数ページや分割解析で並列に処理した段階は、各処理の時間を合計します。
+    """
+    
+    def __init__(self, source_path, model):
+        self.source = str(source_path)
+        self.model = model
+        self.response_schema = None
+        self.batch_id = None  # 一括モードで送信したバッチのID
+        self.timestamp = time.strftime('%Y-%m-%dT%H:%M:%S%z')
+        self.stages = {}
+        self.counters = {'api_calls': 0, 'retries': 0, 'continuations': 0, 'cache_hits': 0, 'duplicate_hits': 0,
+                         'payload_bytes': 0, 'rows': 0, 'connections_opened': 0, 'connections_reused': 0}
+        self.counters.update(dict.fromkeys(TOKEN_USAGE_FIELDS, 0))
+        self.columns = 0
+        self.stop_reasons = []
+        self.responses = []  # 受信したレスポンスのテキスト（ジョブストア用、ログには書き出さない）
+        self.first_token_seconds = None
+        self.total_seconds = None
+        self.output = None
+        self.error = None
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+    
+    @contextlib.contextmanager
+    def stage(self, name):
+        """with ブロックの処理時間を段階 name の時間として記録"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - started)
+    
+    def add_stage(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+    
+    def add(self, **counts):
+        with self._lock:
+            for key, value in counts.items():
+                self.counters[key] = self.counters.get(key, 0) + value
+    
+    def add_response(self, message, first_token_seconds=None, text=None):
+        """APIレスポンスのトークン数・停止理由（text を渡すとレスポンスのテキストも）を記録"""
+        usage = getattr(message, 'usage', None)
+        with self._lock:
+            self.counters['api_calls'] += 1
+            if text is not None:
+                self.responses.append(text)
+            for key in TOKEN_USAGE_FIELDS:
+                self.counters[key] += getattr(usage, key, None) or 0
+            self.stop_reasons.append(getattr(message, 'stop_reason', None))
+            if first_token_seconds is not None and (
+                    self.first_token_seconds is None or first_token_seconds < self.first_token_seconds):
+                self.first_token_seconds = first_token_seconds
+    
+    def add_table(self, table_data):
+        with self._lock:
+            self.counters['rows'] += len(table_data.get('rows', []))
+            self.columns = max(self.columns, len(table_data.get('columns', [])))
+    
+    def finish(self, output=None, error=None):
+        self.total_seconds = time.perf_counter() - self._started
+        self.output = str(output) if output else None
+        self.error = str(error) if error else None
+    
+    def to_record(self):
+        """ログに書き出す辞書を返す"""
+        return {
+            'timestamp': self.timestamp,
+            'source': self.source,
+            'model': self.model,
+            'response_schema': self.response_schema,
+            'batch_id': self.batch_id,
+            'status': 'error' if self.error else 'ok',
+            'error': self.error,
+            'output': self.output,
+            'total_seconds': round(self.total_seconds or 0.0, 3),
+            'stages': {name: round(seconds, 3) for name, seconds in self.stages.items()},
+            'first_token_seconds': round(self.first_token_seconds, 3) if self.first_token_seconds else None,
+            'stop_reasons': self.stop_reasons,
+            'columns': self.columns,
+            **self.counters,
+        }
+    
+    def summary(self):
+        """画面表示用の要約"""
+        parts = [f"{self.total_seconds or 0.0:.1f}秒"]
+        if 'api' in self.stages:
+            parts.append(f"API {self.stages['api']:.1f}秒")
+        if self.counters['api_calls']:
+            parts.append(f"入力 {self.counters['input_tokens']:,}・出力 {self.counters['output_tokens']:,}トークン")
+        if self.counters['cache_read_input_tokens']:
+            parts.append(f"プロンプトキャッシュ {self.counters['cache_read_input_tokens']:,}トークン")
+        if self.counters['retries']:
+            parts.append(f"再試行 {self.counters['retries']}回")
+        if self.counters['continuations']:
+            parts.append(f"続きの要求 {self.counters['continuations']}回")
+        if self.counters['connections_reused']:
+            parts.append(f"接続の再利用 {self.counters['connections_reused']}/"
+                         f"{self.counters['connections_reused'] + self.counters['connections_opened']}回")
+        if self.counters['cache_hits']:
+            parts.append(f"キャッシュ {self.counters['cache_hits']}件")
+        if self.counters['duplicate_hits']:
+            parts.append(f"類似画像の結果を再利用 {self.counters['duplicate_hits']}件")
+        parts.append(f"{self.counters['rows']}行")
+        return " / ".join(parts)
+
+
+class MetricsLog:
+    """計測値を1行1件のJSON（JSONL）で追記するログ（サイズでローテーション）"""
+    
+    def __init__(self, path=METRICS_FILE, max_bytes=METRICS_MAX_BYTES, backup_count=METRICS_BACKUP_COUNT):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._logger = None
+        self._lock = threading.Lock()
+    
+    def _get_logger(self):
+        with self._lock:
+            if self._logger is None:
+                # 同じファイルのロガーは共有する（ハンドラーを重複させない）
+                logger = logging.getLogger(f"{__name__}.metrics.{self.path.resolve()}")
+                if not logger.handlers:
+                    self.path.parent.mkdir(parents=True, exist_ok=True)
+                    handler = RotatingFileHandler(self.path, maxBytes=self.max_bytes,
+                                                  backupCount=self.backup_count, encoding='utf-8')
+                    handler.setFormatter(logging.Formatter('%(message)s'))
+                    logger.setLevel(logging.INFO)
+                    logger.propagate = False
+                    logger.addHandler(handler)
+                self._logger = logger
+            return self._logger
+    
+    def write(self, metrics):
+        """ConversionMetrics を1行追記"""
+        try:
+            self._get_logger().info(json.dumps(metrics.to_record(), ensure_ascii=False))
+        except OSError as e:
+            print(f"計測ログ書き込みエラー: {e}")
+    
+    def read_records(self):
+        """ローテーション済みのファイルも含めて、記録を古い順に返す"""
+        paths = [Path(f"{self.path}.{i}") for i in range(self.backup_count, 0, -1)] + [self.path]
+        for path in paths:
+            if not path.exists():
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+    
+    def monthly_summary(self):
+        """月・応答形式ごとの件数・平均時間・トークン数を集計（キーは（月, 応答形式））"""
+        months = {}
+        for record in self.read_records():
+            key = (record.get('timestamp', '')[:7], record.get('response_schema') or 'objects')
+            month = months.setdefault(key, {
+                'conversions': 0, 'errors': 0, 'total_seconds': 0.0, 'api_seconds': 0.0,
+                'input_tokens': 0, 'output_tokens': 0, 'rows': 0,
+            })
+            month['conversions'] += 1
+            month['errors'] += record.get('status') == 'error'
+            month['total_seconds'] += record.get('total_seconds') or 0.0
+            month['api_seconds'] += (record.get('stages') or {}).get('api', 0.0)
+            for key in ('input_tokens', 'output_tokens', 'rows'):
+                month[key] += record.get(key) or 0
+        return months
+
+
+class TokenBucket:
+    """1分あたり per_minute 個まで取得できるトークンバケット（最大で1分ぶん貯められる）
+    
+    見積もりより多く使った場合は残量がマイナスになり、その分だけ次の取得が遅れます。
+    """
+    
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self._updated = time.monotonic()
+    
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+    
+    def wait_time(self, amount):
+        """amount 個を取得できるまでの秒数（容量を超える量は満杯になるまで待つ）"""
+        self._refill()
+        return max(0.0, (min(amount, self.capacity) - self.level) / self.rate)
+    
+    def consume(self, amount):
+        self._refill()
+        self.level -= amount
+
+
+class RateLimiter:
+    """API呼び出しの同時実行数とレート制限（リクエスト数・入力/出力トークン数）を守るための制御（asyncio 用）
+    
+    出力トークン数は送信時に見積もりで確保し、応答後に実際の値との差を精算します。
+    """
+    
+    def __init__(self, requests_per_minute=DEFAULT_RATE_LIMIT_RPM,
+                 input_tokens_per_minute=DEFAULT_RATE_LIMIT_INPUT_TPM,
+                 output_tokens_per_minute=DEFAULT_RATE_LIMIT_OUTPUT_TPM,
+                 max_concurrency=DEFAULT_API_CONCURRENCY):
+        self.buckets = {
+            'requests': TokenBucket(requests_per_minute),
+            'input_tokens': TokenBucket(input_tokens_per_minute),
+            'output_tokens': TokenBucket(output_tokens_per_minute),
+        }
+        self.max_concurrency = max_concurrency
+        self.throttled_seconds = 0.0
+        self._paused_until = 0.0
+        self._loop = None
+        self._semaphore = None
+        self._lock = None
+    
+    @classmethod
+    def from_config(cls, config):
+        """設定（config.json の内容）からレート制限を作成"""
+        return cls(
+            requests_per_minute=config.get('rate_limit_rpm', DEFAULT_RATE_LIMIT_RPM),
+            input_tokens_per_minute=config.get('rate_limit_input_tpm', DEFAULT_RATE_LIMIT_INPUT_TPM),
+            output_tokens_per_minute=config.get('rate_limit_output_tpm', DEFAULT_RATE_LIMIT_OUTPUT_TPM),
+            max_concurrency=config.get('api_concurrency', DEFAULT_API_CONCURRENCY),
+        )
+    
+    def _primitives(self):
+        # asyncio の同期プリミティブはイベントループごとに作り直す
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(max(1, self.max_concurrency))
+            self._lock = asyncio.Lock()
+        return self._semaphore, self._lock
+    
+    @contextlib.asynccontextmanager
+    async def slot(self, input_tokens, output_tokens):
+        """API呼び出し1回分の枠（同時実行数とレート制限）を確保する"""
+        semaphore, _ = self._primitives()
+        async with semaphore:
+            await self.acquire(input_tokens, output_tokens)
+            yield
+    
+    async def acquire(self, input_tokens, output_tokens):
+        """すべてのバケットから取得できるまで待つ（待っている呼び出しは到着順に処理）"""
+        _, lock = self._primitives()
+        amounts = {'requests': 1, 'input_tokens': input_tokens, 'output_tokens': output_tokens}
+        async with lock:
+            while True:
+                delay = max([self._paused_until - time.monotonic()] +
+                            [bucket.wait_time(amounts[name]) for name, bucket in self.buckets.items()])
+                if delay <= 0:
+                    break
+                self.throttled_seconds += delay
+                await asyncio.sleep(delay)
+            for name, bucket in self.buckets.items():
+                bucket.consume(amounts[name])
+    
+    def settle(self, name, estimated, actual):
+        """見積もりで確保した量と実際の使用量の差を精算"""
+        self.buckets[name].consume(actual - estimated)
+    
+    def pause(self, seconds):
+        """retry-after を指定された場合など、全体の送信を一定時間止める"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+_connection_metrics = contextvars.ContextVar('connection_metrics', default=None)
+
+
+@contextlib.contextmanager
+def track_connections(metrics):
+    """with ブロック内の API 呼び出しが新しく開いた接続・再利用した接続の数を metrics に記録する"""
+    token = _connection_metrics.set(metrics)
+    try:
+        yield
+    finally:
+        _connection_metrics.reset(token)
+
+
+class ClientPool:
+    """API キーごとに1つの Anthropic クライアントを作成し、変換・スレッドをまたいで使い回す
+    
+    クライアントは最初に使うときに作成し、接続プール（同時接続数・keep-alive の本数と秒数）と
+    タイムアウトを設定します。使い終わった接続はプールに戻るので、次の呼び出しは TCP・TLS の
+    接続を省略できます。非同期クライアントは接続がイベントループに結び付くため、ループごとに作成します。
+    各リクエストが新しく接続したか・プールの接続を再利用したかを数え、全体の値を counters に、
+    track_connections で指定した ConversionMetrics にも記録します。
+    """
+    
+    _shared = {}  # 設定 → ClientPool（同じ設定ならアプリ全体で1つ）
+    _shared_lock = threading.Lock()
+    
+    def __init__(self, max_connections=HTTP_MAX_CONNECTIONS, keepalive_connections=HTTP_KEEPALIVE_CONNECTIONS,
+                 keepalive_seconds=HTTP_KEEPALIVE_SECONDS, connect_timeout=HTTP_CONNECT_TIMEOUT,
+                 read_timeout=HTTP_READ_TIMEOUT, prewarm_enabled=True):
+        self.max_connections = max_connections
+        self.keepalive_connections = keepalive_connections
+        self.keepalive_seconds = keepalive_seconds
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.prewarm_enabled = prewarm_enabled  # 起動後・一括変換の開始時に接続を開いておくか
+        self.counters = {'clients': 0, 'connections_opened': 0, 'connections_reused': 0, 'prewarmed': 0}
+        self._clients = {}  # API キー → （クライアント, httpx のクライアント）
+        self._async_clients = weakref.WeakKeyDictionary()  # イベントループ → {API キー → （クライアント, httpx のクライアント）}
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def from_config(cls, config):
+        """設定（config.json の内容）から取得（同じ設定なら作成済みのものを返す）"""
+        options = {
+            'max_connections': config.get('http_max_connections', HTTP_MAX_CONNECTIONS),
+            'keepalive_connections': config.get('http_keepalive_connections', HTTP_KEEPALIVE_CONNECTIONS),
+            'keepalive_seconds': config.get('http_keepalive_seconds', HTTP_KEEPALIVE_SECONDS),
+            'connect_timeout': config.get('http_connect_timeout', HTTP_CONNECT_TIMEOUT),
+            'read_timeout': config.get('http_read_timeout', HTTP_READ_TIMEOUT),
+            'prewarm_enabled': config.get('http_prewarm', True),
+        }
+        key = tuple(sorted(options.items()))
+        with cls._shared_lock:
+            if key not in cls._shared:
+                cls._shared[key] = cls(**options)
+            return cls._shared[key]
+    
+    def client(self, api_key):
+        """API キーの同期クライアント（再試行は ConversionEngine で行うので SDK では再試行しない）"""
+        with self._lock:
+            if api_key not in self._clients:
+                self._clients[api_key] = self._create(api_key, asynchronous=False)
+            return self._clients[api_key][0]
+    
+    def async_client(self, api_key):
+        """実行中のイベントループで使う API キーの非同期クライアント"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients = self._async_clients.setdefault(loop, {})
+            if api_key not in clients:
+                clients[api_key] = self._create(api_key, asynchronous=True)
+            return clients[api_key][0]
+    
+    def _create(self, api_key, asynchronous):
+        # httpx は anthropic が依存しているものを使う（Limits は既定値の型から作る）
+        limits = type(anthropic.DEFAULT_CONNECTION_LIMITS)(max_connections=self.max_connections,
+                                                           max_keepalive_connections=self.keepalive_connections,
+                                                           keepalive_expiry=self.keepalive_seconds)
+        timeout = anthropic.Timeout(self.read_timeout, connect=self.connect_timeout)
+        if asynchronous:
+            http_client = anthropic.DefaultAsyncHttpxClient(limits=limits, timeout=timeout,
+                                                            event_hooks={'request': [self._on_request_async]})
+            client = anthropic.AsyncAnthropic(api_key=api_key, max_retries=0, timeout=timeout,
+                                              http_client=http_client)
+        else:
+            http_client = anthropic.DefaultHttpxClient(limits=limits, timeout=timeout,
+                                                       event_hooks={'request': [self._on_request]})
+            client = anthropic.Anthropic(api_key=api_key, max_retries=0, timeout=timeout, http_client=http_client)
+        self.counters['clients'] += 1
+        return client, http_client
+    
+    def _on_request(self, request):
+        # httpcore の trace 拡張で、このリクエストが新しく接続したかを知る
+        request.extensions['trace'] = self._tracer(_connection_metrics.get())
+    
+    async def _on_request_async(self, request):
+        trace = self._tracer(_connection_metrics.get())
+        
+        async def async_trace(event_name, info):
+            trace(event_name, info)
+        
+        request.extensions['trace'] = async_trace
+    
+    def _tracer(self, metrics):
+        connected = []
+        
+        def trace(event_name, info):
+            if event_name.endswith(('.connect_tcp.started', '.connect_unix_socket.started')):
+                connected.append(True)
+            elif event_name.endswith('.send_request_headers.started'):
+                key = 'connections_opened' if connected else 'connections_reused'
+                connected.clear()
+                with self._lock:
+                    self.counters[key] += 1
+                if metrics is not None:
+                    metrics.add(**{key: 1})
+        
+        return trace
+    
+    def prewarm(self, api_key):
+        """クライアントを作成して接続を開いておく（TCP・TLS の接続を最初の解析の前に済ませる、バックグラウンド用）"""
+        try:
+            client = self.client(api_key)
+            with self._lock:
+                http_client = self._clients[api_key][1]
+            http_client.head(str(client.base_url))
+        except Exception as e:
+            print(f"APIサーバーへの事前接続に失敗しました（解析時に接続します）: {e}")
+            return False
+        with self._lock:
+            self.counters['prewarmed'] += 1
+        return True
+    
+    async def prewarm_async(self, api_key):
+        """prewarm の非同期クライアント版（実行中のイベントループのクライアントの接続を開く）"""
+        try:
+            client = self.async_client(api_key)
+            with self._lock:
+                http_client = self._async_clients[asyncio.get_running_loop()][api_key][1]
+            await http_client.head(str(client.base_url))
+        except Exception as e:
+            print(f"APIサーバーへの事前接続に失敗しました（解析時に接続します）: {e}")
+            return False
+        with self._lock:
+            self.counters['prewarmed'] += 1
+        return True
+    
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
+
+
+def retry_after_seconds(error):
+    """APIエラーの retry-after ヘッダーの秒数を返す（指定がなければ None）"""
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    try:
+        if 'retry-after-ms' in headers:
+            return float(headers['retry-after-ms']) / 1000
+        if 'retry-after' in headers:
+            return float(headers['retry-after'])
+    except (TypeError, ValueError):
+        pass  # 日付形式の retry-after は使わない
+    return None
+
+
+def is_retryable_error(error):
+    """再試行すれば成功する見込みのあるエラーか（レート制限・過負荷・一時的な通信エラー）"""
+    if isinstance(error, anthropic.APIConnectionError):  # タイムアウトを含む
+        return True
+    if getattr(error, 'status_code', None) in RETRYABLE_STATUS_CODES:
+        return True
+    # ストリーミング中に受信したエラーイベント（overloaded_error など）
+    body = getattr(error, 'body', None)
+    error_type = body.get('error', {}).get('type') if isinstance(body, dict) else None
+    return error_type in ('overloaded_error', 'rate_limit_error', 'api_error')
+
+
+def backoff_delay(attempt, retry_after=None):
+    """再試行までの待ち時間（指数バックオフ＋フルジッター、retry-after の指定があればそれ以上待つ）"""
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def render_preview(filepath, max_size=PREVIEW_MAX_SIZE):
+    """プレビュー用の縮小画像を作成し、（画像, PDFのページ数）を返す（画像ファイルのページ数は None）
+    
+    JPEG は draft モードで縮小しながらデコードし、PDF は表示サイズに合わせた倍率で1ページ目だけを描画します。
+    """
+    max_width, max_height = max_size
+    if is_pdf_file(filepath):
+        doc = fitz.open(filepath)
+        try:
+            page_count = len(doc)
+            page = doc[0]
+            zoom = min(max_width / page.rect.width, max_height / page.rect.height, 1.5)
+            pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+        finally:
+            doc.close()
+    else:
+        page_count = None
+        with Image.open(filepath) as opened:
+            # EXIF で90度回転する画像は、回転後に表示サイズを満たすよう縦横を入れ替えて縮小デコードする
+            rotated = opened.getexif().get(0x0112) in (5, 6, 7, 8)
+            opened.draft('RGB', (max_height, max_width) if rotated else (max_width, max_height))
+            img = ImageOps.exif_transpose(opened)
+            img.load()
+    
+    img.thumbnail((max_width, max_height), Image.Resampling.LANCZOS)
+    return img, page_count
+
+
+class ThumbnailCache:
+    """プレビュー画像のLRUキャッシュ（パス・更新時刻・サイズをキーにメモリに保持）"""
+    
+    def __init__(self, max_entries=PREVIEW_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def make_key(filepath):
+        stat = os.stat(filepath)
+        return (os.path.abspath(filepath), stat.st_mtime_ns, stat.st_size)
+    
+    def get(self, key):
+        """（画像, ページ数）を返す（なければ None）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+    
+    def put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class ExtractionCancelled(Exception):
+    """解析が中止されたことを表す例外"""
+
+
+class ConversionJob:
+    """非同期パイプラインで変換する1ファイル（個別に中止できる）"""
+    
+    def __init__(self, source_path, pages=1, output_format=None):
+        self.source_path = source_path
+        self.pages = pages
+        self.output_format = output_format  # None の場合はエンジンの出力形式
+        self.metrics = None
+        self.checkpoint = None  # JobCheckpoint（ジョブストアに段階ごとの結果を保存する場合）
+        self.cancel_event = threading.Event()
+        self._futures = set()  # 実行中のAPI呼び出し（イベントループ上のタスク）
+        self._lock = threading.Lock()
+    
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+    
+    def cancel(self):
+        """この変換を中止する（実行中のAPI呼び出しも中断する）"""
+        self.cancel_event.set()
+        with self._lock:
+            futures = list(self._futures)
+        for future in futures:
+            future.cancel()
+    
+    def run_on_loop(self, coroutine, loop):
+        """変換スレッドから、イベントループ上でコルーチンを実行して結果を待つ"""
+        if self.cancelled:
+            coroutine.close()
+            raise ExtractionCancelled("解析を中止しました")
+        future = asyncio.run_coroutine_threadsafe(coroutine, loop)
+        with self._lock:
+            self._futures.add(future)
+        try:
+            return future.result()
+        except concurrent.futures.CancelledError:
+            raise ExtractionCancelled("解析を中止しました")
+        finally:
+            with self._lock:
+                self._futures.discard(future)
+
+
+class IncrementalTableParser:
+    """ストリーミング受信中のJSONテキストから "rows" の要素を1行ずつ取り出すパーサー
+    
+    受信済みのテキストを1文字ずつ一度だけ走査し、文字列・エスケープ・括弧の深さを追跡します。
+    途中で途切れたテキストでも、それまでに完成した title・columns・行を取り出せます。
+    """
+    
+    def __init__(self):
+        self.text = ''
+        self.title = None
+        self.columns = None
+        self.rows = []
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._last_string = None
+        self._key = None
+        self._expect_value = False
+        self._section = None
+        self._section_start = None
+        self._item_start = None
+    
+    def feed(self, chunk):
+        """受信したテキストを追加し、新たに完成した行のリストを返す"""
+        self.text += chunk
+        text = self.text
+        new_rows = []
+        
+        for i in range(self._pos, len(text)):
+            ch = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._last_string = text[self._string_start + 1:i]
+                    if self._depth == 1 and self._expect_value and self._key == 'title':
+                        self.title = json.loads(text[self._string_start:i + 1])
+            elif ch == '"':
+                if self._depth > 0:
+                    self._in_string = True
+                    self._string_start = i
+            elif ch == ':' and self._depth == 1:
+                self._key = self._last_string
+                self._expect_value = True
+            elif ch == ',' and self._depth == 1:
+                self._expect_value = False
+            elif ch in '{[':
+                self._depth += 1
+                if self._depth == 2 and ch == '[' and self._key in ('rows', 'columns'):
+                    self._section = self._key
+                    self._section_start = i
+                elif self._depth == 3 and self._section == 'rows':
+                    self._item_start = i
+            elif ch in '}]' and self._depth > 0:
+                if self._depth == 3 and self._item_start is not None:
+                    row = json.loads(text[self._item_start:i + 1])
+                    self.rows.append(row)
+                    new_rows.append(row)
+                    self._item_start = None
+                elif self._depth == 2 and self._section is not None:
+                    if self._section == 'columns':
+                        self.columns = json.loads(text[self._section_start:i + 1])
+                    self._section = None
+                self._depth -= 1
+        
+        self._pos = len(text)
+        return new_rows
+
+
+class ExtractionCache:
+    """Claudeの解析結果（table_data）を保存するディスクキャッシュ
+    
+    キーは画像データ・プロンプト・モデル名のハッシュ。
+    最終アクセス時刻（mtime）を使ったLRUで、容量と保存期間を超えた分を削除します。
+    合計サイズは最初に1度だけ数えて保存・削除のたびに更新し、ディレクトリ全体を調べるのは
+    上限を超えたときと CACHE_AGE_CHECK_INTERVAL ごとだけにします。
+    """
+    
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_MB * 1024 * 1024,
+                 max_age_days=DEFAULT_CACHE_MAX_AGE_DAYS, enabled=True):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.max_age = max_age_days * 24 * 60 * 60 if max_age_days else None
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._total_bytes = None  # 最初に必要になったときに数える
+        self._next_age_check = 0.0
+    
+    @classmethod
+    def from_config(cls, config, enabled=None):
+        """設定（config.json の内容）からキャッシュを作成"""
+        return cls(
+            cache_dir=config.get('cache_dir', CACHE_DIR),
+            max_bytes=int(config.get('cache_max_mb', DEFAULT_CACHE_MAX_MB)) * 1024 * 1024,
+            max_age_days=config.get('cache_max_age_days', DEFAULT_CACHE_MAX_AGE_DAYS),
+            enabled=config.get('cache_enabled', True) if enabled is None else enabled,
+        )
+    
+    @staticmethod
+    def make_key(image_data, prompt, model):
+        """キャッシュキー（SHA-256）を計算"""
+        digest = hashlib.sha256()
+        for part in (model, prompt, image_data):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+    
+    def _entry_path(self, key):
+        return self.cache_dir / f"{key}.json"
+    
+    def get(self, key):
+        """キャッシュされた table_data を返す（なければ None）"""
+        path = self._entry_path(key)
+        with self._lock:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    table_data = json.load(f)
+            except (OSError, ValueError):
+                self.misses += 1
+                return None
+            
+            stat = path.stat()
+            if self.max_age and time.time() - stat.st_mtime > self.max_age:
+                self._remove(path, stat.st_size)
+                self.misses += 1
+                return None
+            
+            # 最終アクセス時刻を更新（LRU）
+            os.utime(path)
+            self.hits += 1
+            return table_data
+    
+    def put(self, key, table_data):
+        """table_data を保存し、上限を超えた古いエントリを削除"""
+        with self._lock:
+            try:
+                self.cache_dir.mkdir(parents=True, exist_ok=True)
+                path = self._entry_path(key)
+                total = self._cache_size()
+                tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(table_data, f, ensure_ascii=False)
+                    size = f.tell()
+                # 同じキーを上書きする場合は、前のエントリの分を差し引く
+                try:
+                    total -= path.stat().st_size
+                except OSError:
+                    pass
+                os.replace(tmp_path, path)
+                self._total_bytes = total + size
+                self._evict()
+            except OSError as e:
+                print(f"キャッシュ保存エラー: {e}")
+    
+    def clear(self):
+        """キャッシュをすべて削除"""
+        with self._lock:
+            for path in self.cache_dir.glob("*.json"):
+                self._remove(path)
+    
+    def stats(self):
+        """ヒット/ミス件数を返す"""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+    
+    def _remove(self, path, size=None):
+        try:
+            if size is None:
+                size = path.stat().st_size
+            path.unlink()
+            self.evictions += 1
+        except OSError:
+            return
+        if self._total_bytes is not None:
+            self._total_bytes = max(0, self._total_bytes - size)
+    
+    def _scan(self):
+        """キャッシュのエントリを（最終アクセス時刻, サイズ, パス）の古い順のリストで返す"""
+        entries = []
+        for path in self.cache_dir.glob("*.json"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        return entries
+    
+    def _cache_size(self):
+        """キャッシュの合計サイズ（最初の呼び出しでだけディレクトリを数える）"""
+        if self._total_bytes is None:
+            self._total_bytes = sum(size for _, size, _ in self._scan())
+        return self._total_bytes
+    
+    def _evict(self):
+        """保存期間切れ・容量超過のエントリを古い順に削除（上限以内で確認の間隔内なら何もしない）"""
+        now = time.time()
+        age_check = bool(self.max_age) and now >= self._next_age_check
+        over = self._cache_size() > self.max_bytes
+        if not over and not age_check:
+            return
+        
+        # 他のプロセスが書き込んだ分も含めて数え直す
+        entries = self._scan()
+        self._total_bytes = sum(size for _, size, _ in entries)
+        target = self.max_bytes * CACHE_EVICT_TARGET if over else self.max_bytes
+        for mtime, size, path in entries:
+            expired = self.max_age and now - mtime > self.max_age
+            if not expired and self._total_bytes <= target:
+                break
+            self._remove(path, size)
+        if age_check:
+            self._next_age_check = now + CACHE_AGE_CHECK_INTERVAL
+
+
+def file_sha256(path):
+    """ファイルの内容の SHA-256（16進数）"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class JobStore:
+    """変換ジョブの状態を SQLite に保存するジョブストア（終了・クラッシュ後の再開用）
+    
+    ジョブは queued（待機）→ analyzing（解析中）→ analyzed（解析済み）→ done（完了）/ failed（失敗）の順に進み、
+    段階ごとに入力ファイルのハッシュ・受信したレスポンス・表データ・出力先をコミットします。
+    done / failed 以外のジョブは再起動後も pending() で取り出せ、解析済みなら解析をやり直さずに再開できます。
+    """
+    
+    PENDING_STAGES = ('queued', 'analyzing', 'analyzed')
+    
+    def __init__(self, path=JOB_STORE_FILE):
+        self.path = Path(path)
+        self._conn = None
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def from_config(cls, config):
+        """設定（config.json の内容）からジョブストアを作成（無効な場合は None）"""
+        if not config.get('job_store_enabled', True):
+            return None
+        return cls(config.get('job_store_file', JOB_STORE_FILE))
+    
+    def _connect(self):
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+            conn.row_factory = sqlite3.Row
+            # WAL にすると書き込み中に終了しても、コミット済みの段階までは必ず残る
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS jobs (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        source TEXT NOT NULL,
+                        pages TEXT NOT NULL,
+                        input_hash TEXT NOT NULL,
+                        stage TEXT NOT NULL,
+                        attempts INTEGER NOT NULL DEFAULT 0,
+                        raw_response TEXT,
+                        table_data TEXT,
+                        sheet_titles TEXT,
+                        output TEXT,
+                        error TEXT,
+                        created_at TEXT NOT NULL,
+                        updated_at TEXT NOT NULL
+                    )
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS jobs_stage ON jobs (stage)")
+            self._conn = conn
+        return self._conn
+    
+    def _execute(self, sql, params=()):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                return conn.execute(sql, params)
+    
+    def enqueue(self, source_path, pages=1):
+        """ジョブを登録してIDを返す（同じ内容・ページ指定の未完了のジョブがあればそのIDを返す）"""
+        source = os.path.abspath(source_path)
+        pages = str(pages)
+        input_hash = file_sha256(source)
+        now = time.strftime('%Y-%m-%dT%H:%M:%S%z')
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                row = conn.execute(
+                    "SELECT id, stage FROM jobs WHERE source = ? AND pages = ? AND input_hash = ? AND stage != 'done' "
+                    "ORDER BY id DESC LIMIT 1", (source, pages, input_hash)).fetchone()
+                if row is not None:
+                    if row['stage'] == 'failed':
+                        conn.execute("UPDATE jobs SET stage = 'queued', updated_at = ? WHERE id = ?", (now, row['id']))
+                    return row['id']
+                return conn.execute(
+                    "INSERT INTO jobs (source, pages, input_hash, stage, created_at, updated_at) "
+                    "VALUES (?, ?, ?, 'queued', ?, ?)", (source, pages, input_hash, now, now)).lastrowid
+    
+    def get(self, job_id):
+        """ジョブを辞書で返す（なければ None）"""
+        row = self._execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+    
+    def is_done(self, source_path, pages=1):
+        """同じ内容のファイルを同じページ指定で変換済みかどうか"""
+        source = os.path.abspath(source_path)
+        row = self._execute(
+            "SELECT stage FROM jobs WHERE source = ? AND pages = ? AND input_hash = ? ORDER BY id DESC LIMIT 1",
+            (source, str(pages), file_sha256(source))).fetchone()
+        return row is not None and row['stage'] == 'done'
+    
+    def pending(self):
+        """完了・失敗していないジョブのリスト（登録順）"""
+        placeholders = ", ".join("?" * len(self.PENDING_STAGES))
+        rows = self._execute(f"SELECT * FROM jobs WHERE stage IN ({placeholders}) ORDER BY id",
+                             self.PENDING_STAGES).fetchall()
+        return [dict(row) for row in rows]
+    
+    def update(self, job_id, **fields):
+        """ジョブの列を更新してコミット"""
+        fields['updated_at'] = time.strftime('%Y-%m-%dT%H:%M:%S%z')
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        self._execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+    
+    def checkpoint(self, job_id):
+        """ConversionEngine.convert に渡すチェックポイントを返す"""
+        return JobCheckpoint(self, job_id)
+    
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class JobCheckpoint:
+    """1つのジョブの段階ごとの結果をジョブストアに保存する"""
+    
+    def __init__(self, store, job_id):
+        self.store = store
+        self.job_id = job_id
+    
+    def resume(self):
+        """前回の解析結果（表データ, シート名）を返す（ない場合・入力が変わった場合は解析中にして (None, None)）"""
+        job = self.store.get(self.job_id)
+        input_hash = file_sha256(job['source'])
+        if job['table_data'] is not None and job['input_hash'] == input_hash:
+            sheet_titles = json.loads(job['sheet_titles']) if job['sheet_titles'] else None
+            return json.loads(job['table_data']), sheet_titles
+        self.store.update(self.job_id, stage='analyzing', input_hash=input_hash, attempts=job['attempts'] + 1,
+                          raw_response=None, table_data=None, sheet_titles=None, output=None, error=None)
+        return None, None
+    
+    def analyzed(self, table_data, sheet_titles=None, responses=None):
+        """解析が終わった（表データと受信したレスポンスを保存）"""
+        self.store.update(self.job_id, stage='analyzed',
+                          raw_response=json.dumps(responses or [], ensure_ascii=False),
+                          table_data=json.dumps(table_data, ensure_ascii=False),
+                          sheet_titles=json.dumps(sheet_titles, ensure_ascii=False) if sheet_titles else None)
+    
+    def done(self, output):
+        """Excelファイルを書き出した"""
+        self.store.update(self.job_id, stage='done', output=str(output), error=None)
+    
+    def failed(self, error):
+        """変換に失敗した（解析済みの表データは残す）"""
+        self.store.update(self.job_id, stage='failed', error=str(error))
+
+
+class FolderWatcher:
+    """入力フォルダを監視し、書き込みが終わった変換対象のファイルを on_ready(パス) で通知する
+    
+    watchdog がインストールされていれば OS のファイル変更通知（Linux は inotify）で新しいファイルを知り、
+    なければ poll_interval 秒ごとにフォルダを走査します。変更通知を使う場合も、通知が届かないこと
+    （ネットワーク上の共有フォルダなど）に備えて rescan_interval 秒ごとに走査します。
+    コピー・スキャン中のファイルは、サイズと更新時刻が settle_seconds 秒変わらず、読み込めるようになるまで待ちます。
+    skip_existing が True なら、監視を始めたときにあったファイルは通知しません。
+    """
+    
+    def __init__(self, directories, on_ready, settle_seconds=WATCH_SETTLE_SECONDS, poll_interval=WATCH_POLL_INTERVAL,
+                 rescan_interval=WATCH_RESCAN_INTERVAL, recursive=False, skip_existing=False):
+        self.directories = [Path(directory).resolve() for directory in directories]
+        self.on_ready = on_ready
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.rescan_interval = rescan_interval
+        self.recursive = recursive
+        self.skip_existing = skip_existing
+        self.uses_events = False
+        self._known = {}  # パス → 通知したときの（サイズ, 更新時刻）
+        self._pending = {}  # パス → （最後に確認した（サイズ, 更新時刻）, その状態になった時刻）
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._observer = None
+    
+    def start(self):
+        """監視を開始する（バックグラウンドのスレッドで実行）"""
+        for directory in self.directories:
+            if not directory.is_dir():
+                raise Exception(f"監視するフォルダが見つかりません: {directory}")
+        self._observer = self._start_observer()
+        self.uses_events = self._observer is not None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """監視を終了する"""
+        self._stop_event.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+        if self._thread is not None:
+            self._thread.join()
+    
+    def _start_observer(self):
+        """OS のファイル変更通知を開始する（使えない場合は None）"""
+        try:
+            Observer, FileSystemEventHandler = _import_watchdog()
+        except ImportError:
+            print("watchdog がインストールされていないため、フォルダを一定間隔で走査して監視します")
+            return None
+        
+        watcher = self
+        
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if not event.is_directory:
+                    watcher._mark(getattr(event, 'dest_path', None) or event.src_path)
+        
+        observer = Observer()
+        try:
+            for directory in self.directories:
+                observer.schedule(Handler(), str(directory), recursive=self.recursive)
+            observer.start()
+        except Exception as e:
+            print(f"ファイル変更通知を使えないため、フォルダを一定間隔で走査して監視します: {e}")
+            return None
+        return observer
+    
+    def _run(self):
+        self._scan(initial=True)
+        last_scan = time.monotonic()
+        interval = WATCH_CHECK_INTERVAL if self.uses_events else min(self.poll_interval, WATCH_CHECK_INTERVAL)
+        while not self._stop_event.wait(interval):
+            scan_interval = self.rescan_interval if self.uses_events else self.poll_interval
+            if time.monotonic() - last_scan >= scan_interval:
+                self._scan()
+                last_scan = time.monotonic()
+            self._check_pending()
+    
+    def _is_candidate(self, path):
+        name = os.path.basename(path)
+        # 隠しファイル・Office の一時ファイルは対象外
+        return name.lower().endswith(SUPPORTED_EXTENSIONS) and not name.startswith(('.', '~$'))
+    
+    def _iter_files(self, directory):
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if self.recursive:
+                            yield from self._iter_files(entry.path)
+                    elif self._is_candidate(entry.path):
+                        yield entry
+        except OSError as e:
+            print(f"フォルダを読み込めません（{directory}）: {e}")
+    
+    def _scan(self, initial=False):
+        """フォルダを走査して、新しいファイル・変更されたファイルを確認待ちにする"""
+        now = time.monotonic()
+        for directory in self.directories:
+            for entry in self._iter_files(directory):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                path = os.path.normpath(entry.path)
+                state = (stat.st_size, stat.st_mtime_ns)
+                with self._lock:
+                    if initial and self.skip_existing:
+                        self._known[path] = state
+                    elif self._known.get(path) != state and path not in self._pending:
+                        self._pending[path] = (state, now)
+    
+    def _mark(self, path):
+        """変更通知を受けたファイルを確認待ちにする"""
+        if self._is_candidate(path):
+            with self._lock:
+                self._pending[os.path.normpath(path)] = (None, time.monotonic())
+    
+    def _check_pending(self):
+        """確認待ちのファイルのうち、書き込みが終わったものを通知する"""
+        now = time.monotonic()
+        with self._lock:
+            pending = list(self._pending.items())
+        ready = []
+        for path, (state, since) in pending:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                with self._lock:
+                    self._pending.pop(path, None)  # 削除・移動された
+                continue
+            current = (stat.st_size, stat.st_mtime_ns)
+            with self._lock:
+                if current != state:
+                    self._pending[path] = (current, now)  # まだ書き込み中
+                    continue
+                if self._known.get(path) == current:
+                    self._pending.pop(path, None)  # 通知済みのファイル（内容は変わっていない）
+                    continue
+                if now - since < self.settle_seconds or stat.st_size == 0:
+                    continue
+            if not self._readable(path):
+                continue  # 他のプロセスが書き込み用に開いている（Windows）
+            with self._lock:
+                self._pending.pop(path, None)
+                self._known[path] = current
+            ready.append(path)
+        
+        for path in ready:
+            try:
+                self.on_ready(path)
+            except Exception as e:
+                print(f"変換の開始に失敗しました（{path}）: {e}")
+    
+    @staticmethod
+    def _readable(path):
+        try:
+            with open(path, 'rb') as f:
+                f.read(1)
+            return True
+        except OSError:
+            return False
+
+
+def request_fingerprint(request):
+    """リクエスト（モデル・プロンプト・画像・最大トークン数など）の指紋（SHA-256）"""
+    canonical = json.dumps(request, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class InteractionStore:
+    """APIのやり取りを記録するディレクトリ（リクエストの指紋ごとに1ファイルのJSON）
+    
+    レスポンスのテキスト・停止理由・トークン数と、記録時の応答時間を保存します。
+    """
+    
+    def __init__(self, directory=RECORDINGS_DIR):
+        self.directory = Path(directory)
+        self._fingerprints = None
+        self._lock = threading.Lock()
+    
+    def _entry_path(self, fingerprint):
+        return self.directory / f"{fingerprint}.json"
+    
+    def record(self, request, response_text, message, api_seconds, first_token_seconds=None):
+        """1回分のやり取りを保存（同じ指紋の記録は上書き）"""
+        fingerprint = request_fingerprint(request)
+        usage = getattr(message, 'usage', None)
+        entry = {
+            'fingerprint': fingerprint,
+            'model': request.get('model'),
+            'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'text': response_text,
+            'stop_reason': getattr(message, 'stop_reason', None),
+            'usage': {key: getattr(usage, key, None) or 0 for key in TOKEN_USAGE_FIELDS},
+            'api_seconds': round(api_seconds, 3),
+            'first_token_seconds': round(first_token_seconds, 3) if first_token_seconds else None,
+        }
+        with self._lock:
+            try:
+                self.directory.mkdir(parents=True, exist_ok=True)
+                path = self._entry_path(fingerprint)
+                tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(entry, f, ensure_ascii=False)
+                os.replace(tmp_path, path)
+                self._fingerprints = None
+            except OSError as e:
+                print(f"記録の保存エラー: {e}")
+    
+    def get(self, fingerprint):
+        """記録を返す（なければ None）"""
+        try:
+            with open(self._entry_path(fingerprint), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+    
+    def fingerprints(self):
+        """記録済みの指紋の一覧（ソート済み）"""
+        with self._lock:
+            if self._fingerprints is None:
+                self._fingerprints = sorted(path.stem for path in self.directory.glob("*.json"))
+            return self._fingerprints
+
+
+class ReplayError(Exception):
+    """再生時に模擬するAPIエラー（429 レート制限 / 529 過負荷）"""
+    
+    def __init__(self, status_code, retry_after=None):
+        error_type = 'rate_limit_error' if status_code == 429 else 'overloaded_error'
+        super().__init__(f"Error code: {status_code} - {error_type}（模擬エラー）")
+        self.status_code = status_code
+        headers = {'retry-after': str(retry_after)} if retry_after is not None else {}
+        self.response = types.SimpleNamespace(status_code=status_code, headers=headers)
+        self.body = {'type': 'error', 'error': {'type': error_type}}
+
+
+class ReplayMessage:
+    """記録から作る Message の代わり"""
+    
+    def __init__(self, entry):
+        self.id = f"replay_{entry['fingerprint'][:24]}"
+        self.model = entry.get('model')
+        self.content = [types.SimpleNamespace(type='text', text=entry['text'])]
+        self.stop_reason = entry.get('stop_reason') or 'end_turn'
+        self.usage = types.SimpleNamespace(**entry.get('usage', {}))
+
+
+class ReplayClient:
+    """記録したレスポンスを返す Anthropic クライアントの代わり（ネットワーク不要）
+    
+    latency を指定しなければ記録時の応答時間 × latency_scale だけ待ち、指定すればその秒数（±25%）だけ待ちます。
+    error_rate の割合で 429/529 エラーを返します。記録のないリクエストは on_miss="error" ならエラー、
+    "any" なら記録済みのいずれかを返します（負荷試験用）。
+    待ち時間とエラーの有無は seed・リクエスト・試行回数から決まるため、同じ条件なら毎回同じ結果になります。
+    """
+    
+    def __init__(self, store, latency=None, latency_scale=1.0, error_rate=0.0, on_miss="error", seed=0,
+                 chunk_size=40):
+        self.store = store
+        self.latency = latency
+        self.latency_scale = latency_scale
+        self.error_rate = error_rate
+        self.on_miss = on_miss
+        self.seed = seed
+        self.chunk_size = chunk_size
+        self.stats = {'requests': 0, 'errors': 0, 'misses': 0}
+        self._attempts = {}
+        self._lock = threading.Lock()
+        self.messages = _ReplayMessages(self)
+    
+    def plan(self, request):
+        """リクエストに対して（記録, 最初の応答までの秒数, 全体の秒数, エラー）を決める"""
+        fingerprint = request_fingerprint(request)
+        with self._lock:
+            attempt = self._attempts.get(fingerprint, 0)
+            self._attempts[fingerprint] = attempt + 1
+            self.stats['requests'] += 1
+        rng = random.Random(f"{self.seed}:{fingerprint}:{attempt}")
+        
+        entry = self.store.get(fingerprint)
+        if entry is None:
+            fingerprints = self.store.fingerprints()
+            with self._lock:
+                self.stats['misses'] += 1
+            if self.on_miss != "any" or not fingerprints:
+                raise Exception(f"記録されていないリクエストです（指紋: {fingerprint[:16]}）")
+            entry = self.store.get(fingerprints[int(fingerprint, 16) % len(fingerprints)])
+        
+        if self.latency is None:
+            total = (entry.get('api_seconds') or 0.0) * self.latency_scale
+            first = (entry.get('first_token_seconds') or total) * self.latency_scale
+        else:
+            total = self.latency * rng.uniform(0.75, 1.25)
+            first = total * 0.3
+        
+        error = None
+        if rng.random() < self.error_rate:
+            error = ReplayError(429, retry_after=1) if rng.random() < 0.5 else ReplayError(529)
+            with self._lock:
+                self.stats['errors'] += 1
+        return entry, min(first, total), total, error
+    
+    def chunks(self, text):
+        return [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)] or ['']
+
+
+class _ReplayMessages:
+    def __init__(self, client):
+        self._client = client
+        self.batches = _ReplayBatches(client)
+    
+    def create(self, **request):
+        entry, _, total, error = self._client.plan(request)
+        time.sleep(total)
+        if error is not None:
+            raise error
+        return ReplayMessage(entry)
+    
+    @contextlib.contextmanager
+    def stream(self, **request):
+        entry, first, total, error = self._client.plan(request)
+        time.sleep(first)
+        if error is not None:
+            raise error
+        chunks = self._client.chunks(entry['text'])
+        
+        def text_stream():
+            for chunk in chunks:
+                time.sleep((total - first) / len(chunks))
+                yield chunk
+        
+        yield types.SimpleNamespace(text_stream=text_stream(), get_final_message=lambda: ReplayMessage(entry))
+
+
+class _ReplayBatches:
+    """Message Batches API の代わり（記録を返す。状態は記録ディレクトリの batches/ に保存）
+    
+    送信時に各リクエストの結果（記録・模擬エラー）と終了時刻を決めておき、終了時刻を過ぎると
+    状態が "ended" になって結果を取得できます。状態をファイルに保存するため、別のプロセス
+    （アプリの再起動後）からも同じバッチを確認できます。結果は実際のAPIと同様に送信順とは限りません。
+    """
+    
+    def __init__(self, client):
+        self._client = client
+    
+    def _state_path(self, batch_id):
+        return self._client.store.directory / "batches" / f"{batch_id}.json"
+    
+    def _load(self, batch_id):
+        try:
+            with open(self._state_path(batch_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            raise Exception(f"バッチが見つかりません: {batch_id}")
+    
+    def create(self, requests):
+        results = []
+        duration = 0.0
+        for request in requests:
+            try:
+                entry, _, total, error = self._client.plan(request['params'])
+            except Exception as e:
+                results.append({'custom_id': request['custom_id'], 'fingerprint': None,
+                                'error': {'type': 'invalid_request_error', 'message': str(e)}})
+                continue
+            duration = max(duration, total)
+            results.append({'custom_id': request['custom_id'], 'fingerprint': entry['fingerprint'],
+                            'error': {'type': error.body['error']['type'], 'message': str(error)} if error else None})
+        
+        created = time.time()
+        digest = hashlib.sha256(f"{created}:{[r['custom_id'] for r in results]}".encode('utf-8')).hexdigest()
+        state = {'id': f"msgbatch_replay_{digest[:24]}", 'created_at': created,
+                 'ends_at': created + duration, 'results': results}
+        path = self._state_path(state['id'])
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+        return self._batch(state)
+    
+    def retrieve(self, batch_id):
+        return self._batch(self._load(batch_id))
+    
+    def results(self, batch_id):
+        state = self._load(batch_id)
+        if time.time() < state['ends_at']:
+            raise Exception(f"バッチの処理が終わっていません: {batch_id}")
+        order = list(state['results'])
+        random.Random(f"{self._client.seed}:{batch_id}").shuffle(order)
+        return self._entries(order)
+    
+    def _entries(self, order):
+        for result in order:
+            if result['error'] is not None:
+                error = types.SimpleNamespace(type='error', error=types.SimpleNamespace(**result['error']))
+                outcome = types.SimpleNamespace(type='errored', error=error)
+            else:
+                outcome = types.SimpleNamespace(type='succeeded',
+                                                message=ReplayMessage(self._client.store.get(result['fingerprint'])))
+            yield types.SimpleNamespace(custom_id=result['custom_id'], result=outcome)
+    
+    def _batch(self, state):
+        ended = time.time() >= state['ends_at']
+        succeeded = sum(1 for r in state['results'] if r['error'] is None) if ended else 0
+        counts = types.SimpleNamespace(processing=0 if ended else len(state['results']), succeeded=succeeded,
+                                       errored=len(state['results']) - succeeded if ended else 0,
+                                       canceled=0, expired=0)
+        return types.SimpleNamespace(id=state['id'], processing_status='ended' if ended else 'in_progress',
+                                     request_counts=counts)
+
+
+class AsyncReplayClient(ReplayClient):
+    """ReplayClient の非同期版（AsyncAnthropic の代わり）"""
+    
+    def __init__(self, store, **options):
+        super().__init__(store, **options)
+        self.messages = _AsyncReplayMessages(self)
+
+
+class _AsyncReplayMessages:
+    def __init__(self, client):
+        self._client = client
+    
+    async def create(self, **request):
+        entry, _, total, error = self._client.plan(request)
+        await asyncio.sleep(total)
+        if error is not None:
+            raise error
+        return ReplayMessage(entry)
+    
+    @contextlib.asynccontextmanager
+    async def stream(self, **request):
+        entry, first, total, error = self._client.plan(request)
+        await asyncio.sleep(first)
+        if error is not None:
+            raise error
+        chunks = self._client.chunks(entry['text'])
+        
+        async def text_stream():
+            for chunk in chunks:
+                await asyncio.sleep((total - first) / len(chunks))
+                yield chunk
+        
+        async def get_final_message():
+            return ReplayMessage(entry)
+        
+        yield types.SimpleNamespace(text_stream=text_stream(), get_final_message=get_final_message)
+
+
+def image_hashes(img):
+    """画像の知覚ハッシュ（pHash, dHash）を DUPLICATE_HASH_SIZE² ビットの整数で返す
+    
+    余白・位置・傾き・露出の違いに左右されないよう、detect_table_region で見つけた表の範囲を傾きを補正して
+    切り抜き、コントラストをそろえてから計算します。pHash は 64×64 に縮小した画像の DCT の低周波 16×16 成分、
+    dHash は 17×16 に縮小した画像の横方向の明暗差です。
+    """
+    gray = img.convert('L')
+    scale = min(1.0, TABLE_DETECT_LONG_EDGE / max(gray.size))
+    if scale < 1.0:
+        size = (max(1, round(gray.width * scale)), max(1, round(gray.height * scale)))
+        gray = gray.resize(size, Image.Resampling.BOX, reducing_gap=2.0)
+    gray = ImageOps.autocontrast(crop_to_table(gray, detect_table_region(gray)), cutoff=1)
+    size = DUPLICATE_HASH_SIZE
+    
+    # dHash: 隣り合う画素の明暗
+    small = np.asarray(gray.resize((size + 1, size), Image.Resampling.LANCZOS), dtype=np.int16)
+    dhash = _bits_to_int(small[:, 1:] > small[:, :-1])
+    
+    # pHash: DCT の低周波成分が中央値より大きいか（直流成分は除く）
+    pixels = np.asarray(gray.resize((size * 4, size * 4), Image.Resampling.LANCZOS), dtype=np.float64)
+    n = np.arange(size * 4)
+    dct = np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / (size * 8))
+    low = (dct @ pixels @ dct.T)[:size, :size].flatten()
+    phash = _bits_to_int(low > np.median(low[1:]))
+    return phash, dhash
+
+
+def _bits_to_int(bits):
+    return int.from_bytes(np.packbits(bits.flatten()).tobytes(), 'big')
+
+
+def hash_similarity(hashes, other):
+    """2つの画像の知覚ハッシュ（pHash, dHash）の類似度（一致するビットの割合の平均、0〜1）"""
+    bits = DUPLICATE_HASH_SIZE ** 2
+    distance = sum(bin(a ^ b).count('1') for a, b in zip(hashes, other)) / len(hashes)
+    return 1 - distance / bits
+
+
+def source_image_hashes(source_path, page_number=None):
+    """画像ファイル・PDFページの知覚ハッシュを計算（表の検出に必要な大きさまで縮小して読み込む）"""
+    if page_number is not None:
+        doc = fitz.open(source_path)
+        try:
+            page = doc[page_number - 1]
+            zoom = TABLE_DETECT_LONG_EDGE / max(page.rect.width, page.rect.height)
+            img = pixmap_to_image(page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY,
+                                                  alpha=False))
+        finally:
+            doc.close()
+        return image_hashes(img)
+    
+    with Image.open(source_path) as opened:
+        opened.draft('L', (TABLE_DETECT_LONG_EDGE, TABLE_DETECT_LONG_EDGE))
+        return image_hashes(ImageOps.exif_transpose(opened))
+
+
+class DuplicateIndex:
+    """解析済みの入力画像の知覚ハッシュ（pHash/dHash）の索引
+    
+    再スキャンや撮り直しのようにバイト列は違っても内容が同じ画像を見つけ、以前の解析結果（table_data）を返します。
+    索引（index.jsonl）にハッシュを、エントリごとのファイルに解析結果を保存します。
+    """
+    
+    HASH_BYTES = DUPLICATE_HASH_SIZE ** 2 // 8
+    
+    def __init__(self, index_dir=DUPLICATE_INDEX_DIR, threshold=DEFAULT_DUPLICATE_THRESHOLD,
+                 max_entries=DEFAULT_DUPLICATE_MAX_ENTRIES):
+        self.index_dir = Path(index_dir)
+        self.threshold = threshold  # 類似度（hash_similarity と同じ値）がこの値以上なら同じ内容とみなす
+        self.max_entries = max_entries
+        self.hits = 0
+        self._entries = None
+        self._phashes = None
+        self._dhashes = None
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def from_config(cls, config):
+        """設定（config.json の内容）から索引を作成"""
+        return cls(
+            index_dir=config.get('duplicate_index_dir', DUPLICATE_INDEX_DIR),
+            threshold=config.get('duplicate_threshold', DEFAULT_DUPLICATE_THRESHOLD),
+            max_entries=config.get('duplicate_max_entries', DEFAULT_DUPLICATE_MAX_ENTRIES),
+        )
+    
+    @property
+    def _index_path(self):
+        return self.index_dir / "index.jsonl"
+    
+    def _load(self):
+        # 索引は初回の検索時に一度だけ読み込む
+        if self._entries is not None:
+            return
+        entries = []
+        try:
+            with open(self._index_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except OSError:
+            pass
+        # ハッシュの大きさが違うエントリ（以前の形式で記録したもの）は比べられないので使わない
+        entries = [e for e in entries if len(e.get('phash', '')) == len(e.get('dhash', '')) == self.HASH_BYTES * 2]
+        self._set_entries(entries[-self.max_entries:])
+    
+    def _set_entries(self, entries):
+        self._entries = entries
+        self._phashes = self._hash_array(e['phash'] for e in entries)
+        self._dhashes = self._hash_array(e['dhash'] for e in entries)
+    
+    def _hash_array(self, hex_values):
+        data = b"".join(bytes.fromhex(value) for value in hex_values)
+        return np.frombuffer(data, dtype=np.uint8).reshape(-1, self.HASH_BYTES)
+    
+    def _distances(self, hashes, value):
+        """各ハッシュと value の異なるビット数"""
+        xor = np.bitwise_xor(hashes, np.frombuffer(value.to_bytes(self.HASH_BYTES, 'big'), dtype=np.uint8))
+        return np.unpackbits(xor, axis=1).sum(axis=1)
+    
+    def find(self, hashes):
+        """最も似ている解析済みの画像を探し、類似度がしきい値以上なら
+        {'source', 'similarity', 'table_data'} を返す（なければ None）"""
+        phash, dhash = hashes
+        with self._lock:
+            self._load()
+            if not self._entries:
+                return None
+            # pHash と dHash の異なるビット数の平均（片方だけが大きくずれても、もう片方で補える）
+            distances = (self._distances(self._phashes, phash) + self._distances(self._dhashes, dhash)) / 2
+            best = int(np.argmin(distances))
+            similarity = 1 - float(distances[best]) / (self.HASH_BYTES * 8)
+            if similarity < self.threshold:
+                return None
+            entry = self._entries[best]
+        
+        try:
+            with open(self.index_dir / f"{entry['id']}.json", 'r', encoding='utf-8') as f:
+                table_data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        with self._lock:
+            self.hits += 1
+        return {'source': entry['source'], 'similarity': similarity, 'table_data': table_data}
+    
+    def add(self, hashes, source_path, table_data):
+        """解析結果を索引に追加（上限を超えたら古いものから削除）"""
+        phash, dhash = (f"{value:0{self.HASH_BYTES * 2}x}" for value in hashes)
+        entry = {
+            'id': hashlib.sha256(f"{phash}{dhash}".encode()).hexdigest()[:32],
+            'phash': phash,
+            'dhash': dhash,
+            'source': str(source_path),
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        }
+        with self._lock:
+            self._load()
+            try:
+                self.index_dir.mkdir(parents=True, exist_ok=True)
+                with open(self.index_dir / f"{entry['id']}.json", 'w', encoding='utf-8') as f:
+                    json.dump(table_data, f, ensure_ascii=False)
+                
+                entries = [e for e in self._entries if e['id'] != entry['id']] + [entry]
+                removed = entries[:-self.max_entries] if len(entries) > self.max_entries else []
+                if removed or len(entries) <= len(self._entries):
+                    # 削除・置き換えがあった場合は索引を書き直す
+                    entries = entries[len(removed):]
+                    tmp_path = self._index_path.with_suffix(".tmp")
+                    with open(tmp_path, 'w', encoding='utf-8') as f:
+                        f.writelines(json.dumps(e, ensure_ascii=False) + "\n" for e in entries)
+                    os.replace(tmp_path, self._index_path)
+                    for e in removed:
+                        (self.index_dir / f"{e['id']}.json").unlink(missing_ok=True)
+                else:
+                    with open(self._index_path, 'a', encoding='utf-8') as f:
+                        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                self._set_entries(entries)
+            except OSError as e:
+                print(f"類似画像の索引の保存エラー: {e}")
+
+
+class ConversionEngine:
+    """GUI非依存の変換エンジン（画像/PDF → Claude解析 → Excel生成）"""
+    
+    def __init__(self, api_key, model=DEFAULT_MODEL, output_dir=None, cache=None, image_budget=None,
+                 stream=True, tiling=DEFAULT_TILING, excel_writer=DEFAULT_EXCEL_WRITER, client=None,
+                 metrics_log=None, async_client=None, rate_limiter=None, max_retries=DEFAULT_MAX_RETRIES,
+                 recorder=None, duplicate_index=None, duplicate_mode=DEFAULT_DUPLICATE_MODE, confirm_duplicate=None,
+                 response_schema=DEFAULT_RESPONSE_SCHEMA, consolidated=None, output_format=DEFAULT_OUTPUT_FORMAT,
+                 client_pool=None):
+        self.api_key = api_key
+        self.model = model
+        self.output_dir = output_dir  # None の場合は元ファイルと同じディレクトリ
+        self.cache = cache  # ExtractionCache（None の場合はキャッシュしない）
+        self.image_budget = image_budget or image_budget_from_config({})
+        self.stream = stream  # レスポンスをストリーミングで受信し、行単位で進捗を通知する
+        self.tiling = tiling  # 大きな表を帯に分割して並列に解析するか（"auto" / "on" / "off"）
+        self.excel_writer = excel_writer  # Excelの書き出し方式（"auto" / "styled" / "streaming"）
+        self.client = client  # 指定した場合はこのクライアントでAPIを呼び出す（テスト・ベンチマーク用）
+        self.metrics_log = metrics_log  # MetricsLog（None の場合は計測値を記録しない）
+        self.async_client = async_client  # 非同期パイプライン用（指定がなければ共有の AsyncAnthropic を使う）
+        self.rate_limiter = rate_limiter or RateLimiter()  # 非同期パイプラインのレート制限
+        self.max_retries = max_retries  # 429/529・一時的な通信エラーの再試行回数
+        self.recorder = recorder  # InteractionStore（指定した場合はAPIのやり取りを記録する）
+        self.duplicate_index = duplicate_index  # DuplicateIndex（None の場合は類似画像を探さない）
+        self.duplicate_mode = duplicate_mode  # 類似画像の結果を再利用するか（"ask" / "auto" / "off"）
+        self.confirm_duplicate = confirm_duplicate  # "ask" のとき confirm_duplicate(一致) が True なら再利用する
+        self.response_schema = response_schema  # 応答の形式（"compact" / "objects"）
+        self.consolidated = consolidated  # ConsolidatedWorkbook（指定した場合は別々のファイルにせず追記する）
+        self.output_format = output_format  # 出力形式（EXPORTERS のキー）
+        self.client_pool = client_pool or ClientPool.from_config({})  # API キーごとに共有するクライアント
+        self.cancel_event = threading.Event()
+    
+    @classmethod
+    def from_config(cls, api_key, config, **overrides):
+        """設定（config.json の内容）から変換エンジンを作成（overrides で個別に上書き）"""
+        options = {
+            'model': config.get('model', DEFAULT_MODEL),
+            'image_budget': image_budget_from_config(config),
+            'stream': config.get('stream_responses', True),
+            'response_schema': config.get('response_schema', DEFAULT_RESPONSE_SCHEMA),
+            'tiling': config.get('tiling', DEFAULT_TILING),
+            'excel_writer': config.get('excel_writer', DEFAULT_EXCEL_WRITER),
+            'output_format': config.get('output_format', DEFAULT_OUTPUT_FORMAT),
+            'metrics_log': MetricsLog(config.get('metrics_file', METRICS_FILE))
+            if config.get('metrics_enabled', True) else None,
+            'rate_limiter': RateLimiter.from_config(config),
+            'duplicate_index': DuplicateIndex.from_config(config),
+            'duplicate_mode': config.get('duplicate_detection', DEFAULT_DUPLICATE_MODE),
+            'max_retries': config.get('max_retries', DEFAULT_MAX_RETRIES),
+            'consolidated': ConsolidatedWorkbook.from_config(config),
+            'client_pool': ClientPool.from_config(config),
+        }
+        options.update({key: value for key, value in overrides.items() if value is not None})
+        return cls(api_key, **options)
+    
+    def cancel(self):
+        """実行中の解析を中止する"""
+        self.cancel_event.set()
+    
+    def api_client(self):
+        """API を呼び出すクライアント（指定がなければ API キーごとに共有するクライアント）"""
+        return self.client or self.client_pool.client(self.api_key)
+    
+    def api_async_client(self):
+        """非同期パイプラインで API を呼び出すクライアント（実行中のイベントループで共有するクライアント）"""
+        return self.async_client or self.client_pool.async_client(self.api_key)
+    
+    def prewarm(self):
+        """共有のクライアントの接続を開いておく（バックグラウンドのスレッドで呼び出す）"""
+        if self.client is None and self.api_key and self.client_pool.prewarm_enabled:
+            self.client_pool.prewarm(self.api_key)
+    
+    async def prewarm_async(self):
+        """prewarm の非同期クライアント版"""
+        if self.async_client is None and self.api_key and self.client_pool.prewarm_enabled:
+            await self.client_pool.prewarm_async(self.api_key)
+    
+    def convert(self, source_path, pages=1, progress=None, metrics=None, analyze=None, checkpoint=None,
+                output_format=None):
+        """1ファイルを変換して出力ファイル（既定ではExcelファイル）のパスを返す
+        
+        pages には PDF のページ番号、またはページ指定（例: "1-5,8", "all"）を渡します。
+        複数ページを指定した場合は1ページ1シートのExcelファイルを作成します。
+        output_format（EXPORTERS のキー）を渡すと、この変換だけエンジンの出力形式の代わりにその形式で書き出します。
+        metrics（ConversionMetrics）を渡すと、段階ごとの時間やトークン数をそこに記録します。
+        analyze には analyze_with_claude の代わりに使う解析関数を渡せます（非同期パイプライン用）。
+        checkpoint（JobCheckpoint）を渡すと段階ごとの結果をジョブストアに保存し、前回の実行で解析まで
+        終わっていれば、解析をやり直さずにExcel生成から再開します。
+        """
+        if progress is None:
+            progress = lambda value, status_text: None
+        if metrics is None:
+            metrics = ConversionMetrics(source_path, self.model)
+        metrics.response_schema = self.response_schema
+        
+        try:
+            excel_path = self._convert(source_path, pages, progress, metrics, analyze or self.analyze_with_claude,
+                                       checkpoint, output_format)
+        except Exception as e:
+            metrics.finish(error=e)
+            if checkpoint is not None:
+                checkpoint.failed(e)
+            raise
+        else:
+            metrics.finish(output=excel_path)
+            if checkpoint is not None:
+                checkpoint.done(excel_path)
+            return excel_path
+        finally:
+            if self.metrics_log is not None:
+                self.metrics_log.write(metrics)
+    
+    def _convert(self, source_path, pages, progress, metrics, analyze, checkpoint=None, output_format=None):
+        """convert の本体"""
+        table_data = sheet_titles = None
+        if checkpoint is not None:
+            table_data, sheet_titles = checkpoint.resume()
+        
+        if table_data is None:
+            table_data, sheet_titles = self.extract_tables(source_path, pages, progress, metrics, analyze)
+            if checkpoint is not None:
+                checkpoint.analyzed(table_data, sheet_titles, metrics.responses)
+        else:
+            print(f"前回の解析結果から再開します: {source_path}")
+            for table in table_data if isinstance(table_data, list) else [table_data]:
+                metrics.add_table(table)
+        
+        # ステップ3: Excel生成（出力形式によってはCSVなど）
+        progress(0.7, "Excelファイルを生成中..." if (output_format or self.output_format).startswith('xlsx')
+                 else "ファイルを書き出し中...")
+        with metrics.stage('excel'):
+            excel_path = self.write_output(table_data, source_path, sheet_titles, output_format)
+        
+        # ステップ4: 完了
+        progress(1.0, "完了しました！")
+        return excel_path
+    
+    def extract_tables(self, source_path, pages, progress, metrics, analyze):
+        """ファイルを解析して（表データ, シート名）を返す（複数ページのPDFは表データ・シート名ともにリスト）"""
+        page_number = None
+        if is_pdf_file(source_path):
+            page_numbers = parse_page_range(pages, get_pdf_page_count(source_path))
+            if len(page_numbers) > 1:
+                return self.analyze_pdf_pages(source_path, page_numbers, progress, metrics, analyze)
+            page_number = page_numbers[0]
+        
+        # 解析済みの類似画像（再スキャン・撮り直し）があれば、その結果を再利用する
+        hashes = self.duplicate_hashes(source_path, page_number, metrics)
+        table_data = self.find_duplicate(hashes, source_path, metrics)
+        if table_data is None:
+            table_data = self.analyze_source(source_path, page_number, progress, metrics, analyze)
+            self.remember_duplicate(hashes, source_path, table_data)
+        metrics.add_table(table_data)
+        return table_data, None
+    
+    def analyze_source(self, source_path, page_number, progress, metrics, analyze):
+        """画像ファイル（またはPDFの1ページ）を読み込んで解析し、表データを返す"""
+        def on_row(row, row_count):
+            progress(0.3 + 0.4 * row_count / (row_count + 10), f"Claude APIで解析中...（{row_count}行受信）")
+        
+        if self.needs_tiling(source_path, page_number):
+            # 大きな表は行の境界で帯に分割して並列に解析する
+            progress(0.1, "大きな表を分割しています...")
+            with metrics.stage('load'):
+                if page_number is not None:
+                    img = render_pdf_page(source_path, page_number)
+                else:
+                    with Image.open(source_path) as opened:
+                        img = ImageOps.exif_transpose(opened)
+                # 表の範囲を切り抜き、検出した横罫線を帯の境界に使う
+                boundaries = None
+                if self.image_budget.get('table_crop'):
+                    region = detect_table_region(img)
+                    img = crop_to_table(img, region)
+                    if region is not None:
+                        boundaries = [round(y * img.height) for y in region['rows']]
+            return self.analyze_tiled(img, progress, on_row, metrics, analyze, boundaries)
+        
+        # ステップ1: 画像読み込み（画像ファイルは読み込みとエンコードをまとめて load に記録）
+        if page_number is not None:
+            progress(0.1, "PDFを読み込んでいます...")
+            image_data, media_type, timings = pdf_page_to_image_base64(source_path, page_number, **self.image_budget)
+            for stage, seconds in timings.items():
+                metrics.add_stage(stage, seconds)
+        else:
+            progress(0.1, "画像を読み込んでいます...")
+            with metrics.stage('load'):
+                image_data, media_type = load_image_base64(source_path, **self.image_budget)
+        
+        # ステップ2: Claude APIで解析（受信した行数に応じて 0.3 → 0.7 の範囲で進める）
+        progress(0.3, "Claude APIで解析中...")
+        return analyze(image_data, media_type, on_row=on_row, metrics=metrics)
+    
+    def duplicate_hashes(self, source_path, page_number=None, metrics=None):
+        """類似画像を探すための知覚ハッシュを計算（探さない設定の場合は None）"""
+        if self.duplicate_index is None or self.duplicate_mode == "off":
+            return None
+        try:
+            with metrics.stage('hash') if metrics else contextlib.nullcontext():
+                return source_image_hashes(source_path, page_number)
+        except Exception as e:
+            print(f"知覚ハッシュの計算に失敗しました（{source_path}）: {e}")
+            return None
+    
+    def find_duplicate(self, hashes, source_path, metrics=None):
+        """解析済みの類似画像の表データを返す（見つからない・再利用しない場合は None）"""
+        if hashes is None:
+            return None
+        match = self.duplicate_index.find(hashes)
+        if match is None:
+            return None
+        
+        print(f"類似画像を検出: {source_path} ≒ {match['source']}（類似度 {match['similarity']:.0%}）")
+        if self.duplicate_mode != "auto" and not (self.confirm_duplicate and self.confirm_duplicate(match)):
+            return None
+        if metrics:
+            metrics.add(duplicate_hits=1)
+        return match['table_data']
+    
+    def remember_duplicate(self, hashes, source_path, table_data):
+        """解析結果を類似画像の索引に追加"""
+        if hashes is not None:
+            self.duplicate_index.add(hashes, source_path, table_data)
+    
+    def needs_tiling(self, source_path, page_number=None):
+        """分割して解析すべき大きさの画像かどうかを判定（画像は読み込まずサイズだけで判定）"""
+        if self.tiling == "off":
+            return False
+        if self.tiling == "on":
+            return True
+        
+        if page_number is not None:
+            width, height = get_pdf_page_size(source_path, page_number)
+        else:
+            with Image.open(source_path) as img:
+                width, height = img.size
+        scale = fit_image_scale(width, height, self.image_budget['max_tokens'], self.image_budget['max_long_edge'])
+        return scale < TILE_MIN_SCALE
+    
+    @property
+    def encode_budget(self):
+        """表の範囲を切り抜いた後の画像をエンコードするときの予算（もう一度切り抜かない）"""
+        return dict(self.image_budget, table_crop=False)
+    
+    def analyze_tiled(self, img, progress, on_row=None, metrics=None, analyze=None, boundaries=None):
+        """画像を行の境界で帯に分割し、各帯を並列に解析して結合する（境界を渡さない場合は画像から検出）"""
+        analyze = analyze or self.analyze_with_claude
+        if not boundaries or len(boundaries) < 2:
+            boundaries = find_row_boundaries(img)
+        tiles = plan_tiles(img.width, img.height, boundaries, self.image_budget, force=self.tiling == "on")
+        strips = split_into_strips(img, tiles, boundaries)
+        
+        if len(strips) == 1:
+            progress(0.3, "Claude APIで解析中...")
+            with metrics.stage('encode') if metrics else contextlib.nullcontext():
+                image_data, media_type = prepare_upload_image(img, **self.encode_budget)
+            return analyze(image_data, media_type, on_row=on_row, metrics=metrics)
+        
+        def analyze_strip(strip):
+            with metrics.stage('encode') if metrics else contextlib.nullcontext():
+                image_data, media_type = prepare_upload_image(strip, **self.encode_budget)
+            return analyze(image_data, media_type, prompt=TABLE_REQUEST_TEXT + TILE_PROMPT_NOTE, metrics=metrics)
+        
+        total = len(strips)
+        progress(0.3, f"Claude APIで解析中...（{total}分割）")
+        with ThreadPoolExecutor(max_workers=total) as pool:
+            futures = [pool.submit(analyze_strip, strip) for strip in strips]
+            for done, _ in enumerate(as_completed(futures), start=1):
+                progress(0.3 + 0.4 * done / total, f"Claude APIで解析中...（{done}/{total}分割）")
+            tables = [future.result() for future in futures]
+        
+        table_data = merge_tile_tables(tables)
+        print(f"分割解析を結合: {total}分割 → {len(table_data['rows'])}行")
+        return table_data
+    
+    def analyze_pdf_pages(self, pdf_path, page_numbers, progress, metrics, analyze=None):
+        """PDFの複数ページを並列に描画・解析し、（ページごとの表データ, シート名）を返す"""
+        analyze = analyze or self.analyze_with_claude
+        total = len(page_numbers)
+        results = {}
+        errors = {}
+        
+        # 解析済みの類似ページは描画・解析せずに以前の結果を使う
+        hashes = {number: self.duplicate_hashes(pdf_path, number, metrics) for number in page_numbers}
+        for number in page_numbers:
+            table_data = self.find_duplicate(hashes[number], f"{pdf_path}（{number}ページ）", metrics)
+            if table_data is not None:
+                results[number] = table_data
+                metrics.add_table(table_data)
+        
+        progress(0.1, f"PDFの{total}ページを画像に変換しています...")
+        
+        # 描画（CPU処理）はプロセスプール、解析（API待ち）はスレッドプールで並列化し、
+        # 描画が終わったページから順に解析を開始する
+        render_pool = get_render_pool()
+        render_futures = {
+            render_pool.submit(pdf_page_to_image_base64, str(pdf_path), number, **self.image_budget): number
+            for number in page_numbers if number not in results
+        }
+
+        with ThreadPoolExecutor(max_workers=min(total, DEFAULT_PAGE_WORKERS)) as analyze_pool:
+            analyze_futures = {}
+            for future in as_completed(render_futures):
+                number = render_futures[future]
+                try:
+                    image_data, media_type, timings = future.result()
+                except Exception as e:
+                    errors[number] = str(e)
+                    continue
+                for stage, seconds in timings.items():
+                    metrics.add_stage(stage, seconds)
+                analyze_futures[analyze_pool.submit(analyze, image_data, media_type, metrics=metrics)] = number
+                progress(0.1 + 0.2 * len(analyze_futures) / total, "Claude APIで解析中...")
+            
+            for done, future in enumerate(as_completed(analyze_futures), start=len(results) + 1):
+                number = analyze_futures[future]
+                try:
+                    results[number] = future.result()
+                    metrics.add_table(results[number])
+                    self.remember_duplicate(hashes[number], f"{pdf_path}（{number}ページ）", results[number])
+                except Exception as e:
+                    errors[number] = str(e)
+                progress(0.3 + 0.4 * done / total, f"Claude APIで解析中...（{done}/{total}ページ）")
+        
+        if errors:
+            details = "\n".join(f"{number}ページ: {errors[number]}" for number in sorted(errors))
+            raise Exception(f"{len(errors)}ページの変換に失敗しました:\n{details}")
+        
+        return [results[number] for number in page_numbers], [f"{number}ページ" for number in page_numbers]
+    
+    def analyze_with_claude(self, image_data, media_type="image/jpeg", on_row=None,
+                            prompt=TABLE_REQUEST_TEXT, metrics=None):
+        """Claude APIで画像を解析
+        
+        prompt は画像と一緒に送る依頼文です（応答形式の指示はシステムプロンプトとして送ります）。
+        on_row を渡すと、ストリーミング受信中に行が完成するたびに on_row(行, 受信行数) を呼び出します。
+        レート制限・過負荷・一時的な通信エラーは待ち時間を空けて再試行します。
+        出力が上限（max_tokens）で途切れた場合は、受信済みの行を残して続きの行だけを要求します。
+        """
+        try:
+            # キャッシュ済みの解析結果があればAPIを呼ばずに返す
+            cache_key, cached = self.lookup_cache(image_data, prompt, metrics)
+            if cached is not None:
+                return cached
+            
+            # 共有の Anthropic クライアント（接続を使い回す。再試行はこのクラスで行う）
+            client = self.api_client()
+            
+            request = self.build_request(image_data, media_type, prompt)
+            response_text, message, api_seconds, first_token_seconds = self.send_request(
+                client, request, on_row, metrics)
+            self.record_response(request, image_data, response_text, message, api_seconds, first_token_seconds,
+                                 metrics)
+            table_data = self.complete_response(client, request, image_data, response_text, message, metrics, on_row)
+            
+            if cache_key is not None:
+                self.cache.put(cache_key, table_data)
+            return table_data
+            
+        except Exception as e:
+            raise Exception(f"Claude API解析エラー: {str(e)}")
+    
+    def complete_response(self, client, request, image_data, response_text, message, metrics=None, on_row=None):
+        """応答を解析して表データを返す（記録済みの応答が出力の上限で途切れていれば、続きを要求して結合する）"""
+        pieces = []
+        with metrics.stage('parse') if metrics else contextlib.nullcontext():
+            next_request = self.continuation_request(request, response_text, message, pieces, metrics)
+        while next_request is not None:
+            received = sum(len(piece['rows']) for piece in pieces)
+            row_callback = (lambda row, count: on_row(row, received + count)) if on_row else None
+            response_text, message, api_seconds, first_token_seconds = self.send_request(
+                client, next_request, row_callback, metrics)
+            self.record_response(next_request, image_data, response_text, message, api_seconds, first_token_seconds,
+                                 metrics)
+            with metrics.stage('parse') if metrics else contextlib.nullcontext():
+                next_request = self.continuation_request(request, response_text, message, pieces, metrics)
+        return merge_continuation_tables(pieces)
+    
+    def send_request(self, client, request, on_row=None, metrics=None):
+        """リクエストを送信し（一時的なエラーは再試行）、（テキスト, メッセージ, 秒数, 最初のテキストまでの秒数）を返す"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                started = time.perf_counter()
+                first_token_seconds = None
+                with track_connections(metrics):
+                    if self.stream:
+                        response_text, message, first_token_seconds = self.stream_response(client, request, on_row)
+                    else:
+                        message = client.messages.create(**request)
+                        
+                        # レスポンスからJSONを抽出
+                        response_text = message.content[0].text
+                return response_text, message, time.perf_counter() - started, first_token_seconds
+            except ExtractionCancelled:
+                raise
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable_error(e):
+                    raise
+                delay = backoff_delay(attempt, retry_after_seconds(e))
+                print(f"API呼び出しに失敗したため{delay:.1f}秒後に再試行します（{attempt + 1}/{self.max_retries}）: {e}")
+                if metrics:
+                    metrics.add(retries=1)
+                if self.cancel_event.wait(delay):
+                    raise ExtractionCancelled("解析を中止しました")
+    
+    async def analyze_with_claude_async(self, image_data, media_type="image/jpeg", on_row=None,
+                                        prompt=TABLE_REQUEST_TEXT, metrics=None, cancel_event=None):
+        """Claude APIで画像を解析（非同期クライアント版）
+        
+        送信前にレート制限の枠を確保し、429/529・一時的な通信エラーは指数バックオフ（ジッター付き）で
+        再試行します。retry-after を受け取った場合は、その間すべての送信を止めます。
+        """
+        cancel_event = cancel_event or self.cancel_event
+        try:
+            cache_key, cached = self.lookup_cache(image_data, prompt, metrics)
+            if cached is not None:
+                return cached
+            
+            client = self.api_async_client()
+            expected_output, max_tokens = estimate_output_tokens(image_data, self.response_schema)
+            request = self.build_request(image_data, media_type, prompt, max_tokens)
+            
+            # 入力は画像の予算＋プロンプト、出力は表の大きさ（分からなければ平均的な量）で見積もり、応答後に精算する
+            estimated_input = self.image_budget['max_tokens'] + len(self.system_prompt) + len(prompt)
+            estimated_output = min(expected_output, max_tokens)
+            
+            response_text, message, api_seconds, first_token_seconds = await self.send_request_async(
+                client, request, on_row, metrics, cancel_event, estimated_input, estimated_output)
+            self.record_response(request, image_data, response_text, message, api_seconds, first_token_seconds,
+                                 metrics)
+            
+            # 途切れていれば続きを要求する（続きの見積もりも最初と同じにし、応答後に精算する）
+            pieces = []
+            with metrics.stage('parse') if metrics else contextlib.nullcontext():
+                next_request = self.continuation_request(request, response_text, message, pieces, metrics)
+            while next_request is not None:
+                received = sum(len(piece['rows']) for piece in pieces)
+                row_callback = (lambda row, count: on_row(row, received + count)) if on_row else None
+                response_text, message, api_seconds, first_token_seconds = await self.send_request_async(
+                    client, next_request, row_callback, metrics, cancel_event, estimated_input, estimated_output)
+                self.record_response(next_request, image_data, response_text, message, api_seconds,
+                                     first_token_seconds, metrics)
+                with metrics.stage('parse') if metrics else contextlib.nullcontext():
+                    next_request = self.continuation_request(request, response_text, message, pieces, metrics)
+            table_data = merge_continuation_tables(pieces)
+            
+            if cache_key is not None:
+                self.cache.put(cache_key, table_data)
+            return table_data
+            
+        except Exception as e:
+            raise Exception(f"Claude API解析エラー: {str(e)}")
+    
+    async def send_request_async(self, client, request, on_row, metrics, cancel_event, estimated_input,
+                                 estimated_output):
+        """send_request の非同期クライアント版（送信前にレート制限の枠を確保し、応答後に精算する）"""
+        for attempt in range(self.max_retries + 1):
+            if cancel_event.is_set():
+                raise ExtractionCancelled("解析を中止しました")
+            try:
+                async with self.rate_limiter.slot(estimated_input, estimated_output):
+                    started = time.perf_counter()
+                    first_token_seconds = None
+                    with track_connections(metrics):
+                        if self.stream:
+                            response_text, message, first_token_seconds = await self.stream_response_async(
+                                client, request, on_row, cancel_event)
+                        else:
+                            message = await client.messages.create(**request)
+                            response_text = message.content[0].text
+                break
+            except ExtractionCancelled:
+                raise
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable_error(e):
+                    raise
+                retry_after = retry_after_seconds(e)
+                if retry_after is not None:
+                    self.rate_limiter.pause(retry_after)
+                delay = backoff_delay(attempt, retry_after)
+                print(f"API呼び出しに失敗したため{delay:.1f}秒後に再試行します（{attempt + 1}/{self.max_retries}）: {e}")
+                if metrics:
+                    metrics.add(retries=1)
+                await asyncio.sleep(delay)
+        
+        usage = getattr(message, 'usage', None)
+        self.rate_limiter.settle('input_tokens', estimated_input,
+                                 getattr(usage, 'input_tokens', None) or estimated_input)
+        self.rate_limiter.settle('output_tokens', estimated_output,
+                                 getattr(usage, 'output_tokens', None) or estimated_output)
+        return response_text, message, time.perf_counter() - started, first_token_seconds
+    
+    def lookup_cache(self, image_data, prompt, metrics=None):
+        """（キャッシュキー, キャッシュ済みの解析結果）を返す（キャッシュしない場合はキーも None）"""
+        if self.cache is None or not self.cache.enabled:
+            return None, None
+        cache_key = self.cache.make_key(image_data, self.system_prompt + prompt, self.model)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            print(f"キャッシュから取得: {len(cached['columns'])}列 x {len(cached['rows'])}行")
+            if metrics:
+                metrics.add(cache_hits=1)
+        return cache_key, cached
+    
+    @property
+    def system_prompt(self):
+        """応答形式の指示（すべての解析で共通）"""
+        return RESPONSE_SCHEMA_PROMPTS[self.response_schema]
+    
+    def build_request(self, image_data, media_type, prompt, max_tokens=None):
+        """Messages API のリクエストを作成
+        
+        共通の指示はシステムプロンプトに置いてキャッシュ対象（cache_control）とし、
+        画像ごとに変わる部分（画像と依頼文）だけをユーザーメッセージで送ります。
+        キャッシュはモデルごとの最小トークン数を超えたプロンプトにだけ適用されます。
+        max_tokens を省略した場合は、画像の表の行数・列数から決めます。
+        """
+        if max_tokens is None:
+            _, max_tokens = estimate_output_tokens(image_data, self.response_schema)
+        return {
+            "model": self.model,
+            "max_tokens": max_tokens,
+            "system": [
+                {
+                    "type": "text",
+                    "text": self.system_prompt,
+                    "cache_control": {"type": "ephemeral"},
+                }
+            ],
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "image",
+                            "source": {
+                                "type": "base64",
+                                "media_type": media_type,
+                                "data": image_data,
+                            },
+                        },
+                        {
+                            "type": "text",
+                            "text": prompt
+                        }
+                    ]
+                }
+            ]
+        }
+    
+    def build_continuation_request(self, request, received, last_row):
+        """途切れた応答の続き（受信済みの received 行より後の行）を要求するリクエストを作成"""
+        image, text = request['messages'][0]['content']
+        note = CONTINUATION_PROMPT_NOTE.format(count=received, last_row=json.dumps(last_row, ensure_ascii=False))
+        return {**request, "messages": [{"role": "user", "content": [image, {**text, "text": text['text'] + note}]}]}
+    
+    def continuation_request(self, request, response_text, message, pieces, metrics=None):
+        """応答の表データを pieces に加え、出力が上限で途切れていれば続きを要求するリクエストを返す（最後なら None）"""
+        if getattr(message, 'stop_reason', None) != 'max_tokens':
+            # 続きの応答は、途切れた位置が表の最後だった場合に0行になる
+            pieces.append(parse_table_response(response_text, allow_empty=bool(pieces)))
+            return None
+        
+        partial = recover_truncated_table(response_text)
+        if partial is None or not partial['rows']:
+            raise Exception("出力が上限に達し、完成した行を受信できませんでした。")
+        if len(pieces) >= MAX_CONTINUATIONS:
+            raise Exception(f"続きを{MAX_CONTINUATIONS}回要求しても、表の最後まで受信できませんでした。")
+        pieces.append(partial)
+        received = len(join_continuation_tables(pieces)['rows'])
+        print(f"出力が上限で途切れたため、続きを要求します（{received}行まで受信）")
+        if metrics:
+            metrics.add(continuations=1)
+        return self.build_continuation_request(request, received, partial['rows'][-1])
+    
+    def record_response(self, request, image_data, response_text, message, api_seconds, first_token_seconds=None,
+                        metrics=None):
+        """受信したレスポンスを計測値・記録・デバッグ用ファイルに残す"""
+        if metrics:
+            metrics.add_stage('api', api_seconds)
+            metrics.add(payload_bytes=len(image_data))
+            metrics.add_response(message, first_token_seconds, text=response_text)
+        
+        if self.recorder is not None:
+            self.recorder.record(request, response_text, message, api_seconds, first_token_seconds)
+        
+        # デバッグ用：レスポンスをファイルに保存
+        try:
+            debug_dir = Path("debug_output")
+            debug_dir.mkdir(exist_ok=True)
+            with open(debug_dir / 'claude_response.txt', 'w', encoding='utf-8') as f:
+                f.write(response_text)
+            print(f"Claude response saved to debug_output/claude_response.txt")
+        except:
+            pass
+    
+    def stream_response(self, client, request, on_row=None):
+        """レスポンスをストリーミングで受信し、行が完成するたびに通知する
+        
+        （テキスト全体, 最終メッセージ, 最初のテキストを受信するまでの秒数）を返します。
+        """
+        parser = IncrementalTableParser()
+        started = time.perf_counter()
+        first_token_seconds = None
+        with client.messages.stream(**request) as stream:
+            for text in stream.text_stream:
+                if first_token_seconds is None:
+                    first_token_seconds = time.perf_counter() - started
+                self.feed_stream_text(parser, text, on_row)
+            message = stream.get_final_message()
+        return parser.text, message, first_token_seconds
+    
+    async def stream_response_async(self, client, request, on_row=None, cancel_event=None):
+        """stream_response の非同期クライアント版"""
+        parser = IncrementalTableParser()
+        started = time.perf_counter()
+        first_token_seconds = None
+        async with client.messages.stream(**request) as stream:
+            async for text in stream.text_stream:
+                if first_token_seconds is None:
+                    first_token_seconds = time.perf_counter() - started
+                self.feed_stream_text(parser, text, on_row, cancel_event)
+            message = await stream.get_final_message()
+        return parser.text, message, first_token_seconds
+    
+    def feed_stream_text(self, parser, text, on_row=None, cancel_event=None):
+        """受信したテキストをパーサーに渡し、完成した行を通知する"""
+        if self.cancel_event.is_set() or (cancel_event is not None and cancel_event.is_set()):
+            raise ExtractionCancelled("解析を中止しました")
+        
+        for row in parser.feed(text):
+            # 行がオブジェクトでも配列でもなければ形式が崩れているので早めに打ち切る
+            if not isinstance(row, (dict, list)):
+                raise Exception(f"不正な行データを受信したため解析を中止しました: {row!r}")
+            if on_row:
+                on_row(row, len(parser.rows))
+    
+    async def convert_async(self, job, progress=None, executor=None):
+        """ConversionJob を変換してExcelファイルのパスを返す（非同期パイプライン）
+        
+        画像の読み込み・分割・Excel生成は executor のスレッドで実行し、API呼び出しはイベントループ上で
+        非同期クライアントを使って実行します（レート制限・再試行つき）。
+        """
+        loop = asyncio.get_running_loop()
+        if job.metrics is None:
+            job.metrics = ConversionMetrics(job.source_path, self.model)
+        
+        def analyze(image_data, media_type="image/jpeg", on_row=None, prompt=TABLE_REQUEST_TEXT, metrics=None):
+            return job.run_on_loop(self.analyze_with_claude_async(
+                image_data, media_type, on_row, prompt, metrics, job.cancel_event), loop)
+        
+        try:
+            return await loop.run_in_executor(executor, lambda: self.convert(
+                job.source_path, job.pages, progress, job.metrics, analyze, job.checkpoint, job.output_format))
+        except asyncio.CancelledError:
+            job.cancel()
+            raise
+    
+    def write_output(self, table_data, source_path, sheet_titles=None, output_format=None):
+        """表データを書き出して出力先のパスを返す
+        
+        table_data に表データのリストを渡した場合は1件1シート（CSV などは1つのファイルにまとめる）で書き出します。
+        output_format を省略した場合はエンジンの出力形式で書き出し、Excel の場合で統合ブックを使うときは
+        統合ブックに追記します。
+        """
+        output_format = output_format or self.output_format
+        if self.consolidated is not None and output_format.startswith('xlsx'):
+            return self.consolidated.append(table_data, source_path, sheet_titles)
+        return self.export(table_data, source_path, sheet_titles, output_format)
+    
+    def export(self, table_data, source_path, sheet_titles=None, output_format=DEFAULT_OUTPUT_FORMAT):
+        """表データを output_format の形式で新しいファイルに書き出してパスを返す"""
+        if output_format not in EXPORTERS:
+            raise Exception(f"出力形式が正しくありません: {output_format}（{' / '.join(EXPORTERS)}）")
+        exporter = EXPORTERS[output_format].from_engine(self)
+        try:
+            tables = table_data if isinstance(table_data, list) else [table_data]
+            if isinstance(table_data, list):
+                titles = sheet_titles or [f"清掃スケジュール_{i}" for i in range(1, len(tables) + 1)]
+            else:
+                titles = ["清掃スケジュール"]
+            
+            output_path = self.reserve_output_path(source_path, exporter.extension)
+            exporter.write(tables, titles, output_path, source_path)
+            return str(output_path)
+            
+        except Exception as e:
+            raise Exception(f"{exporter.error_message}: {str(e)}")
+    
+    def generate_excel(self, table_data, source_path, sheet_titles=None):
+        """Excelファイルを生成
+        
+        table_data に表データのリストを渡した場合は1件1シートで書き出します。
+        """
+        return self.export(table_data, source_path, sheet_titles, 'xlsx')
+    
+    def reserve_output_path(self, source_path, extension=".xlsx"):
+        """重複しない出力パスを決定し、空ファイルを作成して確保する"""
+        source_path = Path(source_path)
+        # 保存先：指定がなければ選択したファイルと同じディレクトリ
+        output_dir = Path(self.output_dir) if self.output_dir else source_path.parent
+        output_dir.mkdir(parents=True, exist_ok=True)
+        base_name = source_path.stem  # 拡張子なしのファイル名
+        
+        output_path = output_dir / f"{base_name}_変換結果{extension}"
+        
+        # 同名ファイルがある場合は番号を追加
+        # （並列実行時に同じ名前を取り合わないようロック内で確保する）
+        with _output_path_lock:
+            counter = 1
+            while output_path.exists():
+                output_path = output_dir / f"{base_name}_変換結果_{counter}{extension}"
+                counter += 1
+            output_path.touch()
+        return output_path
+
+
+class BulkConverter:
+    """Message Batches API でまとめて変換する一括（夜間）モード
+    
+    ファイルを送信用の画像にしてまとめて1つのバッチで送信し、バッチのIDとリクエストの対応表を
+    bulk_jobs/ に保存します。処理状況は間隔を延ばしながら確認し、終わったら結果を順に読み込んで、
+    ファイルのすべてのページがそろったところでExcelファイルを書き出します。
+    対応表を保存しているため、アプリを再起動しても pending_jobs() と wait() で続きから再開できます。
+    一括モードでは分割解析は行わず、大きな画像は予算まで縮小して送ります。
+    """
+    
+    def __init__(self, engine, jobs_dir=BULK_JOBS_DIR, poll_initial=BULK_POLL_INITIAL_SECONDS,
+                 poll_max=BULK_POLL_MAX_SECONDS, max_requests=BULK_MAX_REQUESTS, max_batch_bytes=BULK_MAX_BATCH_BYTES):
+        self.engine = engine
+        self.jobs_dir = Path(jobs_dir)
+        self.poll_initial = poll_initial
+        self.poll_max = poll_max
+        self.max_requests = max_requests
+        self.max_batch_bytes = max_batch_bytes
+        self._client = None
+    
+    @classmethod
+    def from_config(cls, engine, config):
+        """設定（config.json の内容）から作成"""
+        return cls(engine,
+                   jobs_dir=config.get('bulk_jobs_dir', BULK_JOBS_DIR),
+                   poll_initial=config.get('bulk_poll_initial_seconds', BULK_POLL_INITIAL_SECONDS),
+                   poll_max=config.get('bulk_poll_max_seconds', BULK_POLL_MAX_SECONDS))
+    
+    @property
+    def client(self):
+        if self._client is None:
+            # バッチの送信・状態確認の再試行は SDK に任せる（接続は共有のクライアントと同じものを使う）
+            self._client = self.engine.api_client().with_options(max_retries=self.engine.max_retries)
+        return self._client
+    
+    def submit(self, files, pages=1, on_result=None):
+        """ファイルを用意してバッチで送信し、送信したジョブ（対応表）のリストを返す
+        
+        キャッシュ・類似画像で全ページの結果がそろったファイルは送信せず、その場でExcelを書き出します。
+        画像データが max_batch_bytes を超える場合は、ファイルの区切りで複数のバッチに分けて送信します。
+        """
+        engine = self.engine
+        jobs = []
+        job, requests, batch_bytes = self._new_job(), [], 0
+        for source_path in files:
+            try:
+                multi, prepared = self.prepare_file(engine, source_path, pages)
+            except Exception as e:
+                self._report(on_result, self._failed_result(source_path, e))
+                continue
+            
+            uploads = [(page, item, params) for page, item, params in prepared if params is not None]
+            size = sum(item['payload_bytes'] for _, item, _ in uploads)
+            if not uploads:
+                # 送信するページがない（キャッシュ・類似画像ですべてそろった）
+                local = self._new_job()
+                self._add_file(local, source_path, multi, prepared)
+                self._finish_file(engine, local, 0, on_result)
+                continue
+            
+            if requests and (batch_bytes + size > self.max_batch_bytes
+                             or len(requests) + len(uploads) > self.max_requests):
+                jobs.append(self._send(job, requests))
+                job, requests, batch_bytes = self._new_job(), [], 0
+            requests.extend(self._add_file(job, source_path, multi, prepared))
+            batch_bytes += size
+        
+        if requests:
+            jobs.append(self._send(job, requests))
+        return jobs
+    
+    def prepare_file(self, engine, source_path, pages=1):
+        """ファイルの各ページを（ページ番号, 対応表の項目, リクエスト）のリストにする
+        
+        キャッシュ・類似画像で結果が分かったページはリクエストを None にします。
+        （複数ページか, リスト）を返します。
+        """
+        page_numbers = [None]
+        if is_pdf_file(source_path):
+            page_numbers = parse_page_range(pages, get_pdf_page_count(source_path))
+        multi = len(page_numbers) > 1
+        
+        # 描画・エンコード（CPU処理）はプロセスプールで並列に行う
+        render_pool = get_render_pool()
+        items = {}
+        futures = {}
+        for number in page_numbers:
+            label = f"{source_path}（{number}ページ）" if multi else source_path
+            hashes = engine.duplicate_hashes(source_path, number)
+            items[number] = {
+                'page': number, 'origin': 'api', 'status': 'pending', 'attempts': 1,
+                'hashes': list(hashes) if hashes is not None else None, 'cache_key': None, 'payload_bytes': 0,
+                'table_data': None, 'usage': None, 'stop_reason': None, 'error': None,
+            }
+            table_data = engine.find_duplicate(hashes, label)
+            if table_data is not None:
+                items[number].update(origin='duplicate', status='done', table_data=table_data)
+            else:
+                futures[number] = render_pool.submit(load_upload_image, str(source_path), number,
+                                                     **engine.image_budget)
+        
+        prepared = []
+        for number in page_numbers:
+            params = None
+            if number in futures:
+                image_data, media_type = futures[number].result()
+                cache_key, cached = engine.lookup_cache(image_data, TABLE_REQUEST_TEXT)
+                if cached is not None:
+                    items[number].update(origin='cache', status='done', table_data=cached)
+                else:
+                    params = engine.build_request(image_data, media_type, TABLE_REQUEST_TEXT)
+                    items[number].update(cache_key=cache_key, payload_bytes=len(image_data))
+            prepared.append((number, items[number], params))
+        return multi, prepared
+    
+    def wait(self, job, on_result=None):
+        """バッチが終わるまで状態を確認し、結果を取り込んでExcelファイルを書き出す
+        
+        確認の間隔は poll_initial 秒から確認ごとに1.5倍（最大 poll_max 秒）に延ばします。
+        一時的なエラーで再送できる結果は、エンジンの max_retries 回まで新しいバッチで再送します。
+        エンジンの cancel() で待機を中止できます（対応表は残るので後で再開できます）。
+        """
+        interval = self.poll_initial
+        while job['status'] != 'completed':
+            if job['status'] == 'in_progress':
+                batch = self._retrieve(job['batch_id'])
+                if batch is None or batch.processing_status != 'ended':
+                    if batch is not None:
+                        counts = batch.request_counts
+                        print(f"バッチ {job['batch_id']}: 処理中 {counts.processing}件 / 成功 {counts.succeeded}件 / "
+                              f"エラー {counts.errored}件（{interval:.0f}秒後に再確認）")
+                    if self.engine.cancel_event.wait(interval):
+                        raise ExtractionCancelled("一括変換の待機を中止しました（後で再開できます）")
+                    interval = min(self.poll_max, interval * 1.5)
+                    continue
+                job['status'] = 'ended'
+                self.save(job)
+            
+            retry = self.collect(job, on_result)
+            if retry:
+                self._resubmit(job, retry, on_result)
+                interval = self.poll_initial
+            else:
+                job['status'] = 'completed'
+                self.save(job)
+        return job
+    
+    def collect(self, job, on_result=None):
+        """終わったバッチの結果を読み込み、そろったファイルから順にExcelを書き出す（再送する項目のIDを返す）"""
+        engine = self._job_engine(job)
+        try:
+            for entry in self.client.messages.batches.results(job['batch_id']):
+                item = job['items'].get(entry.custom_id)
+                if item is None or item['status'] != 'pending':
+                    continue  # 再開前に取り込み済み
+                self._apply_result(engine, job, item, entry.result)
+                if self._file_ready(job, item['file']):
+                    self._finish_file(engine, job, item['file'], on_result)
+                    self.save(job)
+        except Exception as e:
+            raise Exception(f"バッチ結果の取得エラー: {str(e)}")
+        
+        # 結果が返ってこなかった項目も再送する
+        retry = []
+        for custom_id, item in job['items'].items():
+            if item['status'] == 'pending':
+                item.update(status='retry', error="結果がありません")
+            if item['status'] == 'retry':
+                retry.append(custom_id)
+        self.save(job)
+        return retry
+    
+    def pending_jobs(self):
+        """保存済みで、まだ結果を取り込み終えていないジョブのリスト（古い順）"""
+        jobs = []
+        for path in sorted(self.jobs_dir.glob("*.json")):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    job = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"一括変換の対応表を読み込めません（{path}）: {e}")
+                continue
+            if job.get('status') != 'completed':
+                jobs.append(job)
+        return sorted(jobs, key=lambda job: job['submitted_at'])
+    
+    def save(self, job):
+        """ジョブ（対応表）を保存（書き込み途中で中断しても壊れないよう置き換えで保存）"""
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        path = self.jobs_dir / f"{job['id']}.json"
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(job, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    
+    def _new_job(self):
+        return {
+            'id': None, 'batch_id': None, 'batch_ids': [], 'status': 'preparing',
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'submitted_at': None,
+            'model': self.engine.model, 'response_schema': self.engine.response_schema,
+            'output_dir': self.engine.output_dir, 'output_format': self.engine.output_format,
+            'files': [], 'items': {},
+        }
+    
+    def _job_engine(self, job):
+        """ジョブを送信したときの設定（モデル・応答形式・出力先・出力形式）のエンジン"""
+        engine = copy(self.engine)
+        engine.model = job['model']
+        engine.response_schema = job['response_schema']
+        engine.output_dir = job['output_dir']
+        engine.output_format = job.get('output_format', DEFAULT_OUTPUT_FORMAT)
+        return engine
+    
+    def _add_file(self, job, source_path, multi, prepared):
+        """ファイルをジョブに追加し、送信するリクエストのリストを返す"""
+        index = len(job['files'])
+        entry = {'source': str(source_path), 'multi': multi, 'items': [], 'done': False, 'output': None, 'error': None}
+        job['files'].append(entry)
+        requests = []
+        for number, item, params in prepared:
+            custom_id = f"f{index:05d}-p{number or 0:04d}"
+            item['file'] = index
+            job['items'][custom_id] = item
+            entry['items'].append(custom_id)
+            if params is not None:
+                requests.append({'custom_id': custom_id, 'params': params})
+        return requests
+    
+    def _send(self, job, requests):
+        """リクエストをバッチで送信し、IDを対応表に保存"""
+        try:
+            batch = self.client.messages.batches.create(requests=requests)
+        except Exception as e:
+            raise Exception(f"バッチ送信エラー: {str(e)}")
+        job['id'] = job['id'] or batch.id
+        job['batch_id'] = batch.id
+        job['batch_ids'].append(batch.id)
+        job['submitted_at'] = job['submitted_at'] or time.time()
+        job['status'] = 'in_progress'
+        self.save(job)
+        size = sum(len(r['params']['messages'][0]['content'][0]['source']['data']) for r in requests)
+        print(f"バッチを送信しました: {batch.id}（{len(requests)}件、{size / 1024 / 1024:.1f}MB）")
+        return job
+    
+    def _retrieve(self, batch_id):
+        """バッチの状態を返す（一時的なエラーのときは None を返して次の確認を待つ）"""
+        try:
+            return self.client.messages.batches.retrieve(batch_id)
+        except Exception as e:
+            if not is_retryable_error(e):
+                raise Exception(f"バッチの状態確認エラー: {str(e)}")
+            print(f"バッチの状態を確認できませんでした（次の確認で再試行します）: {e}")
+            return None
+    
+    def _resubmit(self, job, custom_ids, on_result=None):
+        """一時的なエラーで失敗した項目を新しいバッチで再送する"""
+        engine = self._job_engine(job)
+        requests = []
+        for custom_id in custom_ids:
+            item = job['items'][custom_id]
+            source_path = job['files'][item['file']]['source']
+            try:
+                image_data, media_type = load_upload_image(source_path, item['page'], **engine.image_budget)
+            except Exception as e:
+                item.update(status='failed', error=str(e))
+                continue
+            requests.append({'custom_id': custom_id,
+                             'params': engine.build_request(image_data, media_type, TABLE_REQUEST_TEXT)})
+            item.update(status='pending', attempts=item['attempts'] + 1, error=None)
+        
+        for index in range(len(job['files'])):
+            if self._file_ready(job, index):
+                self._finish_file(engine, job, index, on_result)
+        if requests:
+            print(f"一時的なエラーの{len(requests)}件を再送信します")
+            self._send(job, requests)
+        else:
+            self.save(job)
+    
+    def _apply_result(self, engine, job, item, result):
+        """バッチの1件の結果を対応表の項目に反映する"""
+        if result.type == 'succeeded':
+            message = result.message
+            usage = getattr(message, 'usage', None)
+            item['usage'] = {key: getattr(usage, key, None) or 0 for key in TOKEN_USAGE_FIELDS}
+            item['stop_reason'] = getattr(message, 'stop_reason', None)
+            try:
+                if item['stop_reason'] == 'max_tokens':
+                    table_data = self._complete_truncated(engine, job, item, message)
+                else:
+                    table_data = parse_table_response(message.content[0].text)
+            except Exception as e:
+                item.update(status='failed', error=str(e))
+                return
+            item.update(status='done', table_data=table_data)
+            if item['cache_key'] is not None:
+                engine.cache.put(item['cache_key'], table_data)
+            if item['hashes'] is not None:
+                entry = job['files'][item['file']]
+                label = f"{entry['source']}（{item['page']}ページ）" if entry['multi'] else entry['source']
+                engine.remember_duplicate(item['hashes'], label, table_data)
+            return
+        
+        # errored（エラー）/ expired（期限切れ）/ canceled（取り消し）
+        error_type = result.type
+        detail = ""
+        if result.type == 'errored':
+            error = getattr(getattr(result, 'error', None), 'error', None)
+            error_type = getattr(error, 'type', None) or 'api_error'
+            detail = getattr(error, 'message', None) or ""
+        retryable = result.type in ('expired', 'canceled') or error_type in BULK_RETRYABLE_ERRORS
+        if retryable and item['attempts'] <= engine.max_retries:
+            item.update(status='retry', error=error_type)
+        else:
+            item.update(status='failed', error=f"{error_type}: {detail}" if detail else error_type)
+    
+    def _complete_truncated(self, engine, job, item, message):
+        """出力が上限で途切れた結果の続きを通常の API で要求し、結合した表データを返す
+        
+        続きの要求のトークン数は項目の usage に加えます。
+        """
+        entry = job['files'][item['file']]
+        image_data, media_type = load_upload_image(entry['source'], item['page'], **engine.image_budget)
+        request = engine.build_request(image_data, media_type, TABLE_REQUEST_TEXT)
+        client = engine.api_client()
+        metrics = ConversionMetrics(entry['source'], engine.model)
+        table_data = engine.complete_response(client, request, image_data, message.content[0].text, message, metrics)
+        for key in TOKEN_USAGE_FIELDS:
+            item['usage'][key] += metrics.counters[key]
+        item['continuations'] = metrics.counters['continuations']
+        return table_data
+    
+    def _file_ready(self, job, index):
+        entry = job['files'][index]
+        return not entry['done'] and all(job['items'][custom_id]['status'] in ('done', 'failed')
+                                         for custom_id in entry['items'])
+    
+    def _finish_file(self, engine, job, index, on_result=None):
+        """ファイルのすべてのページがそろったらExcelファイルを書き出し、計測値を記録する"""
+        entry = job['files'][index]
+        items = [job['items'][custom_id] for custom_id in entry['items']]
+        metrics = ConversionMetrics(entry['source'], engine.model)
+        metrics.response_schema = engine.response_schema
+        metrics.batch_id = job['id']
+        for item in items:
+            if item['usage'] is not None:
+                metrics.add_response(types.SimpleNamespace(usage=types.SimpleNamespace(**item['usage']),
+                                                           stop_reason=item['stop_reason']))
+            metrics.add(payload_bytes=item['payload_bytes'], retries=item['attempts'] - 1,
+                        continuations=item.get('continuations', 0),
+                        cache_hits=int(item['origin'] == 'cache'),
+                        duplicate_hits=int(item['origin'] == 'duplicate'))
+        
+        output = error = None
+        failed = [item for item in items if item['status'] == 'failed']
+        try:
+            if failed:
+                if entry['multi']:
+                    details = "\n".join(f"{item['page']}ページ: {item['error']}" for item in failed)
+                    raise Exception(f"{len(failed)}ページの変換に失敗しました:\n{details}")
+                raise Exception(f"Claude API解析エラー: {failed[0]['error']}")
+            for item in items:
+                metrics.add_table(item['table_data'])
+            with metrics.stage('excel'):
+                if entry['multi']:
+                    output = engine.write_output([item['table_data'] for item in items], entry['source'],
+                                                 sheet_titles=[f"{item['page']}ページ" for item in items])
+                else:
+                    output = engine.write_output(items[0]['table_data'], entry['source'])
+        except Exception as e:
+            error = e
+        
+        metrics.finish(output=output, error=error)
+        if job['submitted_at']:
+            metrics.total_seconds = time.time() - job['submitted_at']  # 送信から書き出しまで
+        if engine.metrics_log is not None:
+            engine.metrics_log.write(metrics)
+        
+        entry.update(done=True, output=output, error=str(error) if error else None)
+        for item in items:
+            item['table_data'] = None  # 書き出し済みの表は対応表に残さない
+        self._report(on_result, {'source': entry['source'], 'ok': error is None, 'output': output,
+                                 'error': str(error) if error else None, 'elapsed': metrics.total_seconds,
+                                 'metrics': metrics, 'cancelled': False})
+    
+    def _failed_result(self, source_path, error):
+        metrics = ConversionMetrics(source_path, self.engine.model)
+        metrics.response_schema = self.engine.response_schema
+        metrics.finish(error=error)
+        if self.engine.metrics_log is not None:
+            self.engine.metrics_log.write(metrics)
+        return {'source': str(source_path), 'ok': False, 'output': None, 'error': str(error),
+                'elapsed': metrics.total_seconds, 'metrics': metrics, 'cancelled': False}
+    
+    @staticmethod
+    def _report(on_result, result):
+        if on_result:
+            on_result(result)
 
-# アプリケーション設定
-APP_TITLE = "清掃スケジュール Excel変換ツール"
-APP_VERSION = "1.0.0"
-CONFIG_FILE = "config.json"
 
-# CustomTkinter テーマ設定
-ctk.set_appearance_mode("light")
-ctk.set_default_color_theme("blue")
+class UIEventBus:
+    """変換スレッドから画面への通知を受け渡すキュー（Tk のウィジェットはメインスレッドからだけ操作する）
+    
+    変換スレッドは post() でイベントを積むだけで、画面側が一定間隔で drain() して反映します。
+    進捗のイベントはジョブごとに最新のものだけを残すので、行ごとに通知しても描画は1回で済みます。
+    """
+    
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+    
+    def post(self, kind, job_id=None, **data):
+        """イベントを積む（どのスレッドからでも呼び出せる）"""
+        self._queue.put((kind, job_id, data))
+    
+    def drain(self, limit=UI_MAX_EVENTS_PER_POLL):
+        """積まれたイベントを (種類, ジョブID, データ) のリストで返す（進捗はジョブごとに最新のものだけ）"""
+        events = []
+        progress_index = {}  # ジョブID → events 内の最新の進捗イベントの位置
+        for _ in range(limit):
+            try:
+                event = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            kind, job_id, _data = event
+            if kind == 'progress':
+                if job_id in progress_index:
+                    events[progress_index[job_id]] = None
+                progress_index[job_id] = len(events)
+            events.append(event)
+        return [event for event in events if event is not None]
+
+
+def format_elapsed(seconds):
+    """経過時間を「分:秒」で表す"""
+    seconds = int(seconds)
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+
+class JobListItem(ctk.CTkFrame):
+    """ジョブ一覧の1行（ファイル名・進捗・経過時間・中止ボタン）"""
+    
+    def __init__(self, master, job, on_cancel, on_close):
+        super().__init__(master)
+        self.job = job
+        self.on_cancel = on_cancel
+        self.on_close = on_close
+        self.value = 0.0
+        self.status_text = "待機中..."
+        self.active = True
+        self.started = None  # 変換を始めた時刻（待機中は None）
+        self.finished = None
+        self._shown_seconds = None
+        
+        self.columnconfigure(1, weight=1)
+        ctk.CTkLabel(self, text=os.path.basename(job.source_path), font=ctk.CTkFont(size=12), width=160,
+                     anchor="w").grid(row=0, column=0, padx=5, sticky="w")
+        self.progress_bar = ctk.CTkProgressBar(self)
+        self.progress_bar.grid(row=0, column=1, padx=5, sticky="ew")
+        self.progress_bar.set(0)
+        self.elapsed_label = ctk.CTkLabel(self, text="", font=ctk.CTkFont(size=12), width=50)
+        self.elapsed_label.grid(row=0, column=2, padx=5)
+        self.button = ctk.CTkButton(self, text="中止", width=70, command=self.on_button)
+        self.button.grid(row=0, column=3, padx=5)
+        self.status_label = ctk.CTkLabel(self, text=self.status_text, font=ctk.CTkFont(size=11),
+                                         text_color="gray", anchor="w")
+        self.status_label.grid(row=1, column=0, columnspan=4, padx=5, sticky="w")
+    
+    def set_progress(self, value, status_text):
+        if self.started is None:
+            self.started = time.monotonic()
+        self.value = value
+        self.status_text = status_text
+        self.progress_bar.set(value)
+        self.status_label.configure(text=status_text)
+    
+    def finish(self, kind, status_text):
+        """変換が終わった（kind は 'done' / 'failed' / 'cancelled'）"""
+        self.active = False
+        self.finished = time.monotonic()
+        self.tick(self.finished)
+        self.set_progress(1.0 if kind == 'done' else self.value, status_text)
+        self.status_label.configure(text_color=("green" if kind == 'done' else "red" if kind == 'failed' else "gray"))
+        self.button.configure(text="閉じる", state="normal")
+    
+    def tick(self, now):
+        """経過時間の表示を更新する（表示する秒数が変わったときだけ描画する）"""
+        if self.started is None:
+            return
+        seconds = int((self.finished or now) - self.started)
+        if seconds != self._shown_seconds:
+            self._shown_seconds = seconds
+            self.elapsed_label.configure(text=format_elapsed(seconds))
+    
+    def on_button(self):
+        if self.active:
+            self.button.configure(state="disabled")
+            self.status_label.configure(text="中止しています...")
+            self.on_cancel(self)
+        else:
+            self.on_close(self)
 
 
 class CleaningScheduleApp(ctk.CTk):
@@ -49,29 +4722,109 @@ class CleaningScheduleApp(ctk.CTk):
         self.api_key = None
         self.is_pdf = False
         self.pdf_page_number = 1
+        self.settings = {}
         
         # 設定読み込み
         self.load_config()
+        self.output_format = self.settings.get('output_format', DEFAULT_OUTPUT_FORMAT)
+        
+        # 解析結果キャッシュと計測ログ（変換ごとに共有）
+        self.extraction_cache = ExtractionCache.from_config(self.settings)
+        self.metrics_log = (MetricsLog(self.settings.get('metrics_file', METRICS_FILE))
+                            if self.settings.get('metrics_enabled', True) else None)  # None なら記録しない
+        self.duplicate_index = DuplicateIndex.from_config(self.settings)
+        self.job_store = JobStore.from_config(self.settings)  # 変換中に終了しても続きから再開できるようにする
+        
+        # プレビューは1本のバックグラウンドスレッドで作成し、作成済みのものは再利用する
+        self.thumbnail_cache = ThumbnailCache()
+        self.preview_executor = ThreadPoolExecutor(max_workers=1)
+        
+        # 変換ジョブ（複数を同時に変換し、変換スレッドからの通知はイベントバス経由で画面に反映する）
+        self.events = UIEventBus()
+        self.jobs = {}  # ジョブID → JobListItem
+        self.next_job_id = 1
+        self.finished_jobs = []  # 変換中のジョブがなくなるまでに終わったジョブ（(種類, JobListItem, データ)）
+        self.job_slots = threading.BoundedSemaphore(max(1, self.settings.get('gui_max_jobs', GUI_MAX_CONCURRENT_JOBS)))
         
         # UI構築
         self.create_widgets()
+        startup_timings['window_created'] = time.perf_counter() - _MODULE_START
+        self.after(UI_POLL_INTERVAL_MS, self.poll_events)
+        
+        # 最初の描画が終わったら起動時間を記録し、重いモジュールをバックグラウンドで読み込む
+        self.exit_after_first_paint = False
+        self.after(0, lambda: self.after_idle(self.on_first_paint))
         
+    def on_first_paint(self):
+        """最初の描画後の処理"""
+        startup_timings['first_paint'] = time.perf_counter() - _MODULE_START
+        budget_ms = self.settings.get('startup_budget_ms', STARTUP_BUDGET_MS)
+        print(format_startup_report(budget_ms))
+        
+        if self.exit_after_first_paint:
+            self.destroy()
+            return
+        
+        threading.Thread(target=self.preload, daemon=True).start()
+        self.after(500, self.offer_resume)
+    
+    def preload(self):
+        """重いモジュールを読み込み、APIサーバーへの接続を開いておく（別スレッド）"""
+        preload_modules()
+        client_pool = ClientPool.from_config(self.settings)
+        if self.api_key and client_pool.prewarm_enabled:
+            client_pool.prewarm(self.api_key)
+    
+    def offer_resume(self):
+        """前回終了したときに変換中だったファイルがあれば、続きから再開するか確認する"""
+        if self.job_store is None:
+            return
+        try:
+            jobs = self.job_store.pending()
+        except Exception as e:
+            print(f"ジョブストアを読み込めません: {e}")
+            return
+        if not jobs:
+            return
+        
+        names = "\n".join(os.path.basename(job['source']) for job in jobs[:5]) + ("\n…" if len(jobs) > 5 else "")
+        if not messagebox.askyesno(
+            "中断した変換",
+            f"前回終了したときに変換中だったファイルが{len(jobs)}件あります。\n\n{names}\n\n続きから再開しますか？\n"
+            f"（解析が終わっているファイルはAPIを呼ばずにExcelを作成します）"
+        ):
+            for job in jobs:
+                self.job_store.update(job['id'], stage='failed', error="再開しませんでした")
+            return
+        if not self.api_key:
+            messagebox.showwarning("APIキー未設定", "Claude APIキーが設定されていません。\n設定ボタンから設定してください。")
+            return
+        
+        # ジョブ一覧に並べて再開する（解析済みのものはチェックポイントから続ける）
+        for job in jobs:
+            if not os.path.exists(job['source']):
+                self.job_store.update(job['id'], stage='failed', error="ファイルが見つかりません")
+                continue
+            self.add_job(ConversionJob(job['source'], job['pages']), store_job_id=job['id'])
+    
+    def create_engine(self):
+        """現在の設定で変換エンジンを作成"""
+        return ConversionEngine.from_config(self.api_key, self.settings, cache=self.extraction_cache,
+                                            metrics_log=self.metrics_log,
+                                            duplicate_index=self.duplicate_index,
+                                            confirm_duplicate=self.confirm_duplicate)
+    
     def load_config(self):
         """設定ファイルを読み込む"""
-        if os.path.exists(CONFIG_FILE):
-            try:
-                with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-                    config = json.load(f)
-                    self.api_key = config.get('claude_api_key', '')
-            except Exception as e:
-                print(f"設定読み込みエラー: {e}")
+        self.settings = load_config()
+        self.api_key = self.settings.get('claude_api_key', '')
     
     def save_config(self):
         """設定ファイルを保存"""
         try:
-            config = {'claude_api_key': self.api_key or ''}
+            self.settings['claude_api_key'] = self.api_key or ''
             with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-                json.dump(config, f, ensure_ascii=False, indent=2)
+                json.dump(self.settings, f, ensure_ascii=False, indent=2)
         except Exception as e:
             print(f"設定保存エラー: {e}")
     
@@ -133,6 +4886,11 @@ class CleaningScheduleApp(ctk.CTk):
         )
         self.status_label.pack(pady=5)
         
+        # ジョブ一覧（最初の変換を始めるまでは非表示）
+        self.job_list = ctk.CTkScrollableFrame(main_frame, height=120, label_text="変換ジョブ")
+        self.job_list.pack(fill="x", pady=5)
+        self.job_list.pack_forget()
+        
         # PDFページ番号入力（初期は非表示）
         self.page_frame = ctk.CTkFrame(main_frame)
         self.page_frame.pack(pady=5)
@@ -140,7 +4898,7 @@ class CleaningScheduleApp(ctk.CTk):
         
         page_label = ctk.CTkLabel(
             self.page_frame,
-            text="PDFページ番号:",
+            text="PDFページ（例: 1 / 1-5,8 / all）:",
             font=ctk.CTkFont(size=12)
         )
         page_label.pack(side="left", padx=5)
@@ -153,6 +4911,26 @@ class CleaningScheduleApp(ctk.CTk):
         self.page_entry.pack(side="left", padx=5)
         self.page_entry.insert(0, "1")
         
+        # 出力形式の選択（Excel の書式が不要なら CSV などで速く書き出せる）
+        self.format_frame = ctk.CTkFrame(main_frame)
+        self.format_frame.pack(pady=5)
+        
+        format_label = ctk.CTkLabel(
+            self.format_frame,
+            text="出力形式:",
+            font=ctk.CTkFont(size=12)
+        )
+        format_label.pack(side="left", padx=5)
+        
+        self.format_menu = ctk.CTkOptionMenu(
+            self.format_frame,
+            values=list(OUTPUT_FORMAT_LABELS.values()),
+            command=self.on_output_format_changed,
+            width=200
+        )
+        self.format_menu.pack(side="left", padx=5)
+        self.format_menu.set(OUTPUT_FORMAT_LABELS.get(self.output_format, OUTPUT_FORMAT_LABELS[DEFAULT_OUTPUT_FORMAT]))
+        
         # ボタンフレーム
         self.button_frame = ctk.CTkFrame(main_frame)
         self.button_frame.pack(pady=10)
@@ -201,92 +4979,90 @@ class CleaningScheduleApp(ctk.CTk):
             self.image_path = filepath
             
             # PDFかどうかを判定
-            self.is_pdf = filepath.lower().endswith('.pdf')
+            self.is_pdf = is_pdf_file(filepath)
             
             if self.is_pdf:
-                # PDFの場合はページ番号入力欄を表示（ボタンフレームの前に挿入）
-                self.page_frame.pack(before=self.button_frame, pady=5)
-                self.display_pdf_preview(filepath)
+                # PDFの場合はページ番号入力欄を表示（出力形式の選択欄の前に挿入）
+                self.page_frame.pack(before=self.format_frame, pady=5)
                 self.filename_label.configure(text=f"PDF: {os.path.basename(filepath)}")
+                self.display_preview(filepath)
                 self.status_label.configure(text="PDFを選択しました（ページ番号を指定してください）")
             else:
                 # 画像の場合はページ番号入力欄を非表示
                 self.page_frame.pack_forget()
-                self.display_image(filepath)
                 self.filename_label.configure(text=os.path.basename(filepath))
+                self.display_preview(filepath)
                 self.status_label.configure(text="画像を選択しました")
             
             self.convert_btn.configure(state="normal")
     
-    def display_image(self, filepath):
-        """画像をプレビュー表示"""
+    def display_preview(self, filepath):
+        """画像またはPDFの最初のページをプレビュー表示（縮小画像はバックグラウンドで作成）"""
         try:
-            # 画像を読み込み
-            img = Image.open(filepath)
-            
-            # プレビューサイズに調整（最大600x450）
-            max_width, max_height = 600, 450
-            img.thumbnail((max_width, max_height), Image.Resampling.LANCZOS)
-            
-            # PhotoImageに変換
-            photo = ImageTk.PhotoImage(img)
-            
-            # 表示を更新
-            self.preview_label.configure(image=photo, text="")
-            self.preview_label.image = photo  # 参照を保持
-            
-            # ウィンドウサイズを調整（画像の高さに応じて）
-            self.adjust_window_size(img.height)
-            
-        except Exception as e:
-            messagebox.showerror("エラー", f"画像の読み込みに失敗しました:\n{e}")
+            key = ThumbnailCache.make_key(filepath)
+        except OSError as e:
+            messagebox.showerror("エラー", f"ファイルの読み込みに失敗しました:\n{e}")
+            return
+        
+        # 作成済みならすぐに表示する
+        cached = self.thumbnail_cache.get(key)
+        if cached is not None:
+            self.show_preview(filepath, *cached)
+            return
+        
+        self.preview_label.configure(image="", text="プレビューを読み込み中...")
+        self.preview_label.image = None
+        
+        def work():
+            # 表示はイベントバス経由でメインスレッドに任せる
+            try:
+                img, page_count = render_preview(filepath)
+            except Exception as e:
+                kind = "PDF" if is_pdf_file(filepath) else "画像"
+                message = f"{kind}の読み込みに失敗しました:\n{e}"  # e は except を抜けると消えるので、ここで文字列にする
+                self.events.post('call', function=lambda: self.show_preview_error(filepath, message))
+                return
+            self.thumbnail_cache.put(key, (img, page_count))
+            self.events.post('call', function=lambda: self.show_preview(filepath, img, page_count))
+        
+        self.preview_executor.submit(work)
     
-    def display_pdf_preview(self, filepath):
-        """PDFの最初のページをプレビュー表示"""
-        try:
-            # PDFを開く
-            doc = fitz.open(filepath)
-            
-            # ページ数を取得
-            page_count = len(doc)
-            
-            # 最初のページを画像に変換
-            page = doc[0]
-            pix = page.get_pixmap(matrix=fitz.Matrix(1.5, 1.5))  # 150% ズーム
-            
-            # PIL Imageに変換
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-            
-            # プレビューサイズに調整（最大600x450）
-            max_width, max_height = 600, 450
-            img.thumbnail((max_width, max_height), Image.Resampling.LANCZOS)
-            
-            # PhotoImageに変換
-            photo = ImageTk.PhotoImage(img)
-            
-            # 表示を更新
-            self.preview_label.configure(image=photo, text="")
-            self.preview_label.image = photo  # 参照を保持
-            
-            doc.close()
-            
-            # ページ数情報を表示
+    def show_preview(self, filepath, img, page_count=None):
+        """作成したプレビュー画像を表示（メインスレッドで呼び出す）"""
+        # 読み込み中に別のファイルが選択された場合は表示しない
+        if filepath != self.image_path:
+            return
+        
+        # PhotoImageに変換
+        photo = ImageTk.PhotoImage(img)
+        
+        # 表示を更新
+        self.preview_label.configure(image=photo, text="")
+        self.preview_label.image = photo  # 参照を保持
+        
+        # ページ数情報を表示
+        if page_count is not None:
             self.filename_label.configure(
                 text=f"PDF: {os.path.basename(filepath)} （全{page_count}ページ）"
             )
-            
-            # ウィンドウサイズを調整（画像の高さに応じて）
-            self.adjust_window_size(img.height)
-            
-        except Exception as e:
-            messagebox.showerror("エラー", f"PDFの読み込みに失敗しました:\n{e}")
+        
+        # ウィンドウサイズを調整（画像の高さに応じて）
+        self.adjust_window_size(img.height)
+    
+    def show_preview_error(self, filepath, message):
+        """プレビュー作成の失敗を表示（メインスレッドで呼び出す）"""
+        if filepath != self.image_path:
+            return
+        self.preview_label.configure(image="", text="プレビューを表示できません")
+        messagebox.showerror("エラー", message)
     
     def adjust_window_size(self, image_height):
         """画像の高さに応じてウィンドウサイズを調整"""
         # 必要な高さを計算
         # タイトル(60) + ボタン(60) + プレビュー(image_height+20) + ファイル名(30) + 
-        # プログレスバー(40) + ステータス(30) + PDFページ(40) + ボタンフレーム(60) + 余白(100)
-        required_height = 60 + 60 + (image_height + 20) + 30 + 40 + 30 + 40 + 60 + 100
+        # プログレスバー(40) + ステータス(30) + ジョブ一覧(表示中は170) + PDFページ(40) + ボタンフレーム(60) + 余白(100)
+        job_list_height = 170 if self.jobs else 0
+        required_height = 60 + 60 + (image_height + 20) + 30 + 40 + 30 + job_list_height + 40 + 60 + 100
         
         # 現在のウィンドウサイズを取得
         current_width = self.winfo_width()
@@ -315,6 +5091,14 @@ class CleaningScheduleApp(ctk.CTk):
             self.api_key = settings_window.result
             self.save_config()
     
+    def on_output_format_changed(self, label):
+        """出力形式を選んだとき（次回の起動時も同じ形式にする）"""
+        for output_format, format_label in OUTPUT_FORMAT_LABELS.items():
+            if format_label == label:
+                self.output_format = output_format
+        self.settings['output_format'] = self.output_format
+        self.save_config()
+    
     def start_conversion(self):
         """Excel変換を開始"""
         
@@ -331,302 +5115,173 @@ class CleaningScheduleApp(ctk.CTk):
             messagebox.showerror("エラー", "有効な画像が選択されていません")
             return
         
-        # ボタンを無効化
-        self.convert_btn.configure(state="disabled")
+        # ページ指定はここ（メインスレッド）で読み取ってからジョブに渡す（例: 1 / 1-5,8 / all）
+        pages = 1
+        if self.is_pdf:
+            pages = self.page_entry.get().strip()
+            if not pages:
+                messagebox.showerror("エラー", "有効なページ番号を入力してください")
+                return
         
-        # 別スレッドで処理を実行
-        thread = threading.Thread(target=self.conversion_process, daemon=True)
-        thread.start()
+        # 変換中も次のファイルを選んで追加できる（同時に変換する数を超えた分は待機する）
+        self.add_job(ConversionJob(self.image_path, pages, self.output_format))
     
-    def pdf_page_to_image_base64(self, pdf_path, page_number):
-        """PDFの指定ページを画像（Base64）に変換"""
-        try:
-            doc = fitz.open(pdf_path)
-            
-            # ページ番号の検証（1-indexed → 0-indexed）
-            page_index = page_number - 1
-            if page_index < 0 or page_index >= len(doc):
-                raise ValueError(f"ページ番号が範囲外です（1〜{len(doc)}ページの範囲で指定してください）")
-            
-            # 指定ページを取得
-            page = doc[page_index]
-            
-            # 高解像度で画像に変換（300dpiに相当する倍率）
-            zoom = 300 / 72  # PDFは72dpi、300dpiにするには約4.17倍
-            pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
-            
-            # PIL Imageに変換
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-            
-            # JPEGとして保存（メモリ上）
-            img_byte_arr = io.BytesIO()
-            img.save(img_byte_arr, format='JPEG', quality=95)
-            img_byte_arr.seek(0)
-            
-            # Base64エンコード
-            image_data = base64.standard_b64encode(img_byte_arr.read()).decode('utf-8')
-            
-            doc.close()
-            return image_data
-            
-        except Exception as e:
-            raise Exception(f"PDF変換エラー: {str(e)}")
+    def add_job(self, job, store_job_id=None):
+        """ジョブ一覧に行を追加して変換を始める（store_job_id はジョブストアから再開する場合のID）"""
+        job_id = self.next_job_id
+        self.next_job_id += 1
+        item = JobListItem(self.job_list, job, on_cancel=self.cancel_job, on_close=self.close_job)
+        item.pack(fill="x", pady=2)
+        if not self.jobs:
+            self.job_list.pack(after=self.status_label, fill="x", pady=5)
+        self.jobs[job_id] = item
+        self.update_overall_progress()
+        threading.Thread(target=self.conversion_process, args=(job_id, job, store_job_id), daemon=True).start()
     
-    def conversion_process(self):
-        """変換処理（別スレッド）"""
-        try:
-            # ステップ1: 画像読み込み
-            if self.is_pdf:
-                # PDFの場合
-                self.update_progress(0.1, "PDFを読み込んでいます...")
-                
-                # ページ番号を取得
-                try:
-                    page_num = int(self.page_entry.get())
-                except ValueError:
-                    raise Exception("有効なページ番号を入力してください")
-                
-                # PDFを画像に変換
-                image_data = self.pdf_page_to_image_base64(self.image_path, page_num)
-            else:
-                # 画像ファイルの場合
-                self.update_progress(0.1, "画像を読み込んでいます...")
-                with open(self.image_path, 'rb') as f:
-                    image_data = base64.standard_b64encode(f.read()).decode('utf-8')
-            
-            # ステップ2: Claude APIで解析
-            self.update_progress(0.3, "Claude APIで解析中...")
-            table_data = self.analyze_with_claude(image_data)
-            
-            # ステップ3: Excel生成
-            self.update_progress(0.7, "Excelファイルを生成中...")
-            excel_path = self.generate_excel(table_data)
-            
-            # ステップ4: 完了
-            self.update_progress(1.0, "完了しました！")
-            
-            # 完了メッセージ
-            self.after(100, lambda: self.show_completion(excel_path))
-            
-        except Exception as e:
-            error_msg = f"エラーが発生しました:\n{str(e)}"
-            self.after(100, lambda: messagebox.showerror("エラー", error_msg))
-            self.after(100, lambda: self.update_progress(0, "エラーが発生しました"))
-        finally:
-            self.after(100, lambda: self.convert_btn.configure(state="normal"))
+    def cancel_job(self, item):
+        """ジョブを中止する（変換スレッドは受信中のレスポンス・再試行の待機も打ち切る）"""
+        item.job.cancel()
     
-    def analyze_with_claude(self, image_data):
-        """Claude APIで画像を解析"""
+    def close_job(self, item):
+        """終わったジョブを一覧から外す"""
+        for job_id, other in list(self.jobs.items()):
+            if other is item:
+                del self.jobs[job_id]
+        item.destroy()
+        if not self.jobs:
+            self.job_list.pack_forget()
+    
+    def conversion_process(self, job_id, job, store_job_id=None):
+        """変換処理（別スレッド。画面には触らず、イベントバスに通知を積む）"""
+        
+        def progress(value, status_text):
+            if job.cancelled:
+                raise ExtractionCancelled("解析を中止しました")
+            self.events.post('progress', job_id, value=value, text=status_text)
+        
         try:
-            # Anthropic クライアントを初期化
-            client = anthropic.Anthropic(
-                api_key=self.api_key
-            )
-            
-            message = client.messages.create(
-                model="claude-sonnet-4-5",
-                max_tokens=8000,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "image",
-                                "source": {
-                                    "type": "base64",
-                                    "media_type": "image/jpeg",
-                                    "data": image_data,
-                                },
-                            },
-                            {
-                                "type": "text",
-                                "text": """この画像に含まれる表データを解析して、表形式のJSON（columns と rows）で出力してください。
-
-【重要】以下のJSON形式を必ず守ってください：
-- トップレベルのキーは "title", "columns", "rows" のみ
-- "columns" は列名の配列
-- "rows" は各行のデータをオブジェクトの配列として表現
-
-【必須要件】
-1. 表のすべての行・列を漏らさず出力（省略禁止）
-2. 説明文やコメントは一切含めず、純粋なJSONのみ出力
-3. コードブロック（```json）は使用しないでください
-
-【出力例】
-{
-  "title": "タイトル",
-  "columns": ["列1", "列2", "列3", "列4"],
-  "rows": [
-    {"列1": "値1", "列2": "値2", "列3": "値3", "列4": "値4"},
-    {"列1": "値5", "列2": "値6", "列3": "値7", "列4": "値8"}
-  ]
-}
-
-上記の形式で、画像内のすべてのデータを含むJSONを出力してください。"""
-                            }
-                        ]
-                    }
-                ]
-            )
-            
-            # レスポンスからJSONを抽出
-            response_text = message.content[0].text
-            
-            # デバッグ用：レスポンスをファイルに保存
+            # 同時に変換する数を超えていれば空くまで待つ（待っている間に中止されたらすぐに終える）
+            while not self.job_slots.acquire(timeout=GUI_JOB_WAIT_INTERVAL):
+                if job.cancelled:
+                    raise ExtractionCancelled("解析を中止しました")
             try:
-                debug_dir = Path("debug_output")
-                debug_dir.mkdir(exist_ok=True)
-                with open(debug_dir / 'claude_response.txt', 'w', encoding='utf-8') as f:
-                    f.write(response_text)
-                print(f"Claude response saved to debug_output/claude_response.txt")
-            except:
-                pass
-            
-            # JSONの抽出（```json ``` で囲まれている場合に対応）
-            if "```json" in response_text:
-                json_start = response_text.find("```json") + 7
-                json_end = response_text.find("```", json_start)
-                response_text = response_text[json_start:json_end].strip()
-            elif "```" in response_text:
-                json_start = response_text.find("```") + 3
-                json_end = response_text.find("```", json_start)
-                response_text = response_text[json_start:json_end].strip()
-            
-            # JSONオブジェクトのみを抽出（余分なテキストを除去）
-            # 最初の { から最後の } までを抽出
-            json_start_bracket = response_text.find('{')
-            json_end_bracket = response_text.rfind('}')
-            
-            if json_start_bracket != -1 and json_end_bracket != -1:
-                response_text = response_text[json_start_bracket:json_end_bracket+1]
-            
-            # JSONパース
-            table_data = json.loads(response_text)
-            
-            # データ構造の検証
-            if 'columns' not in table_data or 'rows' not in table_data:
-                raise Exception(
-                    f"不正なJSON形式：'columns'と'rows'が必要です。\n"
-                    f"受け取ったキー: {list(table_data.keys())}\n"
-                    f"詳細は debug_output/claude_response.txt を確認してください。"
-                )
-            
-            if not isinstance(table_data['columns'], list) or not isinstance(table_data['rows'], list):
-                raise Exception("'columns'と'rows'は配列である必要があります。")
-            
-            if len(table_data['rows']) == 0:
-                raise Exception("データ行が0件です。画像を確認してください。")
-            
-            print(f"解析成功: {len(table_data['columns'])}列 x {len(table_data['rows'])}行")
-            
-            return table_data
-            
+                progress(0, "変換を開始しています...")
+                engine = self.create_engine()
+                engine.cancel_event = job.cancel_event  # 中止したらストリーミングの受信・再試行の待機も止める
+                job.metrics = ConversionMetrics(job.source_path, engine.model)
+                # ジョブストアに登録し、段階ごとの結果を保存する（終了・クラッシュ後に再開できる）
+                if self.job_store is not None:
+                    if store_job_id is None:
+                        store_job_id = self.job_store.enqueue(job.source_path, job.pages)
+                    job.checkpoint = self.job_store.checkpoint(store_job_id)
+                output = engine.convert(job.source_path, job.pages, progress=progress, metrics=job.metrics,
+                                        checkpoint=job.checkpoint, output_format=job.output_format)
+            finally:
+                self.job_slots.release()
         except Exception as e:
-            raise Exception(f"Claude API解析エラー: {str(e)}")
+            if job.cancelled:
+                if job.checkpoint is None and store_job_id is not None:
+                    self.job_store.update(store_job_id, stage='failed', error="中止しました")  # 再開する前に中止した
+                self.events.post('cancelled', job_id, text="中止しました")
+            else:
+                self.events.post('failed', job_id, text=str(e))
+        else:
+            # 処理時間・トークン数などの要約も表示する
+            self.events.post('done', job_id, text=f"完了: {output}", output=output, summary=job.metrics.summary())
     
-    def generate_excel(self, table_data):
-        """Excelファイルを生成"""
+    def poll_events(self):
+        """変換スレッドからのイベントを画面に反映する（メインスレッドで一定間隔に実行）"""
         try:
-            wb = Workbook()
-            ws = wb.active
-            ws.title = "清掃スケジュール"
-            
-            current_row = 1
-            
-            # タイトル行（セル結合）
-            if 'title' in table_data:
-                num_cols = len(table_data.get('columns', []))
-                if num_cols > 0:
-                    ws['A1'] = table_data['title']
-                    end_col = chr(64 + min(num_cols, 26))  # 最大Z列まで
-                    ws.merge_cells(f'A1:{end_col}1')
-                    ws['A1'].font = Font(size=14, bold=True, color='FFFFFF')
-                    ws['A1'].fill = PatternFill(start_color='000000', end_color='000000', fill_type='solid')
-                    ws['A1'].alignment = Alignment(horizontal='center', vertical='center')
-                    current_row += 1
-            
-            # ヘッダー行
-            columns = table_data.get('columns', table_data.get('headers', []))
-            if columns:
-                for col_idx, header in enumerate(columns, start=1):
-                    cell = ws.cell(row=current_row, column=col_idx, value=header)
-                    cell.font = Font(bold=True, size=10)
-                    cell.fill = PatternFill(start_color='D3D3D3', end_color='D3D3D3', fill_type='solid')
-                    cell.alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
-                    cell.border = Border(
-                        left=Side(style='thin'),
-                        right=Side(style='thin'),
-                        top=Side(style='thin'),
-                        bottom=Side(style='thin')
-                    )
-                current_row += 1
-            
-            # データ行
-            if 'rows' in table_data:
-                for row_data in table_data['rows']:
-                    for col_idx, header in enumerate(columns, start=1):
-                        value = row_data.get(header, '')
-                        cell = ws.cell(row=current_row, column=col_idx, value=value)
-                        cell.alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
-                        cell.border = Border(
-                            left=Side(style='thin'),
-                            right=Side(style='thin'),
-                            top=Side(style='thin'),
-                            bottom=Side(style='thin')
-                        )
-                    current_row += 1
-            
-            # 列幅を自動調整
-            for column_cells in ws.columns:
-                max_length = 0
-                column_letter = None
-                for cell in column_cells:
-                    try:
-                        # 結合されたセルをスキップ
-                        if hasattr(cell, 'column_letter'):
-                            if column_letter is None:
-                                column_letter = cell.column_letter
-                            if cell.value:
-                                cell_length = len(str(cell.value))
-                                if cell_length > max_length:
-                                    max_length = cell_length
-                    except:
-                        pass
-                
-                # 列幅を設定
-                if column_letter and max_length > 0:
-                    adjusted_width = min(max_length + 2, 50)
-                    ws.column_dimensions[column_letter].width = adjusted_width
-            
-            # 保存先：選択したファイルと同じディレクトリ
-            source_path = Path(self.image_path)
-            output_dir = source_path.parent  # 元ファイルと同じディレクトリ
-            base_name = source_path.stem  # 拡張子なしのファイル名
-            
-            output_path = output_dir / f"{base_name}_変換結果.xlsx"
-            
-            # 同名ファイルがある場合は番号を追加
-            counter = 1
-            while output_path.exists():
-                output_path = output_dir / f"{base_name}_変換結果_{counter}.xlsx"
-                counter += 1
-            
-            wb.save(str(output_path))
-            return str(output_path)
-            
-        except Exception as e:
-            raise Exception(f"Excel生成エラー: {str(e)}")
+            changed = False
+            for kind, job_id, data in self.events.drain():
+                if kind == 'call':
+                    self.after_idle(data['function'])  # ダイアログなど、メインスレッドで実行する処理
+                    continue
+                item = self.jobs.get(job_id)
+                if item is None:
+                    continue
+                if kind == 'progress':
+                    item.set_progress(data['value'], data['text'])
+                else:
+                    self.finish_job(kind, item, data)
+                changed = True
+            now = time.monotonic()
+            for item in self.jobs.values():
+                item.tick(now)
+            if changed:
+                self.update_overall_progress()
+        finally:
+            self.after(UI_POLL_INTERVAL_MS, self.poll_events)
+    
+    def update_overall_progress(self):
+        """全体の進行状況を表示（変換中のジョブが1件ならその状況、複数なら平均）"""
+        active = [item for item in self.jobs.values() if item.active]
+        if not active:
+            return
+        if len(active) == 1:
+            value, status_text = active[0].value, active[0].status_text
+        else:
+            value = sum(item.value for item in active) / len(active)
+            status_text = f"{len(active)}件を変換中..."
+        self.progress_bar.set(value)
+        self.status_label.configure(text=status_text)
+    
+    def finish_job(self, kind, item, data):
+        """ジョブが終わったときの表示（変換中のジョブがなくなったら結果をダイアログで知らせる）"""
+        item.finish(kind, data['text'])
+        self.finished_jobs.append((kind, item, data))
+        if any(other.active for other in self.jobs.values()):
+            return
+        finished, self.finished_jobs = self.finished_jobs, []
+        
+        if len(finished) == 1:
+            if kind == 'done':
+                self.progress_bar.set(1.0)
+                self.status_label.configure(text=f"完了しました！（{data['summary']}）")
+                self.after_idle(lambda: self.show_completion(data['output'], data['summary']))
+            elif kind == 'failed':
+                self.progress_bar.set(0)
+                self.status_label.configure(text="エラーが発生しました")
+                error_msg = f"エラーが発生しました:\n{data['text']}"
+                self.after_idle(lambda: messagebox.showerror("エラー", error_msg))
+            else:
+                self.progress_bar.set(0)
+                self.status_label.configure(text="中止しました")
+            return
+        
+        counts = {state: sum(1 for finished_kind, _item, _data in finished if finished_kind == state)
+                  for state in ('done', 'failed', 'cancelled')}
+        result = f"成功 {counts['done']}件 / 失敗 {counts['failed']}件 / 中止 {counts['cancelled']}件"
+        details = "\n".join(f"{os.path.basename(finished_item.job.source_path)}: {finished_data['text']}"
+                            for _kind, finished_item, finished_data in finished)
+        self.progress_bar.set(1.0)
+        self.status_label.configure(text=f"{len(finished)}件の変換が終わりました（{result}）")
+        self.after_idle(lambda: messagebox.showinfo("変換完了", f"{result}\n\n{details}"))
     
-    def update_progress(self, value, status_text):
-        """進行状況を更新"""
-        self.after(0, lambda: self.progress_bar.set(value))
-        self.after(0, lambda: self.status_label.configure(text=status_text))
+    def confirm_duplicate(self, match):
+        """類似画像の解析結果を再利用するか確認（変換スレッドから呼び出し、回答を待つ）"""
+        answer = {}
+        answered = threading.Event()
+        
+        def ask():
+            answer['reuse'] = messagebox.askyesno(
+                "類似画像",
+                f"以前に変換した画像とほぼ同じ内容です。\n\n{match['source']}\n（類似度 {match['similarity']:.0%}）\n\n"
+                f"以前の解析結果を再利用しますか？\n（「いいえ」を選ぶと改めて解析します）"
+            )
+            answered.set()
+        
+        self.events.post('call', function=ask)
+        answered.wait()
+        return answer['reuse']
     
-    def show_completion(self, excel_path):
+    def show_completion(self, excel_path, summary=None):
         """完了ダイアログを表示"""
+        details = f"\n\n処理内容:\n{summary}" if summary else ""
         result = messagebox.showinfo(
             "変換完了",
-            f"Excelファイルを作成しました！\n\n保存先:\n{excel_path}\n\nフォルダを開きますか？"
+            f"{'Excelファイル' if excel_path.endswith('.xlsx') else 'ファイル'}を作成しました！\n\n"
+            f"保存先:\n{excel_path}{details}\n\nフォルダを開きますか？"
         )
         
         # フォルダを開く
@@ -745,12 +5400,437 @@ class SettingsDialog(ctk.CTkToplevel):
         self.destroy()
 
 
-def main():
+def collect_input_files(inputs):
+    """ディレクトリ・globパターン・ファイル指定から変換対象ファイルを列挙"""
+    files = []
+    seen = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            candidates = [os.path.join(item, name) for name in sorted(os.listdir(item))]
+        else:
+            candidates = sorted(glob.glob(item)) or [item]
+        
+        for path in candidates:
+            if not os.path.isfile(path) or not path.lower().endswith(SUPPORTED_EXTENSIONS):
+                continue
+            key = os.path.abspath(path)
+            if key not in seen:
+                seen.add(key)
+                files.append(path)
+    return files
+
+
+def create_jobs(files, pages=1, job_store=None, resume=False):
+    """ファイルの ConversionJob のリストを作成
+    
+    job_store を渡すとジョブストアに登録し、段階ごとの結果を保存します。resume が True なら
+    ジョブストアに残っている未完了のジョブ（前回終了・クラッシュしたもの）を先頭に加えます。
+    """
+    jobs = []
+    job_ids = set()
+    
+    def add(source_path, job_pages, job_id=None):
+        job = ConversionJob(source_path, job_pages)
+        if job_id is not None:
+            job.checkpoint = job_store.checkpoint(job_id)
+            job_ids.add(job_id)
+        jobs.append(job)
+    
+    if resume and job_store is not None:
+        for record in job_store.pending():
+            if os.path.exists(record['source']):
+                add(record['source'], record['pages'], record['id'])
+            else:
+                job_store.update(record['id'], stage='failed', error="ファイルが見つかりません")
+    
+    for path in files:
+        if job_store is None:
+            add(path, pages)
+            continue
+        job_id = job_store.enqueue(path, pages)
+        if job_id not in job_ids:
+            add(path, pages, job_id)
+    return jobs
+
+
+async def convert_job(engine, job, executor=None):
+    """ConversionJob を変換し、結果（source, ok, output, error, elapsed, metrics, cancelled）を返す"""
+    started = time.perf_counter()
+    job.metrics = ConversionMetrics(job.source_path, engine.model)
+    try:
+        if job.cancelled:
+            raise ExtractionCancelled("解析を中止しました")
+        output = await engine.convert_async(job, executor=executor)
+        result = {'source': job.source_path, 'ok': True, 'output': output, 'error': None}
+    except Exception as e:
+        result = {'source': job.source_path, 'ok': False, 'output': None, 'error': str(e)}
+    result.update(elapsed=time.perf_counter() - started, metrics=job.metrics, cancelled=job.cancelled)
+    return result
+
+
+async def run_batch_async(engine, jobs, max_workers=DEFAULT_BATCH_WORKERS, on_result=None):
+    """ConversionJob のリストを並列変換し、結果のサマリーを返す
+    
+    同時に変換するファイル数は max_workers まで、API呼び出しはエンジンのレート制限に従います。
+    """
+    semaphore = asyncio.Semaphore(max(1, max_workers))
+    results = []
+    started = time.perf_counter()
+    # 最初のファイルの画像を用意している間に、APIサーバーへの接続を開いておく
+    prewarm = asyncio.create_task(engine.prewarm_async())
+    
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        async def convert_one(job):
+            async with semaphore:
+                result = await convert_job(engine, job, executor)
+            results.append(result)
+            if on_result:
+                on_result(result)
+        
+        await asyncio.gather(*(convert_one(job) for job in jobs))
+    await prewarm
+    elapsed = time.perf_counter() - started
+    
+    succeeded = sum(1 for r in results if r['ok'])
+    return {
+        'results': results,
+        'total': len(results),
+        'succeeded': succeeded,
+        'failed': len(results) - succeeded,
+        'elapsed': elapsed,
+        'files_per_minute': len(results) / elapsed * 60 if elapsed > 0 else 0.0,
+        'input_tokens': sum(r['metrics'].counters['input_tokens'] for r in results),
+        'output_tokens': sum(r['metrics'].counters['output_tokens'] for r in results),
+        'retries': sum(r['metrics'].counters['retries'] for r in results),
+        'duplicate_hits': sum(r['metrics'].counters['duplicate_hits'] for r in results),
+        'connections_opened': sum(r['metrics'].counters['connections_opened'] for r in results),
+        'connections_reused': sum(r['metrics'].counters['connections_reused'] for r in results),
+        'throttled_seconds': engine.rate_limiter.throttled_seconds,
+    }
+
+
+def parse_args(argv=None):
+    """コマンドライン引数を解析"""
+    parser = argparse.ArgumentParser(
+        description=f"{APP_TITLE}（引数なしで起動するとGUIを表示します）"
+    )
+    parser.add_argument('inputs', nargs='*',
+                        help="変換する画像/PDF、ディレクトリ、またはglobパターン（例: 'scans/*.pdf'）")
+    parser.add_argument('-w', '--workers', type=int, default=DEFAULT_BATCH_WORKERS,
+                        help=f"同時に処理するファイル数（既定: {DEFAULT_BATCH_WORKERS}）")
+    parser.add_argument('-o', '--output-dir',
+                        help="Excelファイルの出力先（既定: 元ファイルと同じディレクトリ）")
+    parser.add_argument('-f', '--format', dest='output_format', choices=tuple(EXPORTERS),
+                        help="出力形式（xlsx: 書式付きExcel、xlsx_stream: 高速・省メモリのExcel、csv / jsonl / parquet、"
+                             f"既定: config.json の output_format または {DEFAULT_OUTPUT_FORMAT}）")
+    parser.add_argument('--consolidate', metavar='XLSX',
+                        help="変換結果を別々のファイルにせず、1つの統合ブック XLSX に追記する"
+                             "（既定: config.json の consolidated_workbook）")
+    parser.add_argument('--consolidate-layout', choices=CONSOLIDATED_LAYOUTS,
+                        help="統合ブックの形式（sheets: 元ファイルごとに1シート、"
+                             "master: 一覧シートに元ファイル名・変換日時付きで行を追記、既定: sheets）")
+    parser.add_argument('-p', '--pages', default="1",
+                        help="PDFの変換対象ページ（例: 3 / 1-5,8 / all、既定: 1）")
+    parser.add_argument('--model',
+                        help=f"使用するClaudeモデル（既定: {DEFAULT_MODEL}）")
+    parser.add_argument('--tiling', choices=('auto', 'on', 'off'),
+                        help="大きな表を行ごとに分割して並列に解析するか（既定: auto）")
+    parser.add_argument('--response-schema', choices=tuple(RESPONSE_SCHEMA_PROMPTS),
+                        help="応答の形式（compact: 行を値の配列で出力、objects: 列名付きのオブジェクトで出力、"
+                             f"既定: {DEFAULT_RESPONSE_SCHEMA}）")
+    parser.add_argument('--resume', action='store_true',
+                        help="前回終了・クラッシュで中断した変換（ジョブストアの未完了のジョブ）を続きから再開する")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="解析結果キャッシュを使わずに必ずAPIを呼び出す")
+    parser.add_argument('--duplicates', choices=('ask', 'auto', 'off'),
+                        help="解析済みの類似画像の結果を再利用するか（auto: 自動で再利用、ask: 検出の表示のみ、"
+                             "既定: config.json の duplicate_detection）")
+    replay = parser.add_argument_group("APIのやり取りの記録・再生（オフラインでの負荷試験・再現用）")
+    replay.add_argument('--record', metavar='DIR',
+                        help=f"APIのやり取りを DIR に記録する（例: {RECORDINGS_DIR}、--no-cache と併用）")
+    replay.add_argument('--replay', metavar='DIR',
+                        help="APIを呼ばずに DIR の記録を返す")
+    replay.add_argument('--replay-latency', type=float, metavar='SEC',
+                        help="再生時の応答時間（秒、既定: 記録時の応答時間）")
+    replay.add_argument('--replay-latency-scale', type=float, default=1.0, metavar='X',
+                        help="記録時の応答時間に掛ける倍率（既定: 1.0）")
+    replay.add_argument('--replay-error-rate', type=float, default=0.0, metavar='RATE',
+                        help="429/529エラーを返す割合（0〜1、既定: 0）")
+    replay.add_argument('--replay-seed', type=int, default=0,
+                        help="待ち時間・エラーを決める乱数のシード（既定: 0）")
+    replay.add_argument('--replay-any', action='store_true',
+                        help="記録のないリクエストにも記録済みのいずれかのレスポンスを返す")
+    bulk = parser.add_argument_group("一括（夜間）モード（Message Batches API でまとめて送信し、終わったら結果を取り込む）")
+    bulk.add_argument('--bulk', action='store_true',
+                      help="ファイルをまとめて1つのバッチで送信し、終わるまで待ってExcelを書き出す")
+    bulk.add_argument('--bulk-no-wait', action='store_true',
+                      help="--bulk で送信したら待たずに終了する（結果は --bulk-resume で取り込む）")
+    bulk.add_argument('--bulk-resume', action='store_true',
+                      help=f"送信済みで結果を取り込んでいないバッチ（{BULK_JOBS_DIR}/）の続きから再開する")
+    watch = parser.add_argument_group("フォルダ監視（置かれたスキャンを自動で変換する）")
+    watch.add_argument('--watch', nargs='*', metavar='DIR',
+                       help="DIR を監視し、置かれた画像/PDFを自動で変換する（複数指定可、"
+                            "省略すると config.json の watch_dirs、出力先は -o または watch_output_dir）")
+    watch.add_argument('--watch-settle', type=float, metavar='SEC',
+                       help=f"サイズが変わらなくなってから変換を始めるまでの秒数（既定: {WATCH_SETTLE_SECONDS:g}）")
+    watch.add_argument('--watch-recursive', action='store_true',
+                       help="サブフォルダも監視する")
+    parser.add_argument('--metrics-summary', action='store_true',
+                        help="計測ログ（metrics/metrics.jsonl）を月ごとに集計して表示する")
+    parser.add_argument('--measure-startup', action='store_true',
+                        help="GUIを起動して初回描画までの時間を表示し、すぐに終了する（目標超過時は終了コード1）")
+    return parser.parse_args(argv)
+
+
+async def watch_async(engine, directories, max_workers=DEFAULT_BATCH_WORKERS, pages=1, job_store=None,
+                      on_result=None, **watch_options):
+    """フォルダを監視し、書き込みが終わったファイルから順に変換する（キャンセルされるまで続ける）
+    
+    同時に変換するファイル数は max_workers まで、API呼び出しはエンジンのレート制限に従います。
+    job_store を渡すと、同じ内容のファイルを変換済みなら変換せず、途中の段階をジョブストアに保存します
+    （監視を始めたときにあったファイルも、変換済みでなければ変換します）。
+    watch_options は FolderWatcher に渡します。
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    watcher = FolderWatcher(directories, lambda path: loop.call_soon_threadsafe(queue.put_nowait, path),
+                            skip_existing=job_store is None, **watch_options)
+    
+    def prepare(path):
+        if job_store is not None and job_store.is_done(path, pages):
+            print(f"変換済みのためスキップします: {path}")
+            return []
+        return create_jobs([path], pages, job_store)
+    
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        async def worker():
+            while True:
+                path = await queue.get()
+                try:
+                    for job in await loop.run_in_executor(executor, prepare, path):
+                        result = await convert_job(engine, job, executor)
+                        if on_result:
+                            on_result(result)
+                except Exception as e:
+                    print(f"変換の準備に失敗しました（{path}）: {e}")
+                finally:
+                    queue.task_done()
+        
+        workers = [asyncio.create_task(worker()) for _ in range(max(1, max_workers))]
+        watcher.start()
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            watcher.stop()
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+
+def cli_api_key(args, config):
+    """コマンドラインで使うAPIキー（環境変数 → config.json、再生時はなくてもよい）"""
+    api_key = os.environ.get('ANTHROPIC_API_KEY') or config.get('claude_api_key', '')
+    if args.replay:
+        api_key = api_key or "replay"  # 再生時はAPIを呼ばない
+    if not api_key:
+        print("Claude APIキーが設定されていません（config.json または ANTHROPIC_API_KEY）", file=sys.stderr)
+    return api_key
+
+
+def create_cli_engine(args, config, api_key, output_dir=None):
+    """コマンドライン引数と設定から（変換エンジン, キャッシュ, 再生用クライアント）を作成"""
+    cache = ExtractionCache.from_config(config, enabled=False if args.no_cache else None)
+    replay_clients = {}
+    if args.replay:
+        store = InteractionStore(args.replay)
+        options = dict(latency=args.replay_latency, latency_scale=args.replay_latency_scale,
+                       error_rate=args.replay_error_rate, seed=args.replay_seed,
+                       on_miss="any" if args.replay_any else "error")
+        replay_clients = {'client': ReplayClient(store, **options), 'async_client': AsyncReplayClient(store, **options)}
+        print(f"記録を再生します: {args.replay}（{len(store.fingerprints())}件）")
+    consolidated = ConsolidatedWorkbook.from_config({
+        'consolidated_workbook': args.consolidate or config.get('consolidated_workbook'),
+        'consolidated_layout': args.consolidate_layout or config.get('consolidated_layout', DEFAULT_CONSOLIDATED_LAYOUT),
+    })
+    engine = ConversionEngine.from_config(api_key, config, model=args.model, output_dir=output_dir or args.output_dir,
+                                          cache=cache, tiling=args.tiling, duplicate_mode=args.duplicates,
+                                          response_schema=args.response_schema, consolidated=consolidated,
+                                          output_format=args.output_format,
+                                          recorder=InteractionStore(args.record) if args.record else None,
+                                          **replay_clients)
+    return engine, cache, replay_clients
+
+
+def report_result(result):
+    """1ファイルの変換結果を表示"""
+    if result['ok']:
+        print(f"[成功] {result['source']} -> {result['output']} ({result['metrics'].summary()})")
+    else:
+        print(f"[失敗] {result['source']}: {result['error']}")
+
+
+def batch_main(args):
+    """一括変換（ヘッドレス）のエントリーポイント"""
+    config = load_config()
+    api_key = cli_api_key(args, config)
+    if not api_key:
+        return 2
+    
+    files = collect_input_files(args.inputs)
+    if not files and not args.bulk_resume and not args.resume:
+        print("変換対象のファイルが見つかりません", file=sys.stderr)
+        return 2
+    
+    engine, cache, replay_clients = create_cli_engine(args, config, api_key)
+    report = report_result
+    
+    if args.bulk or args.bulk_resume:
+        return bulk_main(args, engine, config, files, report)
+    
+    job_store = JobStore.from_config(config)
+    if args.resume:
+        if job_store is None:
+            print("ジョブストアが無効なため再開できません（config.json の job_store_enabled）", file=sys.stderr)
+            return 2
+        print(f"中断したジョブ{len(job_store.pending())}件を再開します")
+    jobs = create_jobs(files, args.pages, job_store, resume=args.resume)
+    print(f"{len(jobs)}件のファイルを変換します（ワーカー数: {args.workers}）")
+    summary = asyncio.run(run_batch_async(engine, jobs, max_workers=args.workers, on_result=report))
+    
+    print(
+        f"完了: 成功 {summary['succeeded']}件 / 失敗 {summary['failed']}件 / "
+        f"{summary['elapsed']:.1f}秒（{summary['files_per_minute']:.1f}件/分）"
+    )
+    print(f"トークン: 入力 {summary['input_tokens']:,} / 出力 {summary['output_tokens']:,} / "
+          f"再試行 {summary['retries']}回 / レート制限による待機 {summary['throttled_seconds']:.1f}秒")
+    if cache.enabled:
+        stats = cache.stats()
+        print(f"キャッシュ: ヒット {stats['hits']}件 / ミス {stats['misses']}件")
+    if summary['duplicate_hits']:
+        print(f"類似画像: {summary['duplicate_hits']}件で以前の解析結果を再利用")
+    if summary['connections_opened'] or summary['connections_reused']:
+        print(f"接続: 新規 {summary['connections_opened']}回 / 再利用 {summary['connections_reused']}回"
+              f"（事前接続 {engine.client_pool.stats()['prewarmed']}回）")
+    if replay_clients:
+        stats = replay_clients['async_client'].stats
+        print(f"再生: リクエスト {stats['requests']}件 / 模擬エラー {stats['errors']}件 / 記録なし {stats['misses']}件")
+    return 0 if summary['failed'] == 0 else 1
+
+
+def watch_main(args):
+    """フォルダ監視（ヘッドレス）のエントリーポイント（Ctrl+C で終了）"""
+    config = load_config()
+    api_key = cli_api_key(args, config)
+    if not api_key:
+        return 2
+    directories = args.watch or config.get('watch_dirs', [])
+    if not directories:
+        print("監視するフォルダを指定してください（--watch DIR または config.json の watch_dirs）", file=sys.stderr)
+        return 2
+    
+    engine, _, _ = create_cli_engine(args, config, api_key,
+                                     output_dir=args.output_dir or config.get('watch_output_dir'))
+    print(f"フォルダの監視を開始します: {', '.join(directories)}"
+          f"（出力先: {engine.output_dir or '元ファイルと同じフォルダ'}、ワーカー数: {args.workers}）")
+    
+    def report(result):
+        print(f"{time.strftime('%H:%M:%S')} ", end="")
+        report_result(result)
+    
+    try:
+        asyncio.run(watch_async(
+            engine, directories, args.workers, args.pages, JobStore.from_config(config), report,
+            settle_seconds=args.watch_settle or config.get('watch_settle_seconds', WATCH_SETTLE_SECONDS),
+            poll_interval=config.get('watch_poll_seconds', WATCH_POLL_INTERVAL),
+            recursive=args.watch_recursive or config.get('watch_recursive', False),
+        ))
+    except KeyboardInterrupt:
+        print("フォルダの監視を終了しました")
+    except Exception as e:
+        print(f"フォルダの監視エラー: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def bulk_main(args, engine, config, files, report):
+    """一括（夜間）モードのエントリーポイント（送信・待機・再開）"""
+    bulk = BulkConverter.from_config(engine, config)
+    results = []
+    
+    def on_result(result):
+        results.append(result)
+        report(result)
+    
+    started = time.perf_counter()
+    try:
+        jobs = bulk.pending_jobs() if args.bulk_resume else []
+        if jobs:
+            print(f"送信済みのバッチ{len(jobs)}件の続きから再開します")
+        if files:
+            print(f"{len(files)}件のファイルをバッチで送信します")
+            submitted = bulk.submit(files, args.pages, on_result)
+            if args.bulk_no_wait:
+                print(f"バッチ{len(submitted)}件を送信しました（結果は --bulk-resume で取り込めます）")
+                submitted = []
+            jobs += submitted
+        for job in jobs:
+            bulk.wait(job, on_result)
+    except KeyboardInterrupt:
+        print("待機を中断しました（--bulk-resume で続きから再開できます）", file=sys.stderr)
+        return 130
+    
+    if not results:
+        return 0
+    failed = sum(1 for r in results if not r['ok'])
+    print(f"完了: 成功 {len(results) - failed}件 / 失敗 {failed}件 / {time.perf_counter() - started:.1f}秒")
+    print(f"トークン: 入力 {sum(r['metrics'].counters['input_tokens'] for r in results):,} / "
+          f"出力 {sum(r['metrics'].counters['output_tokens'] for r in results):,}")
+    return 0 if failed == 0 else 1
+
+
+def print_metrics_summary(config):
+    """計測ログを月ごとに集計して表示"""
+    months = MetricsLog(config.get('metrics_file', METRICS_FILE)).monthly_summary()
+    if not months:
+        print("計測ログがありません")
+        return 0
+    
+    print(f"{'月':<9}{'形式':<9}{'件数':>6}{'失敗':>6}{'平均時間':>10}{'平均API':>10}"
+          f"{'入力トークン':>14}{'出力トークン':>14}{'行数':>9}{'出力/行':>9}")
+    for (month, schema), m in sorted(months.items()):
+        count = m['conversions']
+        per_row = m['output_tokens'] / m['rows'] if m['rows'] else 0.0
+        print(f"{month:<9}{schema:<9}{count:>6}{m['errors']:>6}{m['total_seconds'] / count:>9.1f}s"
+              f"{m['api_seconds'] / count:>9.1f}s{m['input_tokens']:>14,}{m['output_tokens']:>14,}{m['rows']:>9,}"
+              f"{per_row:>9.1f}")
+    return 0
+
+
+def main(argv=None):
     """メイン関数"""
+    args = parse_args(argv)
+    if args.metrics_summary:
+        return print_metrics_summary(load_config())
+    if args.watch is not None:
+        return watch_main(args)
+    if args.inputs or args.bulk_resume or args.resume:
+        return batch_main(args)
+    
     app = CleaningScheduleApp()
+    app.exit_after_first_paint = args.measure_startup
     app.mainloop()
+    
+    if args.measure_startup:
+        budget_ms = app.settings.get('startup_budget_ms', STARTUP_BUDGET_MS)
+        return 0 if startup_timings.get('first_paint', 0) * 1000 <= budget_ms else 1
+    return 0
 
 
-if __name__ == "__main__":
-    main()
+# ここまでの定義（モジュールの読み込み）にかかった時間
+startup_timings['module_import'] = time.perf_counter() - _MODULE_START
 
+
+if __name__ == "__main__":
+    # PyInstaller でビルドした実行ファイルでプロセスプールを使うために必要
+    multiprocessing.freeze_support()
+    sys.exit(main())